@@ -0,0 +1,193 @@
+'''
+Sparse decode tests
+
+Check the numpy run expansion of sparse grids against the cell by cell
+loop it replaced.  Grids are made with runs wrapping into the next row,
+flag values and rows of nothing but background, then written as sparse
+files and read back, or expanded straight from the run arrays.
+
+Run from the top folder with: python -m unittest discover tests
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import os, sys, shutil, tempfile, unittest
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Imports from my library
+from w2py import log
+from w2py.datatype import datatype
+from w2py.datatype import sparselatlongrid
+from w2py.datatype.latlongrid import LatLonGrid
+from w2py.netcdf import netcdf_util
+from w2py.netcdf import netcdf_writer
+
+# Keep the decoders quiet
+log.info = lambda *args, **kwargs: None
+
+def loopDecode(shape, background, values, x, y, counts):
+    """ The old cell by cell expansion of readSparseArray2Dfloat, over
+        arrays instead of a reader """
+    rows, cols = shape
+    M = numpy.empty((rows, cols), float)
+    for r in range(0, rows):
+        for c in range(0, cols):
+            M[r, c] = background
+    for i in range(0, len(values)):
+        value = float(values[i])
+        r = int(x[i])
+        c = int(y[i])
+        count = int(counts[i])
+        if value > datatype.missingData:
+            M[r, c] = value
+        for j in range(1, count, 1):
+            c += 1
+            if c == cols:
+                r += 1   # new row
+                c = 0
+            if value > datatype.missingData:
+                M[r, c] = value
+    return M
+
+def makeGrid(rows, cols, seed):
+    """ Make a grid of blobs of repeated values, some flagged cells and
+        whole rows of missing data """
+    random = numpy.random.RandomState(seed)
+    M = numpy.empty((rows, cols), numpy.float32)
+    M.fill(datatype.missingData)
+    for i in range(12):
+        r, c = random.randint(0, rows), random.randint(0, cols)
+        h, w = random.randint(1, 8), random.randint(1, cols+1)
+        M[r:r+h, c:c+w] = random.choice([5.0, 20.5, 42.0, 67.25])
+    M[random.rand(rows, cols) < 0.05] = datatype.rangeFolded
+    M[random.rand(rows, cols) < 0.02] = datatype.dataUnavailable
+    M[rows//2:rows//2+3] = datatype.missingData
+    return M
+
+class SparseDecodeTest(unittest.TestCase):
+    def expand(self, shape, background, values, x, y, counts):
+        """ Expand runs with expandSparseRuns into a new grid """
+        M = numpy.empty(shape, numpy.float64)
+        M.fill(background)
+        netcdf_util.expandSparseRuns(M, numpy.asarray(values, numpy.float64),
+                                     numpy.asarray(x, numpy.int64),
+                                     numpy.asarray(y, numpy.int64),
+                                     numpy.asarray(counts, numpy.int64))
+        return M
+
+    def checkRuns(self, shape, background, values, x, y, counts):
+        """ Check both decoders make the same grid """
+        expected = loopDecode(shape, background, values, x, y, counts)
+        M = self.expand(shape, background, values, x, y, counts)
+        self.assertTrue(numpy.array_equal(M, expected))
+
+    def testWrappingRuns(self):
+        # Runs going on into the next row, one over two rows, one to the
+        # very last cell
+        self.checkRuns((4, 5), datatype.missingData,
+                       [10.0, 20.0, 30.0, 40.0], [0, 1, 2, 3], [3, 4, 0, 2],
+                       [4, 7, 1, 3])
+
+    def testFlagsLeaveBackground(self):
+        # Only valid values replace the background, flags don't
+        self.checkRuns((3, 4), 0.0,
+                       [datatype.rangeFolded, 5.0, datatype.missingData, 7.0],
+                       [0, 0, 1, 2], [0, 2, 0, 1], [3, 3, 4, 2])
+
+    def testBackgroundOnly(self):
+        self.checkRuns((3, 4), datatype.missingData, [], [], [], [])
+        self.checkRuns((3, 4), datatype.missingData, [datatype.missingData], [1], [0], [8])
+
+    def testCountOne(self):
+        # Files without pixel_count read every run as one cell
+        self.checkRuns((2, 3), datatype.missingData, [1.0, 2.0, 3.0], [0, 1, 1],
+                       [2, 0, 2], [1, 1, 1])
+
+    def testBlocks(self):
+        # Runs expanded a few cells at a time, blocks ending inside a run,
+        # on a run end and with a run bigger than a block
+        expandCells = netcdf_util.expandCells
+        try:
+            for cells in [1, 2, 3, 5]:
+                netcdf_util.expandCells = cells
+                self.checkRuns((4, 5), datatype.missingData,
+                               [10.0, 20.0, datatype.rangeFolded, 30.0, 40.0],
+                               [0, 1, 1, 2, 3], [3, 4, 1, 0, 2], [4, 7, 2, 1, 3])
+        finally:
+            netcdf_util.expandCells = expandCells
+
+    def testRunIndices(self):
+        starts = numpy.array([3, 9, 14], numpy.int64)
+        counts = numpy.array([4, 2, 1], numpy.int64)
+        index = sparselatlongrid.runIndices(starts, counts)
+        self.assertEqual(list(index), [3, 4, 5, 6, 9, 10, 14])
+        self.assertEqual(len(sparselatlongrid.runIndices(starts[:0], counts[:0])), 0)
+
+    def testCountBelowOne(self):
+        # The loop always set the first cell of a run, a count of 0 or less
+        # still does
+        self.checkRuns((2, 3), datatype.missingData, [1.0, 2.0], [0, 1], [1, 2], [0, -3])
+
+    def testRunOffTheEnd(self):
+        # The loop raised an IndexError, the cells past the end are dropped
+        shape, values, x, y, counts = (2, 3), [1.0, 2.0], [0, 1], [0, 1], [2, 6]
+        self.assertRaises(IndexError, loopDecode, shape, datatype.missingData,
+                          values, x, y, counts)
+        M = self.expand(shape, datatype.missingData, values, x, y, counts)
+        expected = numpy.array([[1.0, 1.0, datatype.missingData],
+                                [datatype.missingData, 2.0, 2.0]])
+        self.assertTrue(numpy.array_equal(M, expected))
+
+    def testSparseLatLonGrid(self):
+        # The runs a SparseLatLonGrid keeps make the same dense grid
+        shape = (4, 5)
+        values, x, y, counts = [10.0, datatype.rangeFolded, 30.0, 40.0], [0, 1, 2, 3], \
+                               [3, 4, 0, 2], [4, 7, 0, 3]
+        llg = sparselatlongrid.SparseLatLonGrid(numpy.array(values, numpy.float32),
+                                                numpy.array(x), numpy.array(y),
+                                                numpy.array(counts), datatype.missingData,
+                                                35.0, -100.0, 0.01, 0.01, shape)
+        expected = loopDecode(shape, datatype.missingData, values, x, y, counts)
+        self.assertTrue(numpy.array_equal(llg.getValues(), expected))
+
+@unittest.skipIf(netcdf_writer.netcdf_file is None, "Writing netcdf files needs scipy")
+class SparseFileTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, True)
+
+    def checkFile(self, M, name):
+        """ Write M as a sparse file, then check the dense read of it
+            against the loop over the file's own runs """
+        from w2py.netcdf import scipy_netcdf_reader
+        llg = LatLonGrid(M, 40.0, -100.0, 0.01, 0.01)
+        llg.setTypeName("Reflectivity")
+        llg.setEpochTime(1427921232.0)
+        filename = netcdf_writer.writeNetcdfFile(llg, os.path.join(self.folder, name), True)
+
+        reader = scipy_netcdf_reader.scipyNetcdfReader(filename)
+        values, x, y, counts = netcdf_util.readSparseRuns(reader, "Reflectivity", None)
+        self.assertTrue((counts > 1).any())
+        expected = loopDecode(M.shape, datatype.missingData, values, x, y, counts)
+        D = netcdf_util.readNetcdfFile(reader)
+        self.assertTrue(D.isSparse())
+        self.assertTrue(numpy.array_equal(D.getValues(), expected))
+
+        # The flags are left out of the dense grid, everything else is kept
+        valid = M > datatype.missingData
+        self.assertTrue(numpy.array_equal(D.getValues()[valid], M[valid]))
+        self.assertTrue((D.getValues()[~valid] == datatype.missingData).all())
+
+    def testFile(self):
+        self.checkFile(makeGrid(60, 70, 1), "grid.netcdf")
+
+    def testCompressedFile(self):
+        self.checkFile(makeGrid(45, 90, 2), "grid.netcdf.gz")
+
+if __name__ == "__main__":
+    unittest.main()
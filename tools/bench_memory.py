@@ -0,0 +1,103 @@
+'''
+Memory benchmark
+
+Report the peak memory of decoding a CONUS sized LatLonGrid as float64 and
+as float32.  A synthetic grid of storms over missing data is written once
+as a dense file and as a gzipped sparse one, then each file is read in
+each type by a fresh python, since peak memory only ever goes up within
+a process.  Needs scipy for writing the files, and the resource module,
+so not on Windows.
+
+Run from the top folder: python tools/bench_memory.py [rows cols]
+The default is the 3500 by 7000 cells of a 0.01 degree CONUS grid.
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import os, sys, time, shutil, tempfile, subprocess
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Imports from my library
+from w2py import log
+from w2py.datatype import datatype
+from w2py.datatype.latlongrid import LatLonGrid
+
+dtypes = {"float64":numpy.float64, "float32":numpy.float32}
+
+def getPeakMB():
+    """ Get the peak resident memory of this process in MB.  Linux gives
+        kilobytes, OS X bytes """
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak /= 1024
+    return peak/1024.0
+
+def makeGrid(rows, cols, seed=0):
+    """ Make a grid of storms over missing data.  Each storm is rings of
+        5 dBZ steps around its core, so the sparse file has runs like real
+        reflectivity, plus some range folded speckle """
+    random = numpy.random.RandomState(seed)
+    M = numpy.empty((rows, cols), numpy.float32)
+    M.fill(datatype.missingData)
+    for i in range(400):
+        r, c = random.randint(0, rows), random.randint(0, cols)
+        size = random.randint(10, max(11, rows//15))
+        r0, r1, c0, c1 = max(r-size, 0), min(r+size, rows), max(c-2*size, 0), min(c+2*size, cols)
+        y, x = numpy.ogrid[r0-r:r1-r, c0-c:c1-c]
+        distance = numpy.sqrt((y/float(size))**2+(x/(2.0*size))**2)
+        storm = numpy.where(distance < 1, 5*numpy.ceil(14*(1-distance)), datatype.missingData)
+        block = M[r0:r1, c0:c1]
+        numpy.maximum(block, storm.astype(numpy.float32), block)
+    M[random.rand(rows, cols) < 0.001] = datatype.rangeFolded
+    return M
+
+def writeFiles(folder, rows, cols):
+    """ Write the dense and sparse benchmark files, returns their names """
+    from w2py.netcdf import netcdf_writer
+    llg = LatLonGrid(makeGrid(rows, cols), 55.0, -130.0, 0.01, 0.01)
+    llg.setTypeName("MergedReflectivityQC")
+    llg.setEpochTime(1427921232.0)
+    dense = netcdf_writer.writeNetcdfFile(llg, os.path.join(folder, "dense.netcdf"), False)
+    sparse = netcdf_writer.writeNetcdfFile(llg, os.path.join(folder, "sparse.netcdf.gz"), True)
+    return [dense, sparse]
+
+def decode(filename, dtype):
+    """ Read a file in a type and print the seconds and peak memory, run in
+        a fresh python by main """
+    from w2py import w2
+    start = getPeakMB()
+    t = time.time()
+    D = w2.readDataFile(filename, "SCIPY", False, dtypes[dtype])
+    D.getValues()
+    print("{0:<18} {1:<8} {2:7.2f}s {3:8.0f} MB {4:8.0f} MB".format(
+          os.path.basename(filename), dtype, time.time()-t, getPeakMB()-start, getPeakMB()))
+
+def main(rows, cols):
+    folder = tempfile.mkdtemp(prefix="w2bench")
+    try:
+        log.info("Writing a {0} by {1} grid to {2}".format(rows, cols, folder))
+        files = writeFiles(folder, rows, cols)
+        for f in files:
+            log.info("{0} is {1:.1f} MB".format(os.path.basename(f), os.path.getsize(f)/1024.0**2))
+        print("{0:<18} {1:<8} {2:>8} {3:>11} {4:>11}".format("file", "type", "decode",
+                                                             "added", "peak"))
+        for f in files:
+            for dtype in sorted(dtypes, reverse=True):
+                sys.stdout.flush()
+                subprocess.check_call([sys.executable, os.path.abspath(__file__),
+                                       "--decode", f, dtype])
+    finally:
+        shutil.rmtree(folder, True)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--decode":
+        log.info = lambda *args, **kwargs: None
+        decode(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 3:
+        main(int(sys.argv[1]), int(sys.argv[2]))
+    else:
+        main(3500, 7000)
@@ -0,0 +1,195 @@
+'''
+Accumulation
+
+Fold a time ordered stream of LatLonGrids into running max, min, sum or
+count grids, for products like hail swaths, rotation tracks and rainfall
+totals.  The running grids are updated in place a block of rows at a time,
+so only the grid being added is held besides them, no matter how many
+files there are.  Only valid values count.  Where a cell never had one the
+max and min keep the highest flag value seen, the sum is missing and the
+count is zero.
+
+A sliding window, like the last 60 minutes, splits the window into panes
+of equal time, each with its own running grids.  A new file only goes into
+its pane, panes that fall out of the window are dropped, and the output
+combines the panes left.  So nothing is read again, the memory is set by
+the pane count, and the window edge moves a pane at a time.
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import datetime
+from collections import OrderedDict
+import numpy
+
+# Imports from my library
+import log
+import w2py.mosaic as w2mosaic
+from w2py.datatype import datatype
+from w2py.datatype.latlongrid import LatLonGrid
+
+operations = ["max", "min", "sum", "count"]
+
+def getGridGeometry(grid):
+    """ Get the (lat, lon, dlat, dlon, rows, cols) of a LatLonGrid """
+    lon, lat = grid.getUpperLeft()
+    dlon, dlat = grid.getCellSize()
+    return (lat, lon, dlat, dlon, grid.shape[0], grid.shape[1])
+
+class Accumulator(object):
+    def __init__(self, grid, operation="max"):
+        """ Start running grids.
+            grid: (lat, lon, dlat, dlon, rows, cols) of the output, see
+                  getGridGeometry.  Added grids have to line up with it
+            operation: one of max, min, sum or count
+        """
+        if operation not in operations:
+            raise ValueError("Accumulate operation {0} isn't one of {1}".format(
+                             operation, operations))
+        self.lat, self.lon, self.dlat, self.dlon, rows, cols = grid
+        self.shape = (rows, cols)
+        self.operation = operation
+        self.values = None
+        self.counts = None
+        if operation in ("max", "min"):
+            self.values = numpy.empty(self.shape, numpy.float32)
+            self.values.fill(datatype.dataUnavailable)
+        else:
+            self.counts = numpy.zeros(self.shape, numpy.int32)
+            if operation == "sum":
+                self.values = numpy.zeros(self.shape, numpy.float32)
+        self.typeName = None
+        self.epochTime = None
+        self.count = 0
+
+    def add(self, grid):
+        """ Fold a LatLonGrid into the running grids.  It has to be the
+            same product with the same cell size, lined up with our cells.
+            The part outside our grid is left out """
+        if self.typeName is not None and grid.getTypeName() != self.typeName:
+            raise ValueError("Can't accumulate {0} with {1}".format(grid.getTypeName(),
+                             self.typeName))
+        w2mosaic.checkCellSize(grid, self.dlat, self.dlon)
+        row, col = w2mosaic.getOffset(grid, self.lat, self.lon, self.dlat, self.dlon)
+        if row < 0 or col < 0 or row+grid.shape[0] > self.shape[0] or \
+           col+grid.shape[1] > self.shape[1]:
+            log.info("Clipping {0} to the accumulation grid".format(grid.getFileName()))
+        for rows, cols, v in w2mosaic.getBlocks(grid, self.lat, self.lon, self.dlat,
+                                                self.dlon, self.shape):
+            self.addBlock(rows, cols, v)
+        self.addInfo(grid.getTypeName(), grid.getEpochTime(), 1)
+
+    def merge(self, other):
+        """ Fold in the running grids of another Accumulator with the same
+            grid, operation and product """
+        if None not in (self.typeName, other.typeName) and other.typeName != self.typeName:
+            raise ValueError("Can't accumulate {0} with {1}".format(other.typeName,
+                             self.typeName))
+        for r in range(0, self.shape[0], w2mosaic.blockRows):
+            rows = slice(r, r+w2mosaic.blockRows)
+            cols = slice(0, self.shape[1])
+            if self.operation == "max":
+                numpy.maximum(self.values[rows], other.values[rows], self.values[rows])
+            elif self.operation == "min":
+                self.addBlock(rows, cols, other.values[rows])
+            else:
+                self.counts[rows] += other.counts[rows]
+                if self.operation == "sum":
+                    self.values[rows] += other.values[rows]
+        self.addInfo(other.typeName, other.epochTime, other.count)
+
+    def addBlock(self, rows, cols, v):
+        """ Fold a block of values into the running grids """
+        if self.operation == "max":
+            # Valid values are above all our flags, so plain max works
+            out = self.values[rows, cols]
+            numpy.maximum(out, v, out)
+            return
+        valid = v > datatype.missingData
+        if self.operation == "min":
+            # A valid value replaces a flag or a bigger value, a flag only
+            # replaces a lower flag
+            out = self.values[rows, cols]
+            flagged = out <= datatype.missingData
+            take = (valid & (flagged | (v < out))) | (~valid & flagged & (v > out))
+            out[take] = v[take]
+            return
+        self.counts[rows, cols] += valid
+        if self.operation == "sum":
+            out = self.values[rows, cols]
+            out[valid] += v[valid]
+
+    def addInfo(self, typeName, epochTime, count):
+        """ Keep the type, newest time and count of what was added """
+        if self.typeName is None:
+            self.typeName = typeName
+        if epochTime is not None and (self.epochTime is None or epochTime > self.epochTime):
+            self.epochTime = epochTime
+        self.count += count
+
+    def getGrid(self, suffix=""):
+        """ Get the running grids as a new LatLonGrid.  The type name is the
+            added type with the operation and suffix after it """
+        if self.operation == "count":
+            M = self.counts.astype(numpy.float32)
+        else:
+            M = self.values.copy()
+            if self.operation == "sum":
+                M[self.counts == 0] = datatype.missingData
+
+        llg = LatLonGrid(M, self.lat, self.lon, self.dlat, self.dlon)
+        llg.setTypeName("{0}_{1}{2}".format(self.typeName or "Unknown",
+                                            self.operation.capitalize(), suffix))
+        if self.epochTime is not None:
+            llg.setEpochTime(self.epochTime)
+            llg.setTime(datetime.datetime.fromtimestamp(int(self.epochTime)).strftime(
+                        '%Y-%m-%d %H:%M:%S UTC'))
+        return llg
+
+class SlidingAccumulator(object):
+    def __init__(self, window, operation="max", panes=12):
+        """ Accumulate over a sliding time window.
+            window: length of the window in seconds
+            operation: one of max, min, sum or count
+            panes: number of panes the window is split into.  Memory is
+                   the pane count times the running grids, and the window
+                   covers up to one pane more than its length
+        """
+        self.window = float(window)
+        self.operation = operation
+        self.paneLength = self.window/panes
+        self.panes = OrderedDict()    # pane number -> Accumulator, oldest first
+        self.grid = None
+        self.latest = None
+
+    def add(self, grid):
+        """ Add the next LatLonGrid in time order """
+        t = grid.getEpochTime()
+        if t is None:
+            log.info("Skipping {0}, it has no time".format(grid.getFileName()))
+            return
+        if self.grid is None:
+            self.grid = getGridGeometry(grid)
+        if self.latest is not None and t <= self.latest-self.window:
+            log.info("Skipping {0}, it's older than the window".format(grid.getFileName()))
+            return
+        n = int(t//self.paneLength)
+        if n not in self.panes:
+            self.panes[n] = Accumulator(self.grid, self.operation)
+            self.panes = OrderedDict(sorted(self.panes.items()))
+        self.panes[n].add(grid)
+        if self.latest is None or t > self.latest:
+            self.latest = t
+
+        # Drop panes that are all before the window
+        for n in list(self.panes):
+            if (n+1)*self.paneLength <= self.latest-self.window:
+                del self.panes[n]
+
+    def getGrid(self):
+        """ Get the accumulation over the window as a new LatLonGrid """
+        total = Accumulator(self.grid, self.operation)
+        for pane in self.panes.values():
+            total.merge(pane)
+        return total.getGrid("_{0:g}min".format(self.window/60.0))
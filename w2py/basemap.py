@@ -0,0 +1,141 @@
+'''
+Basemap cache
+
+The map outlines under our images only depend on the grid geometry, and
+every frame of a product has the same extent and cell size.  So we read
+the shapefile once, draw its lines once per geometry, and keep the pixels
+the lines touch.  Rendering a frame is then just setting those pixels.
+
+Drawn line masks are kept in memory with least recently used eviction, and
+can also be saved to a folder so the next run doesn't draw them again.
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import os, hashlib, threading, tempfile
+from collections import OrderedDict
+import numpy
+
+# Imports from my library
+import log
+import w2py.resource as w2res
+import w2py.shapefile as w2shape
+
+# Shapefile segments by filename, read once per process
+shapeSegments = {}
+
+def getShapeSegments(filename):
+    """ Get the line segments of a shapefile, reading it the first time """
+    segments = shapeSegments.get(filename)
+    if segments is None:
+        segments = w2shape.readShapeSegments(filename)
+        shapeSegments[filename] = segments
+        log.info("Read {0} map segments from {1}".format(len(segments), filename))
+    return segments
+
+def rasterizeSegments(segments, lat, lon, dlat, dlon, rows, cols):
+    """ Find the pixels that line segments given in lon/lat touch on an
+        image covering a grid with upper left lat, lon, cell size dlat, dlon
+        and rows x cols cells.  Every segment is sampled about once a pixel,
+        all at the same time.  Returns the sorted flat pixel indices """
+
+    # Into pixel coordinates
+    x0 = (segments[:, 0]-lon)/dlon
+    y0 = (lat-segments[:, 1])/dlat
+    x1 = (segments[:, 2]-lon)/dlon
+    y1 = (lat-segments[:, 3])/dlat
+
+    # Throw out what is completely off the image
+    keep = ~(((x0 < 0) & (x1 < 0)) | ((x0 >= cols) & (x1 >= cols)) |
+             ((y0 < 0) & (y1 < 0)) | ((y0 >= rows) & (y1 >= rows)))
+    x0, y0, x1, y1 = x0[keep], y0[keep], x1[keep], y1[keep]
+    if len(x0) == 0:
+        return numpy.empty(0, numpy.intp)
+
+    # Number of samples of each segment, then one t from 0 to 1 per sample
+    # using the same repeat/cumsum trick as our sparse data expansion
+    counts = (numpy.ceil(numpy.maximum(abs(x1-x0), abs(y1-y0)))).astype(numpy.intp)+1
+    total = int(counts.sum())
+    first = numpy.cumsum(counts)-counts
+    step = numpy.arange(total)-numpy.repeat(first, counts)
+    t = step/numpy.repeat(numpy.maximum(counts-1, 1), counts).astype(float)
+
+    x = numpy.floor(numpy.repeat(x0, counts)+t*numpy.repeat(x1-x0, counts)).astype(numpy.intp)
+    y = numpy.floor(numpy.repeat(y0, counts)+t*numpy.repeat(y1-y0, counts)).astype(numpy.intp)
+    inside = (x >= 0) & (x < cols) & (y >= 0) & (y < rows)
+    return numpy.unique(y[inside]*cols+x[inside])
+
+class BasemapCache(object):
+    def __init__(self, size=8, folder=None, shapeFile=None):
+        """ Cache of drawn map lines per grid geometry.
+            size: how many geometries to keep in memory
+            folder: optional folder to save and load drawn lines
+            shapeFile: the map to draw, our usa.shp by default """
+        self.size = size
+        self.folder = folder
+        if shapeFile is None:
+            shapeFile = w2res.getArcgisFilename("usa.shp")
+        self.shapeFile = shapeFile
+        self.lines = OrderedDict()
+        self.lock = threading.Lock()
+
+    def getKey(self, lat, lon, dlat, dlon, rows, cols):
+        """ Get the cache key for a grid geometry """
+        return (self.shapeFile, repr(float(lat)), repr(float(lon)),
+                repr(float(dlat)), repr(float(dlon)), int(rows), int(cols))
+
+    def getCacheFile(self, key):
+        """ Get the file location of a geometry in our cache folder """
+        name = hashlib.md5(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, "basemap_"+name+".npy")
+
+    def getLines(self, lat, lon, dlat, dlon, rows, cols):
+        """ Get the flat pixel indices of the map lines for a grid geometry.
+            Drawn only the first time we see the geometry """
+        key = self.getKey(lat, lon, dlat, dlon, rows, cols)
+        with self.lock:
+            lines = self.lines.pop(key, None)
+        if lines is None and self.folder:
+            cacheFile = self.getCacheFile(key)
+            if os.path.isfile(cacheFile):
+                lines = numpy.load(cacheFile)
+        if lines is None:
+            segments = getShapeSegments(self.shapeFile)
+            lines = rasterizeSegments(segments, lat, lon, dlat, dlon, rows, cols)
+            if self.folder:
+                self.saveLines(key, lines)
+
+        # Most recent goes on the end, oldest falls off the front.  Pipeline
+        # and tile threads share a cache, so only under our lock
+        with self.lock:
+            self.lines[key] = lines
+            while len(self.lines) > self.size:
+                self.lines.popitem(last=False)
+        return lines
+
+    def saveLines(self, key, lines):
+        """ Save drawn lines to our cache folder through a temp file, so
+            another thread never loads half of them """
+        handle, temp = tempfile.mkstemp(".npy", ".basemap", self.folder)
+        os.close(handle)
+        try:
+            numpy.save(temp, lines)
+            os.rename(temp, self.getCacheFile(key))
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def getLatLonGridLines(self, llg):
+        """ Get the map line pixels for a LatLonGrid's geometry """
+        rows, cols = llg.getImageHeight(), llg.getImageWidth()
+        return self.getLines(llg.getLat(), llg.getLon(), llg.getCellSizeY(),
+                             llg.getCellSizeX(), rows, cols)
+
+    def clear(self):
+        """ Forget all the drawn lines we have in memory """
+        with self.lock:
+            self.lines.clear()
+
+# The cache used when rendering doesn't ask for its own
+defaultCache = BasemapCache()
@@ -0,0 +1,242 @@
+'''
+Catalog
+
+Remember what is in our data folders, so finding files doesn't mean walking
+the whole tree and opening every file again.  We keep a SQLite database
+with one row per data file holding its DataType, TypeName, time, origin,
+grid spacing, dimensions, extent, sparse flag and the size and modification
+time of the file.  The rows are indexed for queries like every
+MergedReflectivityQC LatLonGrid between two times inside a box.
+
+Updating is incremental.  A folder whose modification time hasn't changed
+had no files added, removed or renamed, so we don't look at its files at all.
+In the other folders only new or changed files have their header read.
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import os, sqlite3, threading, calendar
+
+# Imports from my library
+import log
+import w2py.resource as w2res
+import w2py.resample as w2resample
+from w2py.datatype.latlongrid import LatLonGrid
+from w2py.datatype.radialset import RadialSet
+
+# Bump this when what we store changes, older catalogs are then rebuilt
+catalogVersion = 1
+
+def toEpochTime(t):
+    """ Get seconds since 1970 from seconds or a UTC datetime """
+    if hasattr(t, "utctimetuple"):
+        return calendar.timegm(t.utctimetuple())
+    return float(t)
+
+def getExtent(D):
+    """ Get the [west, south, east, north] extent of a data object in degrees.
+        RadialSets cover the full range of their gates around the radar """
+    if isinstance(D, LatLonGrid):
+        lon, lat = D.getUpperLeft()
+        rows, cols = D.shape
+        return [lon, lat-rows*D.getCellSizeY(), lon+cols*D.getCellSizeX(), lat]
+    if isinstance(D, RadialSet):
+        north, west, dlat, dlon, rows, cols = w2resample.getRadialGrid(D)
+        return [west, north-rows*dlat, west+cols*dlon, north]
+    return [None, None, None, None]
+
+class Catalog(object):
+    # Columns of our table, in order
+    fields = ["path", "folder", "size", "mtime", "dataType", "typeName", "time",
+              "timeString", "lat", "lon", "height", "dlat", "dlon", "rows", "cols",
+              "west", "south", "east", "north", "isSparse"]
+
+    def __init__(self, folder, name="w2catalog.sqlite"):
+        """ Open (or create) the catalog in the given folder """
+        self.location = os.path.join(folder, name)
+
+        # Same as the manifest, a worker pool's feeder thread can query
+        # while the main one updates
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(self.location, check_same_thread=False)
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version != catalogVersion:
+            self.db.execute("DROP TABLE IF EXISTS files")
+            self.db.execute("DROP TABLE IF EXISTS folders")
+            self.db.execute("PRAGMA user_version={0}".format(catalogVersion))
+        self.db.execute("CREATE TABLE IF NOT EXISTS files ("
+                        "path TEXT PRIMARY KEY, folder TEXT, size INTEGER, mtime REAL, "
+                        "dataType TEXT, typeName TEXT, time REAL, timeString TEXT, "
+                        "lat REAL, lon REAL, height REAL, dlat REAL, dlon REAL, "
+                        "rows INTEGER, cols INTEGER, west REAL, south REAL, "
+                        "east REAL, north REAL, isSparse INTEGER)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS folders ("
+                        "path TEXT PRIMARY KEY, mtime REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS filesByType ON files (typeName, time)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS filesByDataType ON files (dataType, time)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS filesByTime ON files (time)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS filesByFolder ON files (folder)")
+        self.db.commit()
+        log.info("Using catalog at "+self.location)
+
+    def close(self):
+        """ Close the catalog database """
+        self.db.close()
+
+    def getRecord(self, path):
+        """ Get the record of a file as a dictionary, or None if it isn't
+            in the catalog """
+        with self.lock:
+            cursor = self.db.execute("SELECT {0} FROM files WHERE path=?".format(
+                                     ", ".join(self.fields)), (path,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip(self.fields, row))
+
+    def makeRow(self, path, folder, st, D):
+        """ Get the table row of a data file from its header.  D is None for
+            a file we couldn't read, it's kept so we don't try again until
+            it changes """
+        row = dict.fromkeys(self.fields)
+        row.update({"path":path, "folder":folder, "size":st.st_size, "mtime":st.st_mtime})
+        if D is None:
+            return row
+        row.update({"dataType":type(D).__name__, "typeName":D.getTypeName(),
+                    "time":D.getEpochTime(), "timeString":D.getTime(),
+                    "isSparse":int(D.isSparse())})
+        if isinstance(D, LatLonGrid):
+            lon, lat = D.getUpperLeft()
+            row.update({"lat":lat, "lon":lon, "dlat":D.getCellSizeY(),
+                        "dlon":D.getCellSizeX(), "rows":D.shape[0], "cols":D.shape[1]})
+        elif isinstance(D, RadialSet):
+            lat, lon, height = D.getLocation()
+            row.update({"lat":lat, "lon":lon, "height":height,
+                        "rows":D.getNumRadials(), "cols":D.getNumGates()})
+        row.update(zip(["west", "south", "east", "north"], getExtent(D)))
+        return row
+
+    def updateFolder(self, folder, files, read):
+        """ Bring the rows of one folder up to date with its files.
+            Returns the number of files read """
+        known = {}
+        with self.lock:
+            for path, size, mtime in self.db.execute(
+                    "SELECT path, size, mtime FROM files WHERE folder=?", (folder,)):
+                known[path] = (size, mtime)
+
+        rows = []
+        for f in files:
+            path = os.path.abspath(os.path.join(folder, f))
+            if not w2res.isHandledFileType(path):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue    # Removed since we listed it
+            if known.pop(path, None) == (st.st_size, st.st_mtime):
+                continue
+            try:
+                D = read(path)
+            except Exception as e:
+                log.error("Couldn't catalog {0}: {1}".format(path, e))
+                D = None
+            rows.append(self.makeRow(path, folder, st, D))
+
+        # What's left in known is gone from the folder
+        with self.lock:
+            self.db.executemany("DELETE FROM files WHERE path=?",
+                                [(p,) for p in known])
+            self.db.executemany("INSERT OR REPLACE INTO files ({0}) VALUES ({1})".format(
+                                ", ".join(self.fields), ", ".join(["?"]*len(self.fields))),
+                                [[r[k] for k in self.fields] for r in rows])
+            self.db.commit()
+        return len(rows)
+
+    def update(self, inFolder, read, full=False):
+        """ Bring the catalog of a folder tree up to date.  read is a
+            function that reads the header of a data file into one of our
+            DataType objects, like w2.readDataFile with lazy on.  Folders
+            that haven't changed are skipped unless full is on, which checks
+            every file in case one was written over in place.
+            Returns the number of files read """
+        inFolder = os.path.abspath(inFolder)
+        with self.lock:
+            folders = dict(self.db.execute("SELECT path, mtime FROM folders"))
+
+        count = 0
+        seen = set()
+        for d, sub, files in os.walk(inFolder):
+            d = os.path.abspath(d)
+            seen.add(d)
+            mtime = os.stat(d).st_mtime
+            if full or folders.get(d) != mtime:
+                
+                # List again after getting the time, so a file showing up
+                # while we walk changes the time past the one we keep
+                files = [f for f in os.listdir(d) if f not in sub]
+                count += self.updateFolder(d, files, read)
+                with self.lock:
+                    self.db.execute("INSERT OR REPLACE INTO folders (path, mtime) "
+                                    "VALUES (?, ?)", (d, mtime))
+                    self.db.commit()
+
+        # Forget folders of the tree that were removed
+        gone = [d for d in folders if (d == inFolder or
+                d.startswith(os.path.join(inFolder, ""))) and d not in seen]
+        with self.lock:
+            self.db.executemany("DELETE FROM files WHERE folder=?", [(d,) for d in gone])
+            self.db.executemany("DELETE FROM folders WHERE path=?", [(d,) for d in gone])
+            self.db.commit()
+        log.info("Catalog read {0} new or changed files under {1}".format(count, inFolder))
+        return count
+
+    def query(self, dataType=None, typeName=None, start=None, end=None, bounds=None,
+              sparse=None, folder=None):
+        """ Get the records of matching files as dictionaries in time order.
+            Every filter is optional.
+            dataType: our class name, like 'LatLonGrid' or 'RadialSet'
+            typeName: the product, like 'MergedReflectivityQC'
+            start, end: time range, inclusive, in seconds since 1970 or
+                        as UTC datetimes
+            bounds: [west, south, east, north] box the data has to overlap
+            sparse: True or False to only get files stored sparse or dense
+            folder: only files under this folder tree """
+        where = []
+        args = []
+        if dataType is not None:
+            where.append("dataType=?")
+            args.append(dataType)
+        if typeName is not None:
+            where.append("typeName=?")
+            args.append(typeName)
+        if start is not None:
+            where.append("time>=?")
+            args.append(toEpochTime(start))
+        if end is not None:
+            where.append("time<=?")
+            args.append(toEpochTime(end))
+        if bounds is not None:
+            west, south, east, north = bounds
+            where.append("west<? AND east>? AND south<? AND north>?")
+            args.extend([east, west, north, south])
+        if sparse is not None:
+            where.append("isSparse=?")
+            args.append(int(sparse))
+        if folder is not None:
+            folder = os.path.abspath(folder)
+            under = os.path.join(folder, "")
+            where.append("(folder=? OR substr(folder, 1, ?)=?)")
+            args.extend([folder, len(under), under])
+        sql = "SELECT {0} FROM files".format(", ".join(self.fields))
+        if where:
+            sql += " WHERE "+" AND ".join(where)
+        sql += " ORDER BY time, path"
+        with self.lock:
+            rows = self.db.execute(sql, args).fetchall()
+        return [dict(zip(self.fields, row)) for row in rows]
+
+    def getFiles(self, **query):
+        """ Get the paths of matching files in time order, see query """
+        return [r["path"] for r in self.query(**query)]
@@ -15,8 +15,11 @@ class DataType(object):
         self.raster = None
         self.hRaster = False
         self.time = None
+        self.epochTime = None
         self.typeName = "Unknown"
         self.fileName = "Unknown Filename"
+        self.loader = None
+        self.sparse = False
     
     def __del__(self): 
         """ Delete the raster to save memory """
@@ -36,6 +39,22 @@ class DataType(object):
         """ Do we have a raster object? """
         return self.hRaster
     
+    def setLoader(self, loader):
+        """ Set a function that reads our data the first time it's needed.
+            Used when only the header of a file was read """
+        self.loader = loader
+        
+    def isLoaded(self):
+        """ Has our data been read, or was there nothing to defer? """
+        return self.loader is None
+    
+    def loadData(self):
+        """ Call our loader once and return what it read.  The loader is 
+            dropped after, letting go of the file reader it holds """
+        loader = self.loader
+        self.loader = None
+        return loader()
+    
     def getImageWidth(self):
         """ Return the image width for this data type 
             (used in HTML and PNG generation) """
@@ -51,6 +70,20 @@ class DataType(object):
     
     def getTime(self):
         return self.time
+    
+    def setEpochTime(self, t):
+        """ Set the time as seconds since 1970 """
+        self.epochTime = t
+    
+    def getEpochTime(self):
+        return self.epochTime
+
+    def setSparse(self, s):
+        """ Set if our data was stored sparse in its file """
+        self.sparse = s
+        
+    def isSparse(self):
+        return self.sparse
 
     def setTypeName(self, n):
         self.typeName = n
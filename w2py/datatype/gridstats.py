@@ -0,0 +1,165 @@
+"""
+Grid statistics
+
+Statistics of our 2D data: the count, range, mean and standard deviation of
+the valid cells, a histogram, how much is missing or range folded, and
+where the valid data is.  Dense grids are done in one pass a block of rows
+at a time, so a big grid never needs a full size temporary.  Sparse grids
+are done straight from their runs.
+
+@author: Robert Toomey (retoomey)
+"""
+
+import json
+import numpy
+import datatype
+
+# Histogram bin edges used when none are given, covering our reflectivity range
+defaultBins = numpy.arange(-30.0, 85.0, 5.0)
+
+# Rows of a dense grid looked at a time
+blockRows = 256
+
+class StatsAccumulator(object):
+    def __init__(self, bins):
+        """ Running statistics of valid values, added a block at a time.
+            bins: the histogram bin edges """
+        self.bins = numpy.asarray(bins, numpy.float64)
+        self.histogram = numpy.zeros(len(self.bins)-1, numpy.int64)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        
+    def add(self, values, weights=None):
+        """ Add a block of valid values, each counting weights times if given.
+            Blocks are merged into the running mean and squared deviation
+            with the parallel update of Chan et al., which stays accurate
+            over a lot of cells """
+        if len(values) == 0:
+            return
+        v = values.astype(numpy.float64)
+        if weights is None:
+            n = len(v)
+            mean = v.mean()
+            m2 = float(((v-mean)**2).sum())
+        else:
+            w = weights.astype(numpy.float64)
+            n = int(weights.sum())
+            if n == 0:
+                return
+            mean = float((v*w).sum())/n
+            m2 = float((w*(v-mean)**2).sum())
+        total = self.count+n
+        delta = mean-self.mean
+        self.mean += delta*n/total
+        self.m2 += m2+delta*delta*self.count*n/total
+        self.count = total
+        low, high = values.min(), values.max()
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        self.histogram += numpy.histogram(v, self.bins, weights=weights)[0].astype(numpy.int64)
+
+def getBounds(rowMin, rowMax, colMin, colMax, lat, lon, dlat, dlon):
+    """ Get the [west, south, east, north] edges of a block of cells of a 
+        grid with upper left lat, lon and cell size dlat, dlon """
+    return [lon+colMin*dlon, lat-(rowMax+1)*dlat, lon+(colMax+1)*dlon, lat-rowMin*dlat]
+
+def finishStats(acc, missing, folded, cells, bounds):
+    """ Make the statistics dictionary out of an accumulator, the count of
+        missing and range folded cells, the total cells and the bounds """
+    haveData = acc.count > 0
+    return {"count":acc.count,
+            "min":float(acc.min) if haveData else None,
+            "max":float(acc.max) if haveData else None,
+            "mean":acc.mean if haveData else None,
+            "std":(acc.m2/acc.count)**0.5 if haveData else None,
+            "histogram":acc.histogram,
+            "bins":acc.bins,
+            "missingFraction":float(missing)/cells if cells else 0.0,
+            "rangeFoldedFraction":float(folded)/cells if cells else 0.0,
+            "bounds":bounds}
+
+def dumpStats(stats):
+    """ Get a statistics dictionary as JSON text, for keeping with a file """
+    stats = dict(stats)
+    stats["histogram"] = [int(v) for v in stats["histogram"]]
+    stats["bins"] = [float(v) for v in stats["bins"]]
+    if stats["bounds"]:
+        stats["bounds"] = [float(v) for v in stats["bounds"]]
+    stats["count"] = int(stats["count"])
+    return json.dumps(stats)
+
+def loadStats(text):
+    """ Get a statistics dictionary back from dumpStats text """
+    stats = json.loads(text)
+    stats["histogram"] = numpy.array(stats["histogram"], numpy.int64)
+    stats["bins"] = numpy.array(stats["bins"], numpy.float64)
+    return stats
+
+def getGridStats(M, lat, lon, dlat, dlon, bins=None):
+    """ Get the statistics of a dense grid with upper left lat, lon and
+        cell size dlat, dlon.  Cells above missingData are valid.  Returns
+        a dictionary of count, min, max, mean, std, histogram (counts per
+        bin), bins (the edges), missingFraction, rangeFoldedFraction and
+        bounds ([west, south, east, north] of the valid cells, or None) """
+    if bins is None:
+        bins = defaultBins
+    acc = StatsAccumulator(bins)
+    rows, cols = M.shape
+    missing = 0
+    folded = 0
+    validCols = numpy.zeros(cols, bool)
+    rowMin = None
+    rowMax = None
+    for r in range(0, rows, blockRows):
+        block = M[r:r+blockRows]
+        valid = block > datatype.missingData
+        acc.add(block[valid])
+        missing += int(numpy.count_nonzero(block == datatype.missingData))
+        folded += int(numpy.count_nonzero(block == datatype.rangeFolded))
+        validRows = numpy.flatnonzero(valid.any(axis=1))
+        if len(validRows):
+            if rowMin is None:
+                rowMin = r+validRows[0]
+            rowMax = r+validRows[-1]
+            validCols |= valid.any(axis=0)
+    bounds = None
+    if rowMin is not None:
+        c = numpy.flatnonzero(validCols)
+        bounds = getBounds(rowMin, rowMax, c[0], c[-1], lat, lon, dlat, dlon)
+    return finishStats(acc, missing, folded, M.size, bounds)
+
+def getRunStats(values, starts, counts, background, shape, lat, lon, dlat, dlon, bins=None):
+    """ Get the same statistics as getGridStats for a grid stored as runs
+        of valid values over a background.  values, starts and counts are
+        the runs of a SparseLatLonGrid, with no overlaps """
+    if bins is None:
+        bins = defaultBins
+    acc = StatsAccumulator(bins)
+    rows, cols = shape
+    cells = rows*cols
+    acc.add(values, counts)
+    rest = cells-int(counts.sum())
+    missing = 0
+    folded = 0
+    bounds = None
+    if len(starts):
+        # A run that wraps onto another row covers every column between
+        firstRow = starts // cols
+        lastRow = (starts+counts-1) // cols
+        firstCol = numpy.where(firstRow == lastRow, starts % cols, 0)
+        lastCol = numpy.where(firstRow == lastRow, (starts+counts-1) % cols, cols-1)
+        bounds = getBounds(firstRow.min(), lastRow.max(), firstCol.min(), lastCol.max(),
+                           lat, lon, dlat, dlon)
+    if rest > 0:
+        if background > datatype.missingData:
+            # Valid background fills everything the runs don't
+            acc.add(numpy.array([background]), numpy.array([rest]))
+            bounds = getBounds(0, rows-1, 0, cols-1, lat, lon, dlat, dlon)
+        elif background == datatype.missingData:
+            missing = rest
+        elif background == datatype.rangeFolded:
+            folded = rest
+    return finishStats(acc, missing, folded, cells, bounds)
@@ -6,20 +6,31 @@ Data object to hold our raster data type
 @author: Robert Toomey (retoomey)
 """ 
  
+import numpy
 import datatype
+import gridstats
+import overview
 
 class LatLonGrid(datatype.DataType):
-    def __init__(self, M, lat, lon, dlat, dlon):
+    def __init__(self, M, lat, lon, dlat, dlon, shape=None):
         """ Hold the stuff for a lat lon grid.  This is a raster
             data type.
-            M: 2D numpy matrix of the grid (X is lon, Y is lat)
+            M: 2D numpy matrix of the grid (X is lon, Y is lat), or None
+               when a loader will read it on the first getValues
             lat: Latitude in degrees upper left
             lon: Longitude in degrees upper left
             dlat: Lat cell size in degrees
             dlon: Lon cell size in degrees
+            shape: (rows, cols) of the grid when M is None
         """
         datatype.DataType.__init__(self)
         self.matrix = M
+        if M is not None:
+            shape = M.shape
+        self.shape = shape
+        self.stats = None
+        self.overviews = {}     # (method, factor) -> (LatLonGrid, counts)
+        self.overviewBase = None
         self.lat = lat
         self.lon = lon
         self.dlat = dlat
@@ -34,11 +45,101 @@ class LatLonGrid(datatype.DataType):
         return [self.lon, self.lat]
     
     def getLowerLeft(self):
-        return [self.lon, self.lat-(self.dlat*self.matrix.shape[0])]
+        return [self.lon, self.lat-(self.dlat*self.shape[0])]
     
     def getValues(self):
+        if self.matrix is None:
+            self.matrix = self.loadData()
         return self.matrix
     
+    def getRows(self, row0, row1):
+        """ Get rows row0:row1 of the grid """
+        return self.getValues()[row0:row1]
+    
+    def setOverviewBase(self, base):
+        """ Keep our overviews as .npy files named from base, a path 
+            without extension like the raster's.  Levels are read from them
+            when they're there and saved when made """
+        self.overviewBase = base
+    
+    def getOverview(self, factor, method="max"):
+        """ Get a coarser LatLonGrid with one cell for each factor by factor
+            block of ours, the max or mean of its valid cells, see overview.
+            factor is 1 (us), 2, 4 or 8.  Made the first time it's asked for
+            and kept """
+        if factor == 1:
+            return self
+        if factor not in overview.factors or method not in overview.methods:
+            raise ValueError("Overview {0}{1} isn't one of {2} with factor {3}".format(
+                             method, factor, overview.methods, overview.factors))
+        key = (method, factor)
+        if key not in self.overviews:
+            self.overviews[key] = self.makeOverview(factor, method)
+        return self.overviews[key][0]
+    
+    def getOverviewFor(self, width, height=0, method="max"):
+        """ Get the coarsest of us and our overviews that's still at least
+            width by height cells, for drawing or summing up the grid at
+            about that size """
+        for factor in sorted(overview.factors, reverse=True):
+            rows, cols = overview.getOverviewShape(self.shape, factor)
+            if cols >= width and rows >= height:
+                return self.getOverview(factor, method)
+        return self
+    
+    def makeOverview(self, factor, method):
+        """ Make an overview level, returning (LatLonGrid, counts) """
+        shape = overview.getOverviewShape(self.shape, factor)
+        counts = None
+        values = None
+        filename = None
+        if self.overviewBase is not None:
+            filename = overview.getOverviewFile(self.overviewBase, factor, method)
+            values = overview.loadOverview(filename, shape)
+        if values is None:
+            # Start from the coarsest level we have that this one is a
+            # whole number of, a mean one needs its counts
+            getRows, getCounts, size, by = self.getRows, None, self.shape, factor
+            for f in sorted(overview.factors, reverse=True):
+                have = self.overviews.get((method, f))
+                if f < factor and factor % f == 0 and have is not None and \
+                   (method == "max" or have[1] is not None):
+                    grid, n = have
+                    getRows, size, by = grid.getRows, grid.shape, factor//f
+                    if n is not None:
+                        getCounts = lambda r0, r1: n[r0:r1]
+                    break
+            values, counts = overview.reduceGrid(getRows, size, by, method, getCounts)
+            if filename is not None:
+                overview.saveOverview(filename, values)
+        
+        llg = LatLonGrid(values, self.lat, self.lon, self.dlat*factor, self.dlon*factor)
+        llg.setTypeName(self.getTypeName())
+        llg.setTime(self.getTime())
+        llg.setEpochTime(self.getEpochTime())
+        llg.setFileName(self.getFileName())
+        return (llg, counts)
+    
+    def getStats(self, bins=None):
+        """ Get the statistics of the grid as a dictionary, see 
+            gridstats.getGridStats.  Worked out the first time and kept,
+            unless asked for again with different histogram bins """
+        if bins is None:
+            bins = gridstats.defaultBins
+        if (self.stats is None) or not numpy.array_equal(self.stats["bins"], bins):
+            self.stats = self.computeStats(bins)
+        return self.stats
+    
+    def setStats(self, stats):
+        """ Set statistics worked out before, so getStats doesn't need
+            the values """
+        self.stats = stats
+
+    def computeStats(self, bins):
+        """ Work out the statistics of the grid """
+        return gridstats.getGridStats(self.getValues(), self.lat, self.lon,
+                                      self.dlat, self.dlon, bins)
+    
     def getLat(self):
         return self.lat
     
@@ -57,9 +158,9 @@ class LatLonGrid(datatype.DataType):
     def getImageWidth(self):
         """ Return the image width for this data type 
             (used in HTML and PNG generation) """
-        return self.matrix.shape[1]
+        return self.shape[1]
     
     def getImageHeight(self):
         """ Return the image height for this data type 
             (used in HTML and PNG generation) """
-        return self.matrix.shape[0]
+        return self.shape[0]
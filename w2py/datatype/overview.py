@@ -0,0 +1,125 @@
+"""
+Grid overviews
+
+Coarser copies of a grid for previews, where each block of 2x2, 4x4 or 8x8
+cells becomes one cell.  A block gets the max or the mean of its valid
+cells.  Valid values are above all our flags, so a block without any keeps
+the highest flag in it either way.  Grids that don't divide evenly get a
+last partial block on the bottom and right.
+
+Each level is made from the finest one made before it when it can, so
+making 2x, 4x and 8x reads the full grid once.  A mean level keeps the
+count of valid cells under each of its cells, so a mean made from a mean
+is still the mean of the original cells.  Levels can be saved as .npy files
+and memory mapped back in.
+
+@author: Robert Toomey (retoomey)
+"""
+
+import os
+import numpy
+import datatype
+
+factors = [2, 4, 8]
+methods = ["max", "mean"]
+
+# Rows of the finer grid reduced at a time
+blockRows = 256
+
+def getOverviewShape(shape, factor):
+    """ Get the (rows, cols) of a level factor times coarser than shape """
+    return (-(-shape[0] // factor), -(-shape[1] // factor))
+
+def padBlock(block, factor, fill):
+    """ Pad a block out to a multiple of factor rows and columns """
+    rows, cols = block.shape
+    r, c = -rows % factor, -cols % factor
+    if r == 0 and c == 0:
+        return block
+    padded = numpy.empty((rows+r, cols+c), block.dtype)
+    padded.fill(fill)
+    padded[:rows, :cols] = block
+    return padded
+
+def reduceBlock(block, factor, method, counts=None):
+    """ Reduce a block of rows to one cell per factor by factor cells.
+        counts: the valid cells under each value of a mean level we reduce
+        again, None when each valid value is one cell
+        Returns (values, counts), counts is None for max """
+    block = padBlock(block, factor, datatype.dataUnavailable)
+    rows, cols = block.shape
+    blocks = (rows//factor, factor, cols//factor, factor)
+    top = block.reshape(blocks).max(axis=3).max(axis=1)
+    if method == "max":
+        return (top, None)
+
+    valid = block > datatype.missingData
+    if counts is None:
+        weights = valid.astype(numpy.int32)
+    else:
+        weights = numpy.where(valid, padBlock(counts, factor, 0), 0).astype(numpy.int32)
+    sums = numpy.where(valid, block, 0).astype(numpy.float64)*weights
+    sums = sums.reshape(blocks).sum(axis=3).sum(axis=1)
+    n = weights.reshape(blocks).sum(axis=3).sum(axis=1)
+    have = n > 0
+    top[have] = sums[have]/n[have]
+    return (top, n)
+
+def reduceGrid(getRows, shape, factor, method, getCounts=None):
+    """ Reduce a grid by factor, a block of rows at a time.
+        getRows: function taking (row0, row1) and giving those rows of the
+                 grid, so a sparse grid only makes a block dense at a time
+        shape: (rows, cols) of the grid
+        getCounts: the same for the counts of a mean level, or None
+        Returns (values, counts) like reduceBlock """
+    out = None
+    counts = None
+    step = max(factor, blockRows - blockRows % factor)
+    for r in range(0, shape[0], step):
+        e = min(r+step, shape[0])
+        n = None
+        if getCounts is not None:
+            n = getCounts(r, e)
+        v, n = reduceBlock(getRows(r, e), factor, method, n)
+        if out is None:
+            out = numpy.empty(getOverviewShape(shape, factor), v.dtype)
+            if n is not None:
+                counts = numpy.empty(out.shape, numpy.int32)
+        out[r//factor:r//factor+len(v)] = v
+        if counts is not None:
+            counts[r//factor:r//factor+len(n)] = n
+    return (out, counts)
+
+def getOverviewFile(base, factor, method):
+    """ Get the .npy file of a level, base is the path without extension
+        of what it's an overview of """
+    return "{0}.{1}{2}.npy".format(base, method, factor)
+
+def saveOverview(filename, values):
+    """ Save a level, through a temp file so a reader never sees half of it """
+    temp = filename[:-4]+".tmp.npy"
+    numpy.save(temp, values)
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(temp, filename)
+
+def loadOverview(filename, shape):
+    """ Memory map a saved level read only, or None if there isn't one of
+        the right shape """
+    if not os.path.isfile(filename):
+        return None
+    try:
+        values = numpy.load(filename, mmap_mode="r")
+    except (IOError, ValueError):
+        return None
+    if values.shape != tuple(shape):
+        return None
+    return values
+
+def removeOverviews(base):
+    """ Delete the saved levels of base, when what they came from changed """
+    for method in methods:
+        for factor in factors:
+            filename = getOverviewFile(base, factor, method)
+            if os.path.exists(filename):
+                os.remove(filename)
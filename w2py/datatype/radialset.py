@@ -9,9 +9,74 @@ Data object to hold our polar radar set data
 import datatype
 
 class RadialSet(datatype.DataType):
-    def __init__(self, M):
-        """ Hold the stuff for a polar radial set
+    def __init__(self, M, elevation, rangeToFirstGate, azimuth, beamwidth,
+                 spacing, nyquist, gatewidth, shape=None):
+        """ Hold the stuff for a polar radial set.
+            M: 2D numpy matrix of the data (X is radial, Y is gate), or None
+               when a loader will read it on the first getValues
+            elevation: Elevation angle in degrees
+            rangeToFirstGate: Distance to the first gate in meters
+            azimuth: numpy array of the start azimuth of each radial in degrees
+            beamwidth: numpy array of each radial's beamwidth in degrees
+            spacing: numpy array of each radial's azimuthal spacing in degrees
+            nyquist: numpy array of each radial's Nyquist velocity in m/s
+            gatewidth: numpy array of each radial's gate width in meters
+            shape: (radials, gates) of the data when M is None
         """
         datatype.DataType.__init__(self)
         self.matrix = M
-        
\ No newline at end of file
+        if M is not None:
+            shape = M.shape
+        self.shape = shape
+        self.elevation = elevation
+        self.rangeToFirstGate = rangeToFirstGate
+        self.azimuth = azimuth
+        self.beamwidth = beamwidth
+        self.spacing = spacing
+        self.nyquist = nyquist
+        self.gatewidth = gatewidth
+        self.location = None
+        
+    def __del__(self):
+        """ Delete the numpy array to save memory.   """
+        datatype.DataType.__del__(self)
+        del self.matrix
+        
+    def getValues(self):
+        if self.matrix is None:
+            self.matrix = self.loadData()
+        return self.matrix
+    
+    def setLocation(self, lat, lon, height):
+        """ Set the radar location, lat/lon in degrees and height in meters """
+        self.location = [lat, lon, height]
+        
+    def getLocation(self):
+        return self.location
+    
+    def getElevation(self):
+        return self.elevation
+    
+    def getRangeToFirstGate(self):
+        return self.rangeToFirstGate
+    
+    def getAzimuths(self):
+        return self.azimuth
+    
+    def getBeamWidths(self):
+        return self.beamwidth
+    
+    def getAzimuthalSpacings(self):
+        return self.spacing
+    
+    def getNyquistVelocities(self):
+        return self.nyquist
+    
+    def getGateWidths(self):
+        return self.gatewidth
+    
+    def getNumRadials(self):
+        return self.shape[0]
+    
+    def getNumGates(self):
+        return self.shape[1]
@@ -0,0 +1,169 @@
+"""
+SparseLatLonGrid
+
+Data object to hold a raster data type as the runs of a WDSS2 sparse file
+
+@author: Robert Toomey (retoomey)
+"""
+
+import numpy
+import datatype
+import gridstats
+import latlongrid
+
+def runIndices(starts, counts):
+    """ Get the flat cell index of every cell of runs that begin at flat
+        index starts and go on for counts cells """
+    total = int(counts.sum())
+    if total == 0:
+        return numpy.empty(0, numpy.int64)
+    
+    # Every cell of a run is start + offset within the run.  The offset
+    # comes from a running cell number minus where each run begins in
+    # that running number, so wrapping rows is just linear indexing.
+    runBegin = numpy.cumsum(counts) - counts
+    return numpy.repeat(starts - runBegin, counts) + numpy.arange(total)
+
+class SparseLatLonGrid(latlongrid.LatLonGrid):
+    def __init__(self, values, x, y, counts, background, lat, lon, dlat, dlon, shape,
+                 dtype=numpy.float32):
+        """ Hold a lat lon grid as runs of equal values over a background,
+            the way our sparse files store it.  The dense grid is only made
+            when asked for.
+            values: numpy array of the value of each run
+            x, y: numpy arrays of the row and column each run starts at
+            counts: numpy array of the cells in each run.  Runs wrap into
+                    the next row when they go off the end of one
+            background: value of cells no run covers
+            lat, lon, dlat, dlon: as LatLonGrid
+            shape: (rows, cols) of the grid
+            dtype: type of the dense grid
+            values, x, y and counts can all be None when a loader will
+            read them on first use
+        """
+        latlongrid.LatLonGrid.__init__(self, None, lat, lon, dlat, dlon, shape)
+        self.background = background
+        self.dtype = numpy.dtype(dtype)
+        self.runs = None
+        if values is not None:
+            self.setRuns(values, x, y, counts)
+    
+    def setRuns(self, values, x, y, counts):
+        """ Keep the runs that hold data, clipped to the grid and sorted
+            by where they start.  Runs at or below missingData leave the
+            background alone, and a count below 1 is one cell, same as the
+            dense read.  Our files never have runs overlapping, but if one
+            does it's cut off where the next run starts, so every cell has
+            at most one run """
+        rows, cols = self.shape
+        starts = numpy.asarray(x, numpy.int64)*cols + numpy.asarray(y, numpy.int64)
+        counts = numpy.maximum(numpy.asarray(counts, numpy.int64), 1)
+        counts = numpy.minimum(counts, rows*cols - starts)
+        keep = (values > datatype.missingData) & (counts > 0) & (starts >= 0)
+        order = numpy.argsort(starts[keep], kind="mergesort")
+        values = numpy.asarray(values)[keep][order].astype(self.dtype)
+        starts = starts[keep][order]
+        counts = counts[keep][order]
+        if len(starts) > 1:
+            counts[:-1] = numpy.minimum(counts[:-1], starts[1:]-starts[:-1])
+            keep = counts > 0
+            values, starts, counts = values[keep], starts[keep], counts[keep]
+        self.runs = (values, starts, counts)
+        
+    def getRuns(self):
+        """ Get the (values, starts, counts) arrays of our runs, where
+            starts is the flat cell index each run begins at """
+        if self.runs is None:
+            self.setRuns(*self.loadData())
+        return self.runs
+    
+    def getBackground(self):
+        return self.background
+    
+    def getRunCount(self):
+        return len(self.getRuns()[0])
+    
+    def getValues(self):
+        """ Get the dense grid, made the first time it's asked for """
+        if self.matrix is None:
+            self.matrix = self.densify()
+        return self.matrix
+    
+    def getRows(self, row0, row1):
+        """ Get rows row0:row1, from the runs unless the dense grid is made """
+        if self.matrix is not None:
+            return self.matrix[row0:row1]
+        return self.getWindow(row0, min(row1, self.shape[0]), 0, self.shape[1])
+    
+    def isDense(self):
+        """ Has the dense grid been made? """
+        return self.matrix is not None
+    
+    def densify(self):
+        """ Make a new dense grid of our runs """
+        return self.getWindow(0, self.shape[0], 0, self.shape[1])
+    
+    def getWindow(self, row0, row1, col0, col1):
+        """ Make a dense grid of just rows row0:row1 and columns col0:col1.
+            Only the runs crossing those rows are expanded """
+        cols = self.shape[1]
+        values, starts, counts = self.getRuns()
+        M = numpy.empty((row1-row0, col1-col0), self.dtype)
+        M.fill(self.background)
+        
+        # Runs are sorted by start, so only the ones starting from the
+        # longest run before our rows up to the end of our rows can cross
+        # them.  Clip those to the flat range of the rows
+        low = row0*cols
+        high = row1*cols
+        reach = counts.max() if len(counts) else 0
+        first = numpy.searchsorted(starts, low-reach)
+        last = numpy.searchsorted(starts, high)
+        values, starts, counts = values[first:last], starts[first:last], counts[first:last]
+        begin = numpy.maximum(starts, low)
+        length = numpy.minimum(starts+counts, high)-begin
+        inside = length > 0
+        
+        index = runIndices(begin[inside], length[inside])
+        cellValues = numpy.repeat(values[inside], length[inside])
+        r = index // cols - row0
+        c = index % cols - col0
+        keep = (c >= 0) & (c < col1-col0)
+        M[r[keep], c[keep]] = cellValues[keep]
+        return M
+    
+    def getValueAt(self, row, col):
+        """ Look up the value of cells, row and col can be numbers or 
+            numpy arrays.  Runs don't overlap in our files, so the last run
+            starting at or before a cell is the only one that can cover it """
+        values, starts, counts = self.getRuns()
+        index = numpy.asarray(row, numpy.int64)*self.shape[1] + numpy.asarray(col, numpy.int64)
+        if len(starts) == 0:
+            return numpy.zeros(index.shape, self.dtype)+self.dtype.type(self.background)
+        at = numpy.searchsorted(starts, index, "right")-1
+        safe = numpy.maximum(at, 0)
+        covered = (at >= 0) & (index < starts[safe]+counts[safe])
+        return numpy.where(covered, values[safe], self.background).astype(self.dtype)
+    
+    def computeStats(self, bins):
+        """ Work out the statistics from the runs, without a dense grid """
+        values, starts, counts = self.getRuns()
+        return gridstats.getRunStats(values, starts, counts, self.background, self.shape,
+                                     self.lat, self.lon, self.dlat, self.dlon, bins)
+    
+    def threshold(self, low, high=None):
+        """ Get a new SparseLatLonGrid keeping only the runs with values
+            from low up to high.  The rest become background """
+        values, starts, counts = self.getRuns()
+        keep = values >= low
+        if high is not None:
+            keep &= values <= high
+        cols = self.shape[1]
+        g = SparseLatLonGrid(values[keep], starts[keep] // cols, starts[keep] % cols,
+                             counts[keep], self.background, self.lat, self.lon,
+                             self.dlat, self.dlon, self.shape, self.dtype)
+        g.setTypeName(self.getTypeName())
+        g.setTime(self.getTime())
+        g.setEpochTime(self.getEpochTime())
+        g.setFileName(self.getFileName())
+        return g
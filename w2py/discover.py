@@ -0,0 +1,98 @@
+'''
+File discovery
+
+Find the data files we can handle under a folder tree, in time order,
+without gathering and sorting the whole tree up front.
+
+WDSS2 names files by time, like LatLonGrid20150401-204712.netcdf.gz, and 
+writes each product into its own folder.  So each folder sorts on its own 
+and we merge the folders together as the files are asked for.
+
+Folders are listed as the merge gets to them.  Archives often split a
+product into folders by day, like 20150401, and nothing in one of those is
+before its day.  So a day folder isn't listed until the files before its
+day have been given, and the first files come without walking the whole
+archive.  Other folders could hold files of any time, they're listed right
+away.
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import os, re, heapq, itertools
+
+# Imports from my library
+import w2py.resource as w2res
+
+# The 'YYYYMMDD-HHMMSS' time in a WDSS2 filename
+timePattern = re.compile(r"(\d{8})-(\d{6})")
+
+# A 'YYYYMMDD' folder of one day of files
+dayPattern = re.compile(r"^\d{8}$")
+
+def getFileTimeKey(filename):
+    """ Get the sort key for a data file, the WDSS2 time in the filename
+        as 'YYYYMMDDHHMMSS' then the filename.  Files without a time in 
+        the name sort before all the others, by name """
+    name = os.path.basename(filename)
+    m = timePattern.search(name)
+    if m:
+        return (m.group(1)+m.group(2), name)
+    return ("", name)
+
+def getFolderTimeKey(folder):
+    """ Get a key sorting before every file a folder can hold, the start
+        of its day for a day folder.  Any other folder sorts before all
+        files """
+    name = os.path.basename(os.path.normpath(folder))
+    if dayPattern.match(name):
+        return (name+"000000", "")
+    return ("", "")
+
+def folderFiles(folder, files):
+    """ Yield (key, path) for the handled files of one folder in time order """
+    keyed = []
+    for f in files:
+        
+        # Get the full path and see if it ends in a handled extension type (netcdf)
+        absPath = os.path.abspath(os.path.join(folder, f))
+        if w2res.isHandledFileType(absPath):
+            keyed.append((getFileTimeKey(absPath), absPath))
+    keyed.sort()
+    for k in keyed:
+        yield k
+
+def discoverFiles(inFolder):
+    """ Yield the full path of every handled file under inFolder in time 
+        order.  Each folder is only sorted against itself, then the folders
+        are merged, each listed when the merge reaches its key.  There's no
+        limit on the number of files """
+    # The heap holds (key, sequence, path, stream).  A folder not listed
+    # yet has no stream, a file has the stream of the rest of its folder.
+    # The sequence keeps equal keys from comparing the rest
+    heap = []
+    sequence = itertools.count()
+    heapq.heappush(heap, (getFolderTimeKey(inFolder), next(sequence), inFolder, None))
+    while heap:
+        key, n, path, stream = heapq.heappop(heap)
+        if stream is None:
+            # Like os.walk, skip folders we can't read and links to folders
+            try:
+                names = sorted(os.listdir(path))
+            except OSError:
+                continue
+            files = []
+            for name in names:
+                full = os.path.join(path, name)
+                if os.path.isdir(full):
+                    if not os.path.islink(full):
+                        heapq.heappush(heap, (getFolderTimeKey(full), next(sequence),
+                                              full, None))
+                else:
+                    files.append(name)
+            stream = folderFiles(path, files)
+        else:
+            yield path
+        for key, absPath in stream:
+            heapq.heappush(heap, (key, next(sequence), absPath, stream))
+            break
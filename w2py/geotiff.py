@@ -0,0 +1,185 @@
+'''
+GeoTIFF utilities
+
+Write LatLonGrid data to a tiled, deflate compressed GeoTIFF without arcpy.
+Rows are handed to the writer a block at a time, and each band of tiles is
+compressed and written as soon as its rows are in, so a big grid never
+has to be copied whole.  The georeferencing matches what we give ArcGIS:
+WGS 1984 (EPSG:4326), the grid corner from getLowerLeft and our missing
+data value as nodata.
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import struct, zlib
+import numpy
+
+# Imports from my library
+import log
+from w2py.datatype import datatype
+from w2py.datatype.sparselatlongrid import SparseLatLonGrid
+
+# TIFF field types
+SHORT = 3
+LONG = 4
+DOUBLE = 12
+ASCII = 2
+typeFormats = {SHORT:"H", LONG:"I", DOUBLE:"d", ASCII:"s"}
+
+class GeoTIFFWriter(object):
+    def __init__(self, filename, rows, cols, dtype, lowerLeft, cellSize,
+                 nodata=datatype.missingData, tileSize=256, level=6):
+        """ Start a GeoTIFF file.
+            rows, cols: size of the grid
+            dtype: float32 or float64 sample type
+            lowerLeft: [lon, lat] of the lower left grid corner
+            cellSize: [dlon, dlat] in degrees
+            nodata: the value that means no data
+            tileSize: tile width and height, a multiple of 16
+            level: zlib compression level """
+        self.rows = rows
+        self.cols = cols
+        self.dtype = numpy.dtype(dtype).newbyteorder("<")
+        if self.dtype.kind != "f":
+            raise ValueError("GeoTIFF writer only handles float data, not "+str(dtype))
+        self.lowerLeft = lowerLeft
+        self.cellSize = cellSize
+        self.nodata = nodata
+        self.tileSize = tileSize
+        self.level = level
+        self.across = (cols+tileSize-1)//tileSize
+        self.down = (rows+tileSize-1)//tileSize
+        self.offsets = []
+        self.counts = []
+
+        # Rows waiting for a full band of tiles
+        self.band = numpy.empty((tileSize, self.across*tileSize), self.dtype)
+        self.band.fill(nodata)
+        self.bandRows = 0
+        self.rowsDone = 0
+
+        # Header with the directory location filled in at the end
+        self.f = open(filename, "wb")
+        self.f.write(b"II*\x00\x00\x00\x00\x00")
+
+    def writeRows(self, block):
+        """ Add the next rows of the grid, top down.  block is a
+            (n, cols) array of any float type """
+        at = 0
+        n = block.shape[0]
+        while at < n:
+            take = min(n-at, self.tileSize-self.bandRows)
+            self.band[self.bandRows:self.bandRows+take, :self.cols] = block[at:at+take]
+            self.bandRows += take
+            at += take
+            if self.bandRows == self.tileSize:
+                self.flushBand()
+
+    def flushBand(self):
+        """ Compress and write the tiles of the current band of rows """
+        if self.bandRows < self.tileSize:
+            self.band[self.bandRows:].fill(self.nodata)
+        t = self.tileSize
+        for c in range(self.across):
+            tile = numpy.ascontiguousarray(self.band[:, c*t:(c+1)*t])
+            data = zlib.compress(tile.data, self.level)
+            self.offsets.append(self.f.tell())
+            self.counts.append(len(data))
+            self.f.write(data)
+        self.rowsDone += self.bandRows
+        self.bandRows = 0
+
+    def close(self):
+        """ Write the last tiles and the tag directory, and close the file """
+        if self.bandRows > 0:
+            self.flushBand()
+        if self.rowsDone != self.rows:
+            self.f.close()
+            raise ValueError("GeoTIFF got {0} rows, expected {1}".format(
+                             self.rowsDone, self.rows))
+
+        # Tie the upper left corner of the upper left cell to the map
+        dlon, dlat = self.cellSize
+        upperLat = self.lowerLeft[1]+dlat*self.rows
+        geoKeys = [1, 1, 0, 3,
+                   1024, 0, 1, 2,      # GTModelType: geographic
+                   1025, 0, 1, 1,      # GTRasterType: pixel is area
+                   2048, 0, 1, 4326]   # GeographicType: WGS 1984
+        nodata = "{0!r}\x00".format(float(self.nodata)).encode("ascii")
+        bits = self.dtype.itemsize*8
+        tags = [(256, LONG, [self.cols]),
+                (257, LONG, [self.rows]),
+                (258, SHORT, [bits]),
+                (259, SHORT, [8]),             # Deflate
+                (262, SHORT, [1]),             # Min is black
+                (277, SHORT, [1]),
+                (284, SHORT, [1]),
+                (322, LONG, [self.tileSize]),
+                (323, LONG, [self.tileSize]),
+                (324, LONG, self.offsets),
+                (325, LONG, self.counts),
+                (339, SHORT, [3]),             # IEEE float samples
+                (33550, DOUBLE, [dlon, dlat, 0.0]),
+                (33922, DOUBLE, [0.0, 0.0, 0.0, self.lowerLeft[0], upperLat, 0.0]),
+                (34735, SHORT, geoKeys),
+                (42113, ASCII, nodata)]        # GDAL nodata
+
+        # Directory goes at the end on a word boundary, values that don't
+        # fit in an entry go after it
+        if self.f.tell() % 2:
+            self.f.write(b"\x00")
+        ifd = self.f.tell()
+        extra = ifd+2+12*len(tags)+4
+        entries = []
+        values = []
+        for tag, kind, value in tags:
+            if kind == ASCII:
+                packed = value
+            else:
+                packed = struct.pack("<{0}{1}".format(len(value), typeFormats[kind]), *value)
+            if len(packed) <= 4:
+                entries.append(struct.pack("<HHI", tag, kind, len(value))+packed.ljust(4, b"\x00"))
+            else:
+                entries.append(struct.pack("<HHII", tag, kind, len(value), extra))
+                values.append(packed)
+                extra += len(packed)
+                if extra % 2:
+                    values.append(b"\x00")
+                    extra += 1
+        if extra > 0xffffffff:
+            self.f.close()
+            raise ValueError("GeoTIFF is too big for a classic TIFF file")
+        self.f.write(struct.pack("<H", len(tags)))
+        self.f.write(b"".join(entries))
+        self.f.write(struct.pack("<I", 0))
+        self.f.write(b"".join(values))
+
+        # Point the header at the directory
+        self.f.seek(4)
+        self.f.write(struct.pack("<I", ifd))
+        self.f.close()
+
+def writeGeoTIFF(llg, outputlocation, dtype=None, blockRows=256):
+    """ Write a LatLonGrid to a tiled, compressed GeoTIFF, blockRows rows
+        at a time.  dtype is the sample type, the grid's own by default.
+        A SparseLatLonGrid that isn't dense yet is made dense a block of 
+        rows at a time, so the whole grid never is """
+    rows, cols = llg.getImageHeight(), llg.getImageWidth()
+    windowed = isinstance(llg, SparseLatLonGrid) and not llg.isDense()
+    if windowed:
+        getRows = lambda r: llg.getWindow(r, min(rows, r+blockRows), 0, cols)
+        if dtype is None:
+            dtype = llg.dtype
+    else:
+        M = llg.getValues()
+        getRows = lambda r: M[r:r+blockRows]
+        if dtype is None:
+            dtype = M.dtype
+    log.info("Attempting to write GeoTIFF to "+outputlocation)
+    w = GeoTIFFWriter(outputlocation, rows, cols, dtype, llg.getLowerLeft(),
+                      llg.getCellSize())
+    for r in range(0, rows, blockRows):
+        w.writeRows(getRows(r))
+    w.close()
+    return outputlocation
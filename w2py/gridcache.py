@@ -0,0 +1,208 @@
+'''
+Grid cache
+
+Keep decoded grids on disk, so reading the same archive file again for
+another report doesn't mean uncompressing it and expanding its sparse runs
+again.  Each grid is a raw .npy file of its values with a small json
+sidecar of its header.  A cached grid comes back as a LatLonGrid over a
+memory map of the .npy, so nothing is read until it's used and nothing is
+copied.  The map is copy on write, changing the values never changes the
+cache.
+
+An entry is for one data file read with one reader.  It's only used while
+the file has the same size and modification time, and was decoded by the
+same decoding code (netcdf_util.getDecoderVersion), otherwise the file is
+read again and the entry replaced.  The cache is kept under a size, dropping
+the grids used longest ago.  The sidecar's modification time is when its
+grid was last used.
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import os, json, hashlib, threading, tempfile
+import numpy
+
+# Imports from my library
+import log
+import w2py.resource as w2res
+from w2py.netcdf import netcdf_util
+from w2py.datatype.latlongrid import LatLonGrid
+
+defaultMaxBytes = 2*1024**3
+
+class GridCache(object):
+    def __init__(self, folder=None, maxBytes=defaultMaxBytes):
+        """ Open a grid cache.
+            folder: where the grids go, a folder in our cache folder if None
+            maxBytes: size of the grids kept, the least recently used go
+                      first when it's over """
+        if folder is None:
+            folder = os.path.join(w2res.getCacheDir(), "grids")
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                pass     # Someone else made it
+        self.folder = folder
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def getEntry(self, datafile, net, dtype):
+        """ Get the (grid, sidecar) file locations of a data file """
+        key = "{0}|{1}|{2}".format(os.path.abspath(datafile), net, numpy.dtype(dtype).str)
+        name = hashlib.md5(key.encode("utf-8")).hexdigest()
+        base = os.path.join(self.folder, name)
+        return (base+".npy", base+".json")
+
+    def getSource(self, datafile, net):
+        """ Get what an entry has to match: the file's size and
+            modification time, the reader and the decoder version """
+        st = os.stat(datafile)
+        return {"source":os.path.abspath(datafile), "size":st.st_size,
+                "mtime":st.st_mtime, "net":net,
+                "decoderVersion":netcdf_util.getDecoderVersion(net)}
+
+    def get(self, datafile, net, dtype=numpy.float32):
+        """ Get a data file's LatLonGrid from the cache, or None if it isn't
+            there or is out of date """
+        gridFile, infoFile = self.getEntry(datafile, net, dtype)
+        try:
+            f = open(infoFile)
+            try:
+                info = json.load(f)
+            finally:
+                f.close()
+            source = self.getSource(datafile, net)
+            if any(info.get(k) != v for k, v in source.items()):
+                self.count(False)
+                return None
+            M = numpy.load(gridFile, mmap_mode="c")
+        except (IOError, OSError, ValueError):
+            self.count(False)
+            return None
+        if list(M.shape) != info["shape"]:
+            self.count(False)
+            return None
+
+        # Mark it used for the least recently used order
+        try:
+            os.utime(infoFile, None)
+        except OSError:
+            pass
+        self.count(True)
+        llg = LatLonGrid(M, info["lat"], info["lon"], info["dlat"], info["dlon"])
+        llg.setTypeName(info["typeName"])
+        llg.setTime(info["time"])
+        llg.setEpochTime(info["epochTime"])
+        llg.setSparse(info["sparse"])
+        llg.setFileName(datafile)
+        log.info("Read cached grid of "+datafile)
+        return llg
+
+    def count(self, hit):
+        """ Count a hit or a miss, batch threads share a cache """
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, datafile, net, llg, M=None):
+        """ Cache the decoded values of a data file's LatLonGrid.  M is the
+            values if the grid doesn't have them yet.  The cache is only
+            there to save time, if it can't be written we go on without """
+        if M is None:
+            M = llg.getValues()
+        if M.nbytes > self.maxBytes:
+            return
+        gridFile, infoFile = self.getEntry(datafile, net, M.dtype)
+        info = self.getSource(datafile, net)
+        info.update({"shape":list(M.shape), "dtype":M.dtype.str,
+                     "lat":llg.getLat(), "lon":llg.getLon(),
+                     "dlat":llg.getCellSizeY(), "dlon":llg.getCellSizeX(),
+                     "typeName":llg.getTypeName(), "time":llg.getTime(),
+                     "epochTime":llg.getEpochTime(), "sparse":llg.isSparse()})
+        try:
+            self.write(gridFile, infoFile, M, info)
+        except (IOError, OSError) as e:
+            log.error("Couldn't cache the grid of {0}: {1}".format(datafile, e))
+            self.remove(gridFile)
+            return
+        self.evict()
+
+    def write(self, gridFile, infoFile, M, info):
+        """ Write an entry through temp files, so a reader never sees half
+            of one.  The sidecar goes last, an entry without one is never
+            used """
+        handle, temp = tempfile.mkstemp(".npy", ".grid", self.folder)
+        os.close(handle)
+        try:
+            numpy.save(temp, M)
+            with self.lock:
+                self.remove(infoFile)
+                self.remove(gridFile)
+                os.rename(temp, gridFile)
+        finally:
+            self.remove(temp)
+        handle, temp = tempfile.mkstemp(".json", ".grid", self.folder)
+        try:
+            f = os.fdopen(handle, "w")
+            try:
+                json.dump(info, f)
+            finally:
+                f.close()
+            os.rename(temp, infoFile)
+        finally:
+            self.remove(temp)
+
+    def remove(self, filename):
+        """ Delete a cache file if it's there.  On Windows one that's still
+            memory mapped can't be, we leave it """
+        try:
+            if os.path.exists(filename):
+                os.remove(filename)
+            return True
+        except OSError:
+            return False
+
+    def getEntries(self):
+        """ Get (last used, bytes, grid, sidecar) of every entry, oldest first """
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.startswith(".") or not name.endswith(".json"):
+                continue
+            infoFile = os.path.join(self.folder, name)
+            gridFile = infoFile[:-5]+".npy"
+            try:
+                entries.append((os.path.getmtime(infoFile), os.path.getsize(gridFile),
+                                gridFile, infoFile))
+            except OSError:
+                pass     # Being replaced
+        entries.sort()
+        return entries
+
+    def evict(self):
+        """ Drop the least recently used grids until we're under our size """
+        with self.lock:
+            entries = self.getEntries()
+            total = sum(e[1] for e in entries)
+            for used, size, gridFile, infoFile in entries:
+                if total <= self.maxBytes:
+                    break
+                if self.remove(infoFile) and self.remove(gridFile):
+                    total -= size
+                    log.info("Dropped cached grid "+gridFile)
+
+    def getSize(self):
+        """ Get the bytes of grids in the cache """
+        return sum(e[1] for e in self.getEntries())
+
+    def clear(self):
+        """ Drop every grid in the cache """
+        with self.lock:
+            for used, size, gridFile, infoFile in self.getEntries():
+                self.remove(infoFile)
+                self.remove(gridFile)
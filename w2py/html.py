@@ -58,6 +58,54 @@ def genHTMLListItem(f, link, linkname):
     genHTMLLink(f, link, linkname)
     f.write("\n")
 
+def genStatsRows(f, stats):
+    """ Generate table rows for the statistics of a grid """
+    genHTMLTablePair(f, "Valid cells:", stats["count"])
+    if stats["count"]:
+        genHTMLTablePair(f, "Min / Max:", "{0:.4g} / {1:.4g}".format(stats["min"], stats["max"]))
+        genHTMLTablePair(f, "Mean:", "{0:.4g}".format(stats["mean"]))
+        genHTMLTablePair(f, "Std deviation:", "{0:.4g}".format(stats["std"]))
+    genHTMLTablePair(f, "Missing:", "{0:.2%}".format(stats["missingFraction"]))
+    genHTMLTablePair(f, "Range folded:", "{0:.2%}".format(stats["rangeFoldedFraction"]))
+    if stats["bounds"]:
+        genHTMLTablePair(f, "Valid data extent:",
+            "{0:.3f} to {2:.3f} lon, {1:.3f} to {3:.3f} lat".format(*stats["bounds"]))
+    
+def genHistogram(f, stats, barWidth=300):
+    """ Generate a histogram table of a grid's statistics, one row per bin
+        with a bar scaled to the biggest bin """
+    histogram = stats["histogram"]
+    bins = stats["bins"]
+    biggest = max(histogram.max(), 1) if len(histogram) else 1
+    f.write("<table>\n")
+    genHTMLTableItem(f, ["<b>Value range</b>", "<b>Cells</b>", ""])
+    for i, count in enumerate(histogram):
+        bar = "<div style=\"background:steelblue;height:10px;width:{0}px\"></div>".format(
+              int(barWidth*count/biggest))
+        genHTMLTableItem(f, ["{0:g} to {1:g}".format(bins[i], bins[i+1]), count, bar])
+    f.write("</table><br>\n")
+
+def genSlippyMap(f, D, tiles, percentWidth):
+    """ Generate a Leaflet slippy map of a grid's web map tiles over an
+        OpenStreetMap base.  tiles is (folder URL, min zoom, max zoom) """
+    url, minZoom, maxZoom = tiles
+    west, south = D.getLowerLeft()
+    east = D.getUpperLeft()[0]+D.getCellSizeX()*D.getImageWidth()
+    north = D.getUpperLeft()[1]
+    f.write("<link rel=\"stylesheet\" href=\"https://unpkg.com/leaflet@1.9.4/dist/leaflet.css\">\n")
+    f.write("<script src=\"https://unpkg.com/leaflet@1.9.4/dist/leaflet.js\"></script>\n")
+    f.write("<div id=\"map\" style=\"width:{0}%;height:600px;border:1px solid black\"></div>\n".format(
+            percentWidth))
+    f.write("<script>\n")
+    f.write("var map = L.map('map', {{minZoom:{0}}});\n".format(max(0, minZoom-1)))
+    f.write("map.fitBounds([[{0}, {1}], [{2}, {3}]]);\n".format(south, west, north, east))
+    f.write("L.tileLayer('https://tile.openstreetmap.org/{z}/{x}/{y}.png', ")
+    f.write("{attribution:'&copy; OpenStreetMap contributors'}).addTo(map);\n")
+    f.write("L.tileLayer('{0}/{{z}}/{{x}}/{{y}}.png', ".format(url))
+    f.write("{{minNativeZoom:{0}, maxNativeZoom:{1}, opacity:0.8}}).addTo(map);\n".format(
+            minZoom, maxZoom))
+    f.write("</script>\n")
+
 def genFileBase(f):
     """ Given a filename, generate a safe 'base' name for
         HTML and PNG filenames """
@@ -91,9 +139,12 @@ def genNavigation(f, indexLocation, percentWidth, prevFile="", nextFile=""):
     f.write("</tr>\n</table><br>")   
        
 def genHTMLFile(D, outHTMLFolder, outputHTMLFile, inputPNGFile,
-                indexLocation="", prevFile="", nextFile=""):  
+                indexLocation="", prevFile="", nextFile="", tiles=None, stats=None):  
     """ Given one of our DataType objects, image file and html location, 
-        generate one HTML page """
+        generate one HTML page.  With tiles, (folder URL, min zoom, max zoom)
+        of the grid's web map tiles, the page shows a slippy map instead of
+        the image.  stats is the grid's statistics if we have them already,
+        otherwise a grid works them out """
     workhtml = w2res.getTempFile(outHTMLFolder, outputHTMLFile)
     percentWidth = 95
     
@@ -121,6 +172,12 @@ def genHTMLFile(D, outHTMLFolder, outputHTMLFile, inputPNGFile,
     iLink = "<a href=\"{0}\">{1}</a><br>\n".format(inputPNGFile, inputPNGFile)
     genHTMLTablePair(f, "Image:", iLink)
     genHTMLTablePair(f, "Cells:", "{0} w x {1} h".format(width, height))
+    
+    # Grids have statistics, worked out once and kept on the object
+    if stats is None and hasattr(D, "getStats"):
+        stats = D.getStats()
+    if stats is not None:
+        genStatsRows(f, stats)
     f.write("</table>\n")
     
     # Generate the navigation between pages
@@ -128,15 +185,22 @@ def genHTMLFile(D, outHTMLFolder, outputHTMLFile, inputPNGFile,
 
     # Insert the PNG file into the page, make it clickable if we have nextFile
     # This will let user go to next quickly 
-    if nextFile:
-        f.write("<a href=\"{0}\">".format(nextFile+".html"))
-    image = "<img src=\"{0}\" width=\"{1}%\" style=\"border:1px solid black\">\n"
-    f.write(image.format(inputPNGFile, percentWidth))
-    if nextFile:
-        f.write("</a>")
+    if tiles:
+        genSlippyMap(f, D, tiles, percentWidth)
+    else:
+        if nextFile:
+            f.write("<a href=\"{0}\">".format(nextFile+".html"))
+        image = "<img src=\"{0}\" width=\"{1}%\" style=\"border:1px solid black\">\n"
+        f.write(image.format(inputPNGFile, percentWidth))
+        if nextFile:
+            f.write("</a>")
     
     # Another navigation for convenience at bottom of page    
     genNavigation(f, indexLocation, percentWidth, prevFile, nextFile)
+    
+    # The histogram goes below the image, it's long
+    if stats is not None:
+        genHistogram(f, stats)
   
     log.info("Wrote html page to "+outputHTMLFile)
     genHTMLFooter(f)
\ No newline at end of file
@@ -0,0 +1,163 @@
+'''
+Manifest
+
+Remember what a batch conversion already made, so running it again only
+does the new or changed work.  We keep a small SQLite database in the
+output folder, one row per input file, keyed by the file path and holding
+its size, modification time and content hash.  Each row records which
+raster, PNG and HTML outputs were made, and with which reader and
+symbology, plus the grid statistics so a page can be made again without
+decoding.  Rows are committed as each file finishes, so a batch that
+dies partway picks up where it stopped.
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import os, sqlite3, hashlib, threading
+
+# Imports from my library
+import log
+
+def getFileHash(filename):
+    """ Get the md5 hex digest of a file's content, read in chunks """
+    h = hashlib.md5()
+    f = open(filename, "rb")
+    try:
+        chunk = f.read(1024*1024)
+        while chunk:
+            h.update(chunk)
+            chunk = f.read(1024*1024)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+class Manifest(object):
+    # Columns of our table, in order
+    fields = ["path", "size", "mtime", "hash", "reader", "symbology",
+              "isGrid", "raster", "png", "html", "prevFile", "nextFile", "stats"]
+
+    def __init__(self, folder, name="w2manifest.sqlite"):
+        """ Open (or create) the manifest in the given folder """
+        self.location = os.path.join(folder, name)
+        
+        # A worker pool asks for work from its own feeder thread while we
+        # record results from the main one, so share the connection with 
+        # a lock around it
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(self.location, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS files ("
+                        "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, "
+                        "hash TEXT, reader TEXT, symbology TEXT, isGrid INTEGER, "
+                        "raster TEXT, png TEXT, html TEXT, "
+                        "prevFile TEXT, nextFile TEXT, stats TEXT)")
+
+        # Manifests from before we kept statistics don't have them.  They
+        # are from before RadialSets were resampled too, so forget the files
+        # that weren't grids then, they might be now
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(files)")]
+        if "stats" not in columns:
+            self.db.execute("ALTER TABLE files ADD COLUMN stats TEXT")
+            self.db.execute("DELETE FROM files WHERE isGrid=0")
+        self.db.commit()
+        log.info("Using manifest at "+self.location)
+
+    def close(self):
+        """ Close the manifest database """
+        self.db.close()
+
+    def getRecord(self, path):
+        """ Get the record of a file as a dictionary, or None if we
+            haven't converted it before """
+        with self.lock:
+            cursor = self.db.execute("SELECT {0} FROM files WHERE path=?".format(
+                                     ", ".join(self.fields)), (path,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip(self.fields, row))
+
+    def isSameContent(self, record, path):
+        """ Is the file the same one we recorded?  Size and time matching is
+            good enough.  If those changed we check the hash, since a copied
+            or touched file can still be the same data """
+        st = os.stat(path)
+        if st.st_size == record["size"] and st.st_mtime == record["mtime"]:
+            return True
+        if st.st_size != record["size"]:
+            return False
+        return getFileHash(path) == record["hash"]
+
+    def getHash(self, path, record):
+        """ Get the content hash of a file.  The recorded one is still good
+            while the size and time match, so an unchanged file isn't read """
+        st = os.stat(path)
+        if record is not None and st.st_size == record["size"] and \
+                st.st_mtime == record["mtime"]:
+            return record["hash"]
+        return getFileHash(path)
+
+    def getWork(self, path, reader, symbology, htmlOn, prevFile, nextFile, raster, exists):
+        """ Work out what still has to be made for a data file.  raster is
+            where its raster should be, and exists is a function telling if
+            an output location is still there.
+            Returns the tuple (doRaster, doPNG, doHTML) """
+        record = self.getRecord(path)
+        if (record is None) or (record["reader"] != reader) or \
+                (not self.isSameContent(record, path)):
+            return (True, htmlOn, htmlOn)
+
+        # Only LatLonGrids make outputs, nothing more to do for others
+        if not record["isGrid"]:
+            return (False, False, False)
+
+        doRaster = (record["raster"] != raster) or not exists(raster)
+        doPNG = htmlOn and (doRaster or (record["symbology"] != symbology) or
+                            not (record["png"] and exists(record["png"])))
+        doHTML = htmlOn and (doPNG or (record["prevFile"] != prevFile) or
+                             (record["nextFile"] != nextFile) or
+                             not (record["html"] and exists(record["html"])))
+        return (doRaster, doPNG, doHTML)
+
+    def isRendered(self, path, symbology):
+        """ Did a data file's PNG and tiles get finished with a symbology?
+            Only says what we recorded, the caller knows if it's being made
+            again """
+        record = self.getRecord(path)
+        return bool(record and record["png"] and record["symbology"] == symbology)
+
+    def record(self, path, reader, symbology, outputs):
+        """ Record what we made for a data file and commit right away.
+            outputs is a dictionary with 'isGrid' and the 'raster', 'png' 
+            and 'html' locations, plus the 'prevFile' and 'nextFile' the 
+            page links to and the grid 'stats' as text.  A location of None
+            means we didn't make it this time, so we keep any we made before
+            from the same file content, the same for stats """
+        old = self.getRecord(path)
+        fileHash = self.getHash(path, old)
+        if old is not None and old["hash"] != fileHash:
+            old = None
+
+        png = outputs["png"]
+        html = outputs["html"]
+        prevFile = outputs["prevFile"]
+        nextFile = outputs["nextFile"]
+        if png is None and old is not None:
+            png = old["png"]
+            symbology = old["symbology"]
+        if html is None and old is not None:
+            html = old["html"]
+            prevFile = old["prevFile"]
+            nextFile = old["nextFile"]
+        stats = outputs.get("stats")
+        if stats is None and old is not None:
+            stats = old["stats"]
+
+        st = os.stat(path)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO files ({0}) VALUES ({1})".format(
+                            ", ".join(self.fields), ", ".join(["?"]*len(self.fields))),
+                            (path, st.st_size, st.st_mtime, fileHash, reader,
+                             symbology, int(outputs["isGrid"]), outputs["raster"],
+                             png, html, prevFile, nextFile, stats))
+            self.db.commit()
@@ -0,0 +1,182 @@
+'''
+Mosaic
+
+Combine several LatLonGrids, like regional tiles or products from different
+sources, into one grid covering all of them.  The grids have to share the
+same cell size and line up on the same cells.  The output covers the union
+of their extents and can be memory mapped, so it can be bigger than memory.
+Grids are added one at a time, each going into its slice of the output a
+block of rows at a time, so only one input is held at once.
+
+Where grids overlap a cell gets:
+  max: the biggest value
+  latest: the value of the newest grid, add grids oldest first
+  average: the weighted average of the values
+Only valid values count.  A cell without any keeps the highest flag value
+it got, so missing beats range folded.  Cells no grid covers are
+dataUnavailable.
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import os, datetime
+import numpy
+
+# Imports from my library
+import log
+from w2py.datatype import datatype
+from w2py.datatype.latlongrid import LatLonGrid
+
+policies = ["max", "latest", "average"]
+blockRows = 256       # rows of an input combined at a time
+tolerance = 0.01      # fraction of a cell grids can be off and still line up
+
+def checkCellSize(grid, dlat, dlon):
+    """ Raise a ValueError unless a LatLonGrid has the cell size dlat, dlon,
+        close enough that its cells stay lined up across the whole grid """
+    gx, gy = grid.getCellSize()
+    if abs(gx-dlon) > tolerance*dlon/grid.shape[1] or \
+       abs(gy-dlat) > tolerance*dlat/grid.shape[0]:
+        raise ValueError("Grids need the same cell size, {0} isn't {1}".format(
+                         [gx, gy], [dlon, dlat]))
+
+def getUnionGrid(grids):
+    """ Get the geometry covering a list of LatLonGrids, as (lat, lon, dlat,
+        dlon, rows, cols) with lat, lon the upper left.  Only the headers are
+        used, so lazily read grids stay unread """
+    if not grids:
+        raise ValueError("Mosaic needs at least one grid")
+    dlon, dlat = grids[0].getCellSize()
+    north = max(g.getUpperLeft()[1] for g in grids)
+    west = min(g.getUpperLeft()[0] for g in grids)
+    south = min(g.getLowerLeft()[1] for g in grids)
+    east = max(g.getUpperLeft()[0]+g.shape[1]*g.getCellSizeX() for g in grids)
+    for g in grids:
+        checkCellSize(g, dlat, dlon)
+        getOffset(g, north, west, dlat, dlon)
+    rows = int(round((north-south)/dlat))
+    cols = int(round((east-west)/dlon))
+    return (north, west, dlat, dlon, rows, cols)
+
+def getOffset(grid, lat, lon, dlat, dlon):
+    """ Get the (row, col) of a grid's upper left cell in the grid with
+        upper left lat, lon and cell size dlat, dlon """
+    lon0, lat0 = grid.getUpperLeft()
+    row = (lat-lat0)/dlat
+    col = (lon0-lon)/dlon
+    if abs(row-round(row)) > tolerance or abs(col-round(col)) > tolerance:
+        raise ValueError("Mosaic grid at {0} doesn't line up with the cells at {1}".format(
+                         [lon0, lat0], [lon, lat]))
+    return (int(round(row)), int(round(col)))
+
+def getBlocks(grid, lat, lon, dlat, dlon, shape):
+    """ Yield the part of a grid inside a bigger grid of the given upper 
+        left, cell size and shape a block of rows at a time, as (rows, cols,
+        values) with rows and cols the slices of the bigger grid the values
+        go in """
+    row, col = getOffset(grid, lat, lon, dlat, dlon)
+    values = grid.getValues()
+    rows, cols = values.shape
+
+    # Clip to the bigger grid, in case the grid sticks out of it
+    r0, c0 = max(row, 0), max(col, 0)
+    r1, c1 = min(row+rows, shape[0]), min(col+cols, shape[1])
+    for r in range(r0, r1, blockRows):
+        e = min(r+blockRows, r1)
+        yield (slice(r, e), slice(c0, c1), values[r-row:e-row, c0-col:c1-col])
+
+class Mosaic(object):
+    def __init__(self, grid, policy="max", output=None, dtype=numpy.float32):
+        """ Start a mosaic.
+            grid: (lat, lon, dlat, dlon, rows, cols) from getUnionGrid
+            policy: one of max, latest or average
+            output: .npy file to memory map the mosaic to, or None to keep
+                    it in memory.  An average also maps its weights to a
+                    file next to it while adding
+            dtype: type of the mosaic values
+        """
+        if policy not in policies:
+            raise ValueError("Mosaic policy {0} isn't one of {1}".format(policy, policies))
+        self.lat, self.lon, self.dlat, self.dlon, rows, cols = grid
+        self.shape = (rows, cols)
+        self.policy = policy
+        self.output = output
+        self.values = self.makeArray(output, dtype)
+        self.values.fill(datatype.dataUnavailable)
+        self.weights = None
+        self.weightFile = None
+        if policy == "average":
+            if output is not None:
+                self.weightFile = os.path.splitext(output)[0]+".weights.npy"
+            self.weights = self.makeArray(self.weightFile, numpy.float32)
+            self.weights.fill(0)
+        self.typeName = None
+        self.epochTime = None
+        self.count = 0
+
+    def makeArray(self, filename, dtype):
+        """ Make an array of our shape, memory mapped if given a filename """
+        if filename is None:
+            return numpy.empty(self.shape, dtype)
+        return numpy.lib.format.open_memmap(filename, "w+", dtype, self.shape)
+
+    def add(self, grid, weight=1.0):
+        """ Combine a LatLonGrid into the mosaic """
+        for rows, cols, v in getBlocks(grid, self.lat, self.lon, self.dlat, self.dlon,
+                                       self.shape):
+            out = self.values[rows, cols]
+            if self.policy == "max":
+                numpy.maximum(out, v, out)
+            elif self.policy == "latest":
+                # Valid values replace anything, flags only replace lower flags
+                take = (v > datatype.missingData) | (v > out)
+                out[take] = v[take]
+            else:
+                self.addAverage(out, self.weights[rows, cols], v, weight)
+
+        self.count += 1
+        if self.typeName is None:
+            self.typeName = grid.getTypeName()
+        t = grid.getEpochTime()
+        if t is not None and (self.epochTime is None or t > self.epochTime):
+            self.epochTime = t
+        log.info("Added {0} to mosaic".format(grid.getFileName()))
+
+    def addAverage(self, out, weights, v, weight):
+        """ Add a block of values into the running weighted sum.  Until a
+            cell has a valid value it holds the highest flag instead """
+        valid = v > datatype.missingData
+        first = valid & (weights == 0)
+        out[first] = 0
+        out[valid] += weight*v[valid]
+        weights[valid] += weight
+        flags = ~valid & (weights == 0)
+        out[flags] = numpy.maximum(out[flags], v[flags])
+
+    def getGrid(self):
+        """ Finish the mosaic and get it as a LatLonGrid.  The values are
+            the memory mapped output, if there is one """
+        if self.weights is not None:
+            for r in range(0, self.shape[0], blockRows):
+                out = self.values[r:r+blockRows]
+                w = self.weights[r:r+blockRows]
+                have = w > 0
+                out[have] /= w[have]
+            self.weights = None
+            if self.weightFile is not None:
+                os.remove(self.weightFile)
+        if self.output is not None:
+            self.values.flush()
+
+        llg = LatLonGrid(self.values, self.lat, self.lon, self.dlat, self.dlon)
+        llg.setTypeName(self.typeName or "Mosaic")
+        if self.epochTime is not None:
+            llg.setEpochTime(self.epochTime)
+            llg.setTime(datetime.datetime.fromtimestamp(int(self.epochTime)).strftime(
+                        '%Y-%m-%d %H:%M:%S UTC'))
+        if self.output is not None:
+            llg.setFileName(self.output)
+        log.info("Mosaic of {0} grids is {1} by {2} cells".format(
+                 self.count, self.shape[1], self.shape[0]))
+        return llg
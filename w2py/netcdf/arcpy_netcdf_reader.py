@@ -7,6 +7,7 @@ This reader uses the arcpy NetCDFFileProperties to access a netcdf file
 """ 
 
 import arcpy
+import numpy
 from w2py import log 
 import netcdf_reader
 
@@ -48,6 +49,9 @@ class arcpyNetcdfReader(netcdf_reader.netcdfReader):
             pass
         return haveIt
     
+    def haveVariable(self, var):
+        return var in self.data.getVariables()
+    
     def haveAttribute(self, param1, param2):
         attrs = self.data.getAttributeNames(param1)
         return param2 in attrs
@@ -74,4 +78,25 @@ class arcpyNetcdfReader(netcdf_reader.netcdfReader):
     
     def getValue2D(self, vlookup, index, x, y):
         return self.data.getDimensionValue(vlookup, index)
-        
\ No newline at end of file
+        
+    
+    # There's no hyperslab read in NetCDFFileProperties, so we still pay the 
+    # wrapped call per element.  At least fromiter fills the array directly
+    # instead of the caller indexing and converting every cell
+    def getArray(self, param1, dtype=float, shape=None):
+        if shape is None:
+            return self.getSlice(param1, 0, self.getDimensionSizeByVariable(param1), dtype)
+        return self.getSlice(param1, 0, shape[0], dtype, shape)
+    
+    def getSlice(self, param1, start, stop, dtype=float, shape=None):
+        value = self.data.getDimensionValue
+        if dtype is None:
+            dtype = float
+        if shape is None:
+            return numpy.fromiter((value(param1, i) for i in xrange(start, stop)),
+                                  dtype, stop-start)
+        cols = shape[1]
+        num = (stop-start)*cols
+        M = numpy.fromiter((value(param1, i) 
+                            for i in xrange(start*cols, stop*cols)), dtype, num)
+        return M.reshape((stop-start, cols))
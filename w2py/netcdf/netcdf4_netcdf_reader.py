@@ -0,0 +1,101 @@
+"""
+NetCDF4 Netcdf Reader class file
+
+This reader uses the netCDF4 library to access a netcdf file.  This is the
+one to use for newer netcdf4/HDF5 files, which the other readers can't
+open.  It reads classic netcdf files as well.  No arcpy needed.
+
+@author: Robert Toomey (retoomey)
+"""  
+
+import netCDF4
+from w2py import log
+import netcdf_reader
+
+class netcdf4NetcdfReader(netcdf_reader.netcdfReader):
+    
+    def __init__(self, datafile):           
+        """ Open NetCDF file with the netCDF4 library
+        """
+        super(type(self), self).__init__()
+        self.data = None
+        log.info("Trying to read netcdf "+datafile)
+        try:
+            # Compressed files are opened from memory.  Older netcdf C 
+            # libraries can't do that, so then we use a temp file, 
+            # which will be deleted on __del__ cleanup
+            fileData = self.uncompressToMemory(datafile)
+            if fileData is None:
+                self.data = netCDF4.Dataset(datafile, "r")
+            else:
+                try:
+                    self.data = netCDF4.Dataset(datafile, "r", memory=fileData)
+                except (TypeError, ValueError, IOError) as e:
+                    log.info("Can't open netcdf from memory, using temp file: {0}".format(e))
+                    del fileData
+                    datafile = self.uncompressTempFile(datafile)
+                    self.data = netCDF4.Dataset(datafile, "r")
+            
+            # We want the raw values with our own missing data flags, 
+            # not masked arrays
+            self.data.set_auto_maskandscale(False)
+        except BaseException as e:
+            log.error("Couldn't read netcdf data from file "+datafile)
+            log.error("Exception {0}".format(e))
+    
+    def __del__(self):       
+        # Close our file before calling superclass, 
+        # since superclass might delete it
+        if self.data:
+            self.data.close()
+        super(type(self), self).__del__()
+        
+    def haveDimension(self, dim):
+        return dim in self.data.dimensions
+    
+    def haveVariable(self, var):
+        return var in self.data.variables
+    
+    def haveAttribute(self, param1, param2):
+        if param1 == "":
+            return param2 in self.data.ncattrs()
+        else:
+            var = self.data.variables.get(param1)
+            return var is not None and param2 in var.ncattrs()
+    
+    def getAttributeValue(self, param1, param2):
+        # "" for param1 is global attribute, otherwise variable
+        if param1 == "":
+            return self.data.getncattr(param2)
+        else:
+            return self.data.variables[param1].getncattr(param2)
+    
+    def getDimensionSize(self, param1):
+        return len(self.data.dimensions[param1])
+    
+    def getDimensionSizeByVariable(self, param1):
+        return int(self.data.variables[param1].shape[0])
+    
+    def getValueLookup(self, param1):
+        # Read the variable once, HDF5 can't hand us a view into the file
+        return self.data.variables[param1][:]
+    
+    def getValue(self, vlookup, index):
+        return vlookup[index]
+    
+    def getValue2D(self, vlookup, index, x, y):
+        return vlookup[x, y]
+    
+    def getArray(self, param1, dtype=float, shape=None):
+        # The library reads into its own buffer, we don't copy it again
+        # unless we have to convert the type
+        values = self.data.variables[param1][:]
+        if dtype is None:
+            return values
+        return values.astype(dtype, copy=False)
+    
+    def getSlice(self, param1, start, stop, dtype=float, shape=None):
+        values = self.data.variables[param1][start:stop]
+        if dtype is None:
+            return values
+        return values.astype(dtype, copy=False)
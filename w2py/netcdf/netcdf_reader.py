@@ -10,13 +10,15 @@ more to learn about how to use it properly.
 @author: Robert Toomey (retoomey)
 """
 
-import os, gzip
+import os, gzip, shutil, struct, tempfile, time
+import numpy
 import w2py.log as log
 import w2py.resource as w2res
 
 class netcdfReader(object):
     def __init__(self):
         self.haveTemp = False
+        self.tempDir = None
         self.fileName = None
         
     def getFileLocation(self):
@@ -27,22 +29,66 @@ class netcdfReader(object):
     def setFileLocation(self, f):
         """ Set the file location used by this reader """
         self.fileName = f 
+    
+    def uncompressToMemory(self, datafile):
+        """ Uncompress a gzip file into memory if needed.  Returns the
+            uncompressed bytes, or None if the file isn't compressed and
+            can be opened directly.  Readers that can open a netcdf from
+            memory should use this instead of a temp file """
+        self.setFileLocation(datafile)
+        if not datafile.endswith(".gz"):
+            return None
+        start = time.time()
+        i = gzip.GzipFile(datafile, 'rb')
+        try:
+            fileData = i.read()
+        finally:
+            i.close()
+        log.info("Uncompressed {0} bytes into memory in {1:.3f} seconds".format(
+                 len(fileData), time.time()-start))
+        return fileData
+
+    def getUncompressedSize(self, datafile):
+        """ Get the uncompressed size of a gzip file from its trailer, without
+            uncompressing it.  Gzip keeps it modulo 4 GB, which is plenty
+            for deciding how to read a file """
+        f = open(datafile, 'rb')
+        try:
+            f.seek(-4, os.SEEK_END)
+            return struct.unpack("<I", f.read(4))[0]
+        finally:
+            f.close()
               
     def uncompressTempFile(self, datafile):
-        """ Uncompress a gzip file to a temp file if needed """
+        """ Uncompress a gzip file to a temp file if needed.  The file goes
+            into a private temp directory (tmpfs if we have one), so we
+            never write next to the data and two readers of the same
+            file don't step on each other """
         if datafile.endswith(".gz"):
-            uncompressed = w2res.getAbsBaseMulti(datafile)
-            uncompressed += ".netcdf"
+            start = time.time()
+            self.tempDir = tempfile.mkdtemp(prefix="w2py", dir=w2res.getFastTempDir())
+            uncompressed = os.path.join(self.tempDir, 
+                                        w2res.getBaseMulti(datafile)+".netcdf")
             log.info("Uncompressing file to "+uncompressed)
-            i = gzip.GzipFile(datafile, 'rb')
-            fileData = i.read()
-            i.close()
-            o = file(uncompressed, 'wb')
-            o.write(fileData)
-            o.close()
-            datafile = uncompressed
+            try:
+                i = gzip.GzipFile(datafile, 'rb')
+                try:
+                    o = open(uncompressed, 'wb')
+                    try:
+                        # Copy in chunks, never holding the whole file in memory
+                        shutil.copyfileobj(i, o, 1024*1024)
+                    finally:
+                        o.close()
+                finally:
+                    i.close()
+            except BaseException:
+                # A bad file or full disk, don't leave half of it behind
+                shutil.rmtree(self.tempDir, True)
+                self.tempDir = None
+                raise
+            log.info("Uncompressed {0} bytes to temp file in {1:.3f} seconds".format(
+                     os.path.getsize(uncompressed), time.time()-start))
             self.setFileLocation(uncompressed)
-            self.fileName = uncompressed
             self.haveTemp = True
             datafile = uncompressed
         else:
@@ -54,9 +100,12 @@ class netcdfReader(object):
         if self.haveTemp:
             log.info("Attempting to remove temp file"+self.fileName)
             os.remove(self.fileName)
+            os.rmdir(self.tempDir)
          
     def haveDimension(self, dim):
         return False
+    def haveVariable(self, var):
+        return False
     def haveAttribute(self, param1, param2):
         return False
     #def getAttributeNames(self, params):
@@ -73,3 +122,39 @@ class netcdfReader(object):
         return None
     def getValue2D(self, vlookup, index, x, y):
         return None
+    
+    # Bulk access.  Readers should override these with a real whole variable
+    # or hyperslab read.  The fallbacks here go through getValue/getValue2D
+    # one element at a time, so any reader that only has the per-element
+    # methods still works, just slowly.
+    def getArray(self, param1, dtype=float, shape=None):
+        """ Read a whole variable into a numpy array of the given dtype.
+            A dtype of None keeps the type stored in the file, as a view
+            into the file where the reader can do that.
+            shape is the (rows, cols) of a 2D variable.  Some readers can't
+            tell it from the variable, so callers pass it in """
+        if dtype is None:
+            dtype = float
+        vlookup = self.getValueLookup(param1)
+        if shape is None:
+            num = self.getDimensionSizeByVariable(param1)
+            return numpy.fromiter((self.getValue(vlookup, i)
+                                   for i in range(num)), dtype, num)
+        return self.getSlice(param1, 0, shape[0], dtype, shape)
+        
+    def getSlice(self, param1, start, stop, dtype=float, shape=None):
+        """ Read the hyperslab start:stop along the first dimension of a 
+            variable into a numpy array of the given dtype.  shape is the 
+            (rows, cols) of a 2D variable """
+        if dtype is None:
+            dtype = float
+        vlookup = self.getValueLookup(param1)
+        if shape is None:
+            return numpy.fromiter((self.getValue(vlookup, i)
+                                   for i in range(start, stop)), dtype, stop-start)
+        cols = shape[1]
+        M = numpy.empty((stop-start, cols), dtype)
+        for x in range(start, stop):
+            for y in range(0, cols):
+                M[x-start, y] = self.getValue2D(vlookup, x*cols+y, x, y)
+        return M
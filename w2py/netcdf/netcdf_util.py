@@ -12,30 +12,51 @@ The main points are:
 """
 
 # We use numpy for matrix data storage
-import numpy, datetime
+import os, glob, hashlib, numpy, datetime
 
 from w2py import log
 from w2py.datatype import datatype as datatype
 from w2py.datatype import radialset
 from w2py.datatype import latlongrid
+from w2py.datatype import sparselatlongrid
    
-def getDimension(data, dim):
-    """ Read in first element of a netcdf dimension...if there's an
-        exception return False. We have some optional dimension data, this
-        makes the code cleaner
-    """
-    haveIt = False
-    try:
-        data.getDimensionValue(dim, 0)
-        haveIt = True
-    except:
-        # Assume it's not there...
-        pass
-    return haveIt
+# Log the metadata of every radial as RadialSets are read.  Off by default,
+# there are hundreds of radials per file
+logRadials = False
+
+# Digest of our decoding code, see getDecoderVersion
+decoderDigest = None
+
+# Cells of sparse runs expanded at a time
+expandCells = 1024*1024
+
+def getDecoderVersion(net):
+    """ Get a version of how files are decoded with a reader, so grids
+        saved by the grid cache are decoded again after any change that
+        could give different values.  It's a digest of the source of the
+        readers, this module and the datatypes, with the reader name """
+    global decoderDigest
+    if decoderDigest is None:
+        h = hashlib.md5()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for folder in (here, os.path.join(os.path.dirname(here), "datatype")):
+            sources = sorted(glob.glob(os.path.join(folder, "*.py")))
+            if not sources:
+                sources = sorted(glob.glob(os.path.join(folder, "*.py[co]")))  # Shipped without source
+            for source in sources:
+                f = open(source, "rb")
+                try:
+                    h.update(f.read())
+                finally:
+                    f.close()
+        decoderDigest = h.hexdigest()
+    return "{0}:{1}".format(net, decoderDigest)
 
 # FIXME: Probably break up into classes eventually....
-def readRadialSet(data, isSparse):
-    """ Try to read in a NSSL RadialSet data format.
+def readRadialSet(data, isSparse, lazy=False, dtype=numpy.float32):
+    """ Try to read in a NSSL RadialSet data format.  The per radial
+        metadata is read in bulk.  When lazy, the data matrix is read
+        on the first getValues.  dtype is the type of the data matrix
     """
     # Get the radar elevation in degrees
     e = data.getAttributeValue("", "Elevation")
@@ -49,60 +70,58 @@ def readRadialSet(data, isSparse):
     
     # Read the main data of the file into 2D array
     datatype = data.getAttributeValue("", "TypeName")
-    # Assume Sparse
-    M = None
-    if isSparse:
-        log.info("Data type is SPARSE")
-        M = readSparseArray2Dfloat(data, datatype, "Azimuth", "Gate")
-    else:
+    def readRadials():
+        if isSparse:
+            log.info("Data type is SPARSE")
+            return readSparseArray2Dfloat(data, datatype, "Azimuth", "Gate", dtype)
         log.info("Data is not SPARSE")
-        M = readArray2Dfloat(data, datatype, "Azimuth", "Gate")
+        return readArray2Dfloat(data, datatype, "Azimuth", "Gate", dtype)
      
-    # Ok, now create the radial set
- 
-    if M != None:
-        log.info("X size is "+str(M.shape[0]))
-        log.info("Y size is "+str(M.shape[1]))  
-        num_radials = M.shape[0]
-        
-        # Get out 'lookups'  keys that depend on the library we're using
-        # they are used to access data at an index
-        haveAs = getDimension(data, "AzimuthalSpacing")
-        haveNy = getDimension(data, "NyquistVelocity")
-        azimuthL = data.getValueLookup("Azimuth")
-        beamwidthL = data.getValueLookup("BeamWidth")
-        if haveAs:
-            azimuthalSpacingL = data.getValueLookup("AzimuthalSpacing")
-        if haveNy:
-            nvl = data.getValueLookup("NyquistVelocity")
-        gatewidthL = data.getValueLookup("GateWidth")
-        nyquest = -99999.0
+    M = None
+    if lazy:
+        shape = (data.getDimensionSize("Azimuth"), data.getDimensionSize("Gate"))
+    else:
+        M = readRadials()
+        shape = M.shape
+    log.info("X size is "+str(shape[0]))
+    log.info("Y size is "+str(shape[1]))  
+    num_radials = shape[0]
         
+    # Read each radial's info in bulk.  Spacing defaults to the
+    # beamwidth and Nyquist to a flag value if the file doesn't have them
+    azimuth = data.getArray("Azimuth", float)
+    beamwidth = data.getArray("BeamWidth", float)
+    if data.haveVariable("AzimuthalSpacing"):
+        aspace = data.getArray("AzimuthalSpacing", float)
+    else:
+        aspace = beamwidth  # Spacing is equal to beamwidth
+    if data.haveVariable("NyquistVelocity"):
+        nyquist = data.getArray("NyquistVelocity", float)
+    else:
+        nyquist = numpy.empty(num_radials, float)
+        nyquist.fill(-99999.0)
+    gatewidth = data.getArray("GateWidth", float)
+    
+    if logRadials:
         for i in range(0,num_radials):
-            az = float(data.getValue(azimuthL, i))
-            bw = float(data.getValue(beamwidthL, i))
-            if haveAs:
-                aspace = float(data.getValue(azimuthalSpacingL, i))
-            else:
-                aspace = bw  # Spacing is equal to beamwidth
-            if haveNy:
-                ny = float(data.getValue(nvl, i))
-            else:
-                ny = nyquest
-            gw = int(data.getValue(gatewidthL, i)) 
-               
-            log.info("{0}, {1}, {2}, {3}, {4}".format(az,bw,aspace, ny,gw))
+            log.debug("{0}, {1}, {2}, {3}, {4}".format(azimuth[i], beamwidth[i],
+                                        aspace[i], nyquist[i], gatewidth[i]))
         
-        rs = radialset.RadialSet(M)
-        rs.setTypeName(datatype)   
-        return rs
-    else:
-        log.error("Could not find DataType attribute in Netcdf file.")
-        log.error("All NSSL netcdf data files should have this.")
-    return None
+    rs = radialset.RadialSet(M, elevation, distToFirstGate, azimuth, beamwidth,
+                             aspace, nyquist, gatewidth, shape)
+    if lazy:
+        rs.setLoader(readRadials)
+    rs.setLocation(float(data.getAttributeValue("", "Latitude")),
+                   float(data.getAttributeValue("", "Longitude")),
+                   float(data.getAttributeValue("", "Height")))
+    rs.setTypeName(datatype)   
+    return rs
 
-def readLatLonGrid(data, isSparse):
-    """ Try to read in a NSSL LatLonGrid data format
+def readLatLonGrid(data, isSparse, lazy=False, dtype=numpy.float32, keepSparse=False):
+    """ Try to read in a NSSL LatLonGrid data format.  When lazy, only
+        the header is read now and the grid is read on the first getValues.
+        dtype is the type of the grid.  keepSparse makes a sparse file a 
+        SparseLatLonGrid holding the runs instead of a dense grid
     """    
     log.debug("Entering readLatLonGrid")
     lat = float(data.getAttributeValue("", "Latitude"))
@@ -112,24 +131,47 @@ def readLatLonGrid(data, isSparse):
     
     # Read the main data of the file into 2D array
     datatype = data.getAttributeValue("", "TypeName")
-    # Assume Sparse
-    M = None
-    if isSparse:
-        log.info("Data type is SPARSE")
-        M = readSparseArray2Dfloat(data, datatype, "Lat", "Lon")
-    else:
+    def readGrid():
+        if isSparse:
+            log.info("Data type is SPARSE")
+            return readSparseArray2Dfloat(data, datatype, "Lat", "Lon", dtype)
         log.info("Data is not SPARSE")
-        M = readArray2Dfloat(data, datatype, "Lat", "Lon")
+        return readArray2Dfloat(data, datatype, "Lat", "Lon", dtype)
     
-    llg = latlongrid.LatLonGrid(M, lat, lon, dlat, dlon)
+    if isSparse and keepSparse:
+        shape = (data.getDimensionSize("Lat"), data.getDimensionSize("Lon"))
+        background = float(data.getAttributeValue(datatype, "BackgroundValue"))
+        def readRuns():
+            return readSparseRuns(data, datatype, dtype)
+        llg = sparselatlongrid.SparseLatLonGrid(None, None, None, None, background,
+                                                lat, lon, dlat, dlon, shape, 
+                                                numpy.float32 if dtype is None else dtype)
+        llg.setLoader(readRuns)
+        if not lazy:
+            llg.getRuns()
+    elif lazy:
+        shape = (data.getDimensionSize("Lat"), data.getDimensionSize("Lon"))
+        llg = latlongrid.LatLonGrid(None, lat, lon, dlat, dlon, shape)
+        llg.setLoader(readGrid)
+    else:
+        llg = latlongrid.LatLonGrid(readGrid(), lat, lon, dlat, dlon)
     llg.setTypeName(datatype)
     return llg
     
-def readNetcdfFile(data): 
+def readNetcdfFile(data, lazy=False, dtype=numpy.float32, keepSparse=False): 
     """ Read in a netcdf data file, look for our attributes.
         Using Arcpy's built in netcdf ability.  This of course relies on 
         the arcpy library.  Could wrap all the netcdf to allow plug-in of 
-        SciPy or another library
+        SciPy or another library.
+        lazy reads just the attributes, dimensions and radial metadata,
+        leaving the data matrix to be read when first used.  The reader has to 
+        stay open until then, the data object keeps it.
+        dtype is the type of the data matrix.  Our data is stored as 32 bit
+        floats, so float32 keeps it as is with half the memory of float64.
+        None keeps whatever type the file has.  Our flag values like 
+        missingData are exact in either float type.
+        keepSparse reads sparse LatLonGrids as SparseLatLonGrids, keeping
+        the runs of the file and only making a dense grid when asked.
     """  
     D = None  
     if data.haveAttribute("", "DataType"):
@@ -148,21 +190,21 @@ def readNetcdfFile(data):
         # We'll have to dispatch for RadialSet/LatLonGrid
         isSparse = "Sparse" in dataType
         if "RadialSet" in dataType:
-            D = readRadialSet(data, isSparse)
+            D = readRadialSet(data, isSparse, lazy, dtype)
         elif "LatLonGrid" in dataType:
-            D = readLatLonGrid(data, isSparse)
+            D = readLatLonGrid(data, isSparse, lazy, dtype, keepSparse)
         else:
             log.error("Can't process unknown DataType of "+dataType)
+        if D is not None:
+            D.setSparse(isSparse)
             
         # Try to get the time from the data file...
         if data.haveAttribute("", "Time"):
             t1 = long(data.getAttributeValue("", "Time"))
-            #t2 = float(0.0)
-            #if data.haveAttribute("", "FractionalTime"):
-            #   t2 = float(data.getAttributeValue("", "FractionalTime"))
-            #log.info("************************T1 is "+str(t1))
-            #log.info("************************T2 is "+str(t2))
-            #t1 = t1 + long(1000.0*t2)
+            t2 = float(0.0)
+            if data.haveAttribute("", "FractionalTime"):
+                t2 = float(data.getAttributeValue("", "FractionalTime"))
+            D.setEpochTime(t1+t2)
             theTime = datetime.datetime.fromtimestamp(t1).strftime('%Y-%m-%d %H:%M:%S UTC')
         else:
             # We don't care, just use current date...           
@@ -174,9 +216,33 @@ def readNetcdfFile(data):
         log.error("No DataType attribute found in NetCDF file.")
     return D
   
-def readArray2Dfloat(data, typename, rfield, cfield):
+def unpackValues(data, typename, values, dtype):
+    """ Turn data values stored as scaled integers into floats of the
+        given type (float32 for None).  Stored fill values become 
+        missingData.  Float values come back as they are.
+    """
+    if values.dtype.kind == "f" or not data.haveAttribute(typename, "scale_factor"):
+        return values
+    if dtype is None:
+        dtype = numpy.float32
+    scale = float(data.getAttributeValue(typename, "scale_factor"))
+    offset = 0.0
+    if data.haveAttribute(typename, "add_offset"):
+        offset = float(data.getAttributeValue(typename, "add_offset"))
+    unpacked = values.astype(dtype)
+    unpacked *= scale
+    unpacked += offset
+    for flag in ("_FillValue", "missing_value"):
+        if data.haveAttribute(typename, flag):
+            fill = data.getAttributeValue(typename, flag)
+            unpacked[values == fill] = datatype.missingData
+    log.info("Unpacked scaled values with scale {0}, offset {1}".format(scale, offset))
+    return unpacked
+  
+def readArray2Dfloat(data, typename, rfield, cfield, dtype=numpy.float32):
     """ Read in a non 2D array from our netcdf data and expand. 
         For the initial project, we will just handle sparse data.
+        dtype is the type of the array, None for the type in the file
     """    
     #log.info("NUMPY version is {0}".format(numpy.version.version))
 
@@ -185,33 +251,56 @@ def readArray2Dfloat(data, typename, rfield, cfield):
     # Humm..need this index I think.  Don't know how to use it properly
     #index = data.getDimensionIndex(typename)
     
-    #log.info("Filling in data values "+str(rows)+","+str(cols))
-    M = numpy.empty((rows,cols), float)
-    i = 0
-    notify = 0
-    totalCells = 0
-    allCells = rows*cols
     log.info("Type name comes in as "+typename)
-    values = data.getValueLookup(typename)
-    log.info("Type name of values is "+str(type(values)))
-    for x in range(0,rows):
-        for y in range(0, cols):
-            M[x,y] = float(data.getValue2D(values, i, x, y))
-            i = i + 1
-            notify += 1
-            totalCells += 1
-            if notify > 10000:
-                log.info("Processed {0} of {1} data samples.".format(totalCells, allCells))
-                notify = 0
-    log.info("Processed {0} of {1} data samples.".format(totalCells, allCells))
+    M = unpackValues(data, typename, data.getArray(typename, None, (rows, cols)), dtype)
+    if dtype is not None:
+        M = M.astype(dtype, copy=False)
+    log.info("Processed {0} data samples.".format(M.size))
     return M
 
-def readSparseArray2Dfloat(data, typename, rfield, cfield):  
-    """ Read in a sparse 2D array from our netcdf data and expand. 
-    """    
-    backgroundValue = float(data.getAttributeValue(typename, "BackgroundValue"))
-    log.info("Background value is "+str(backgroundValue))
+def expandSparseRuns(M, values, x, y, counts):
+    """ Expand sparse run length pixels into the dense matrix M in place.
+        values, x, y and counts are equal length numpy arrays of the sparse
+        pixel data.  Each pixel is a strip of 'count' cells starting at
+        row x, column y, wrapping into the next row when it runs off the
+        end of a row.  Pixels at or below missingData leave the background
+        alone.  A count below 1 still sets the cell the pixel starts at.
+        Cells off the end of the grid are dropped instead of raising an
+        IndexError.  Returns the number of cells written.
+    """
+    cols = M.shape[1]
+    
+    # Only valid data replaces the background
+    keep = values > datatype.missingData
+    values = values[keep]
+    counts = numpy.clip(counts[keep], 1, M.size)
+    starts = x[keep]*cols + y[keep]
     
+    # A block of runs of about expandCells cells at a time, the index of
+    # every cell takes 8 bytes, more than the grid itself
+    ends = numpy.cumsum(counts)
+    written = 0
+    r0 = 0
+    while r0 < len(counts):
+        r1 = numpy.searchsorted(ends, ends[r0]-counts[r0]+expandCells, "right")
+        r1 = max(r0+1, int(r1))
+        index = sparselatlongrid.runIndices(starts[r0:r1], counts[r0:r1])
+        cells = numpy.repeat(values[r0:r1], counts[r0:r1])
+        
+        # Strips that run off the end of the grid are clipped
+        inside = (index >= 0) & (index < M.size)
+        if not inside.all():
+            index, cells = index[inside], cells[inside]
+        M.flat[index] = cells
+        written += len(index)
+        r0 = r1
+    return written
+
+def readSparseRuns(data, typename, dtype=numpy.float32):
+    """ Read the runs of a sparse 2D array from our netcdf data as the
+        numpy arrays (values, x, y, counts).  dtype is the type of the
+        values, None for the type in the file
+    """
     num_pixels = data.getDimensionSizeByVariable("pixel_x")
     
     # Try to get the count field, if any.  This will cause an exception if missing.  This is
@@ -224,60 +313,37 @@ def readSparseArray2Dfloat(data, typename, rfield, cfield):
         # Assume it's not there...
         pass
     
-    #log.info("NUMPY version is {0}".format(numpy.version.version))
+    # Basically, for sparse array.  We have an 'x' and 'y' that tell position into the array, and
+    # a possible 'pixel_count' which is a line of same data value.
+    values = unpackValues(data, typename, data.getArray(typename, None), dtype)
+    if dtype is not None:
+        values = values.astype(dtype, copy=False)
+    x = data.getArray("pixel_x", numpy.int64)
+    y = data.getArray("pixel_y", numpy.int64)
+    if haveCount:
+        counts = data.getArray("pixel_count", numpy.int64)
+    else:
+        counts = numpy.ones(num_pixels, numpy.int64)
+    return (values, x, y, counts)
 
-    # Bleh, Arcgis 10.2 has numpy 1.7, so we can't fill with background value automatically
+def readSparseArray2Dfloat(data, typename, rfield, cfield, dtype=numpy.float32):  
+    """ Read in a sparse 2D array from our netcdf data and expand. 
+        dtype is the type of the array, None for the type in the file
+    """    
+    backgroundValue = float(data.getAttributeValue(typename, "BackgroundValue"))
+    log.info("Background value is "+str(backgroundValue))
+    
+    values, x, y, counts = readSparseRuns(data, typename, dtype)
+    if dtype is None:
+        dtype = values.dtype
+    
+    # Arcgis 10.2 has numpy 1.7, so no numpy.full.  Fill does the same
     rows = data.getDimensionSize(rfield)
     cols = data.getDimensionSize(cfield)
     log.info("Creating background array of {0}, {1}".format(rows, cols))
-    M = numpy.empty((rows,cols), float)
-    for x in range(0,rows):
-        for y in range(0,cols):
-            M[x,y] = backgroundValue
-    
-    # Basically, for sparse array.  We have an 'x' and 'y' that tell position into the array, and
-    # a possible 'pixel_count' which is a line of same data value.
-    #log.info("Filling in data values")
-    actualData = 0
-    notify = 0
-    totalCells = 0
-    pixelL = data.getValueLookup(typename)
-    pixel_xL = data.getValueLookup("pixel_x")
-    pixel_yL = data.getValueLookup("pixel_y")
-    if haveCount:
-        pixel_countL = data.getValueLookup("pixel_count")
+    M = numpy.empty((rows,cols), dtype)
+    M.fill(backgroundValue)
     
-    for i in range(0, num_pixels,1):
-
-        # Data value and the sparse x, y location in full matrix
-        value = float(data.getValue(pixelL, i))
-        x = int(data.getValue(pixel_xL, i))
-        y = int(data.getValue(pixel_yL, i))
-        
-        # Each can be a line strip of values at the location
-        if haveCount:
-            count = int(data.getValue(pixel_countL, i))
-        else:
-            count = 1
-        #log.info("**************Count is "+str(haveCount))    
-        if value > datatype.missingData:
-            M[x, y] = value
-            actualData += 1
-        totalCells += 1
-        notify += 1
-        
-        if notify > 10000:
-                log.info("Processed {0} of {1} data samples.".format(totalCells, num_pixels))
-                notify = 0
-        # Fill in line strip
-        for j in range(1, count, 1):
-            y += 1
-            if y == cols:
-                x += 1   # new row
-                y = 0
-            if value > datatype.missingData:
-                M[x, y] = value
-                actualData += 1  
-            #print x, y, count, "set to", value
-    log.info("Processed {0} of {1} data samples.".format(totalCells, num_pixels))
+    actualData = expandSparseRuns(M, values, x, y, counts)
+    log.info("Processed {0} data samples, {1} cells of actual data.".format(len(values), actualData))
     return M
@@ -0,0 +1,205 @@
+"""
+Netcdf writer
+
+Write our data types back out as WDSS2 netcdf files, the same layout
+readNetcdfFile reads, so derived products like mosaics and accumulations
+can go back into a WDSS2 system.  LatLonGrids and RadialSets can be written
+dense, one value per cell, or sparse as runs of equal values over a
+background value:
+    pixel_x, pixel_y: the row and column each run starts at
+    pixel_count: the cells in the run, going on into the next row
+The runs are found with numpy over the whole grid at once, no loop over
+cells.  Most of our grids are mostly missing, so sparse files are a lot
+smaller.
+
+We use the scipy netcdf_file class, which writes classic netcdf like WDSS2
+does.  A filename ending in .gz is gzipped.  Files are written to a temp
+file next to them and renamed, so something watching the folder never
+reads half of one.
+
+@author: Robert Toomey (retoomey)
+"""
+
+import os, gzip, shutil, tempfile
+import numpy
+
+# Scipy is optional, only writing needs it
+try:
+    from scipy.io import netcdf_file
+except ImportError:
+    netcdf_file = None
+
+from w2py import log
+from w2py.datatype import datatype
+from w2py.datatype import radialset
+from w2py.datatype import latlongrid
+from w2py.datatype import sparselatlongrid
+
+# Bytes a sparse file takes per run and a dense file per cell
+runBytes = 12
+cellBytes = 4
+
+def findRuns(M, background):
+    """ Find the runs of equal values of a 2D grid that aren't the
+        background, in row order, letting runs go on into the next row.
+        Returns (values, starts, counts), starts is the flat cell index
+        each run begins at """
+    flat = M.ravel()
+    index = numpy.flatnonzero(flat != background)
+    if len(index) == 0:
+        return (numpy.empty(0, flat.dtype), numpy.empty(0, numpy.int64),
+                numpy.empty(0, numpy.int64))
+    values = flat[index]
+
+    # A run begins where the cells stop being next to each other or the
+    # value changes
+    begins = numpy.empty(len(index), bool)
+    begins[0] = True
+    begins[1:] = (index[1:] != index[:-1]+1) | (values[1:] != values[:-1])
+    first = numpy.flatnonzero(begins)
+    counts = numpy.diff(numpy.append(first, len(index)))
+    return (values[first], index[first].astype(numpy.int64), counts.astype(numpy.int64))
+
+def getRuns(D, background):
+    """ Get the (values, starts, counts) runs of a data object.  A
+        SparseLatLonGrid already has its runs, over its own background """
+    if isinstance(D, sparselatlongrid.SparseLatLonGrid) and \
+       D.getBackground() == background:
+        return D.getRuns()
+    return findRuns(D.getValues(), background)
+
+def writeHeader(f, D, dataType, lat, lon, height):
+    """ Write the global attributes every WDSS2 file has.  Scipy writes a
+        python float as a 32 bit float, so locations and times are given
+        as numpy doubles """
+    f.TypeName = D.getTypeName()
+    f.DataType = dataType
+    f.Latitude = numpy.float64(lat)
+    f.Longitude = numpy.float64(lon)
+    f.Height = numpy.float64(height)
+    t = D.getEpochTime()
+    if t is not None:
+        f.Time = int(numpy.floor(t))
+        f.FractionalTime = numpy.float64(t-numpy.floor(t))
+    f.attributes = ""
+    f.MissingData = datatype.missingData
+    f.RangeFolded = datatype.rangeFolded
+
+def writeData(f, D, rfield, cfield, runs, background):
+    """ Write the data variable, dense over rfield, cfield or sparse over
+        pixels when given runs """
+    typeName = D.getTypeName()
+    if runs is None:
+        var = f.createVariable(typeName, "f", (rfield, cfield))
+        var[:] = D.getValues()
+        var.Units = "dimensionless"
+        return
+    values, starts, counts = runs
+    cols = D.shape[1]
+    f.createDimension("pixel", len(values))
+    var = f.createVariable(typeName, "f", ("pixel",))
+    var[:] = values
+    var.Units = "dimensionless"
+    var.BackgroundValue = float(background)
+    var.NumValidRuns = len(values)
+
+    # Shorts like WDSS2 when the grid is small enough for them
+    index = "i"
+    if max(D.shape) <= numpy.iinfo(numpy.int16).max:
+        index = "h"
+    x = f.createVariable("pixel_x", index, ("pixel",))
+    x[:] = starts // cols
+    y = f.createVariable("pixel_y", index, ("pixel",))
+    y[:] = starts % cols
+    c = f.createVariable("pixel_count", "i", ("pixel",))
+    c[:] = counts
+
+def writeNetcdfFile(D, filename, sparse=None, background=datatype.missingData, height=0.0):
+    """ Write a LatLonGrid or RadialSet as a WDSS2 netcdf file.
+        sparse: True for runs, False for a dense grid, None to pick the
+                smaller.  A SparseLatLonGrid is always written sparse, from
+                its own runs when its background is the one given
+        background: value of the cells a sparse file leaves out
+        height: height of a LatLonGrid in meters, RadialSets have theirs
+        Returns the filename """
+    if netcdf_file is None:
+        raise ValueError("Writing netcdf files needs the scipy library")
+    if isinstance(D, sparselatlongrid.SparseLatLonGrid):
+        sparse = True
+        background = D.getBackground()
+    runs = None
+    if sparse or sparse is None:
+        runs = getRuns(D, background)
+        if sparse is None and len(runs[0])*runBytes >= D.shape[0]*D.shape[1]*cellBytes:
+            runs = None
+
+    folder = os.path.dirname(os.path.abspath(filename))
+    handle, temp = tempfile.mkstemp(".tmp", "."+os.path.basename(filename), folder)
+    os.close(handle)
+    try:
+        f = netcdf_file(temp, "w")
+        try:
+            if isinstance(D, latlongrid.LatLonGrid):
+                writeLatLonGrid(f, D, runs, background, height)
+            elif isinstance(D, radialset.RadialSet):
+                writeRadialSet(f, D, runs, background)
+            else:
+                raise ValueError("Can't write a {0} as netcdf".format(type(D).__name__))
+        finally:
+            f.close()
+        if filename.endswith(".gz"):
+            gzipFile(temp)
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(temp, filename)
+    finally:
+        # Only left when something went wrong
+        if os.path.exists(temp):
+            os.remove(temp)
+    log.info("Wrote {0} {1} to {2}".format("sparse" if runs is not None else "dense",
+                                           D.getTypeName(), filename))
+    return filename
+
+def writeLatLonGrid(f, llg, runs, background, height):
+    """ Write the dimensions, attributes and data of a LatLonGrid """
+    lon, lat = llg.getUpperLeft()
+    writeHeader(f, llg, "SparseLatLonGrid" if runs is not None else "LatLonGrid",
+                lat, lon, height)
+    f.LatGridSpacing = numpy.float64(llg.getCellSizeY())
+    f.LonGridSpacing = numpy.float64(llg.getCellSizeX())
+    f.createDimension("Lat", llg.shape[0])
+    f.createDimension("Lon", llg.shape[1])
+    writeData(f, llg, "Lat", "Lon", runs, background)
+
+def writeRadialSet(f, rs, runs, background):
+    """ Write the dimensions, attributes, radial info and data of a RadialSet """
+    lat, lon, height = rs.getLocation() or (0.0, 0.0, 0.0)
+    writeHeader(f, rs, "SparseRadialSet" if runs is not None else "RadialSet",
+                lat, lon, height)
+    f.Elevation = numpy.float64(rs.getElevation())
+    f.ElevationUnits = "Degrees"
+    f.RangeToFirstGate = numpy.float64(rs.getRangeToFirstGate())
+    f.RangeToFirstGateUnits = "Meters"
+    f.createDimension("Azimuth", rs.shape[0])
+    f.createDimension("Gate", rs.shape[1])
+    for name, values in (("Azimuth", rs.getAzimuths()), ("BeamWidth", rs.getBeamWidths()),
+                         ("AzimuthalSpacing", rs.getAzimuthalSpacings()),
+                         ("GateWidth", rs.getGateWidths()),
+                         ("NyquistVelocity", rs.getNyquistVelocities())):
+        var = f.createVariable(name, "f", ("Azimuth",))
+        var[:] = values
+    writeData(f, rs, "Azimuth", "Gate", runs, background)
+
+def gzipFile(filename):
+    """ Gzip a file in place """
+    i = open(filename, "rb")
+    try:
+        o = gzip.GzipFile(filename+".gz", "wb")
+        try:
+            shutil.copyfileobj(i, o, 1024*1024)
+        finally:
+            o.close()
+    finally:
+        i.close()
+    os.remove(filename)
+    os.rename(filename+".gz", filename)
@@ -8,6 +8,7 @@ This isn't installed in arcgis python by default, but this class is faster.
 """  
 
 import Scientific.IO.NetCDF
+import numpy
 from w2py import log
 import netcdf_reader
 
@@ -31,6 +32,9 @@ class sciNetcdfReader(netcdf_reader.netcdfReader):
     def haveDimension(self, dim):
         return hasattr(self.data, dim)
     
+    def haveVariable(self, var):
+        return var in self.data.variables
+    
     def haveAttribute(self, param1, param2):
         if param1 == "":
             return hasattr(self.data, param2)
@@ -78,4 +82,11 @@ class sciNetcdfReader(netcdf_reader.netcdfReader):
         return vlookup[index]
     
     def getValue2D(self, vlookup, index, x, y):
-        return vlookup[x, y]  
\ No newline at end of file
+        return vlookup[x, y]  
+    
+    def getArray(self, param1, dtype=float, shape=None):
+        # Scientific already reads the whole variable as a numpy array
+        return numpy.asarray(self.data.variables[param1].getValue(), dtype)
+    
+    def getSlice(self, param1, start, stop, dtype=float, shape=None):
+        return numpy.asarray(self.data.variables[param1][start:stop], dtype)
@@ -0,0 +1,114 @@
+"""
+Scipy Netcdf Reader class file
+
+This reader uses the scipy.io netcdf_file class to access a netcdf file.
+The file is memory mapped, so variables come back as views into the file 
+instead of being copied into python memory.  Small compressed files are 
+read straight from the gzip stream, so only their variables end up in 
+memory, not a copy of the whole file.  Big ones are uncompressed to a 
+temp file (tmpfs if we have one) and memory mapped like any other.  WDSS2 
+files are classic netcdf, which is all scipy can read.  No arcpy needed.
+
+@author: Robert Toomey (retoomey)
+"""  
+
+import scipy.io
+import numpy, gzip, time
+from w2py import log
+import netcdf_reader
+
+# Compressed files bigger than this uncompressed are mapped from a temp file
+mapBytes = 64*1024*1024
+
+class scipyNetcdfReader(netcdf_reader.netcdfReader):
+    
+    def __init__(self, datafile):           
+        """ Open NetCDF file with the scipy library, memory mapped
+        """
+        super(type(self), self).__init__()
+        self.data = None
+        log.info("Trying to read netcdf "+datafile)
+        try:
+            # We can't map a gzip stream, scipy copies each variable out
+            # of it instead.  Fine for small files, big ones get a temp file
+            # so their variables stay on disk until used
+            size = None
+            if datafile.endswith(".gz"):
+                size = self.getUncompressedSize(datafile)
+            if size is not None and size <= mapBytes:
+                self.setFileLocation(datafile)
+                start = time.time()
+                self.data = scipy.io.netcdf_file(gzip.GzipFile(datafile, "rb"), "r", mmap=False)
+                log.info("Uncompressed {0} bytes from the gzip stream in {1:.3f} seconds".format(
+                         size, time.time()-start))
+            else:
+                datafile = self.uncompressTempFile(datafile)
+                self.data = scipy.io.netcdf_file(datafile, "r", mmap=True)
+        except BaseException as e:
+            log.error("Couldn't read netcdf data from file "+datafile)
+            log.error("Exception {0}".format(e))
+    
+    def __del__(self):       
+        # Close our file before calling superclass, 
+        # since superclass might delete it.  Scipy leaves the map open
+        # (with a warning) while any of our views are still alive
+        if self.data:
+            self.data.close()
+        super(type(self), self).__del__()
+        
+    def haveDimension(self, dim):
+        return dim in self.data.dimensions
+    
+    def haveVariable(self, var):
+        return var in self.data.variables
+    
+    def haveAttribute(self, param1, param2):
+        if param1 == "":
+            return param2 in self.data._attributes
+        else:
+            var = self.data.variables.get(param1)
+            return var is not None and param2 in var._attributes
+    
+    def getAttributeValue(self, param1, param2):
+        # "" for param1 is global attribute, otherwise variable
+        if param1 == "":
+            value = self.data._attributes[param2]
+        else:
+            value = self.data.variables[param1]._attributes[param2]
+        # Scipy gives back bytes for text and 1 element arrays for numbers
+        if isinstance(value, bytes):
+            return value.decode("ascii")
+        if isinstance(value, numpy.ndarray) and value.size == 1:
+            return value[0]
+        return value
+    
+    def getDimensionSize(self, param1):
+        return int(self.data.dimensions[param1])
+    
+    def getDimensionSizeByVariable(self, param1):
+        # The variable shape is right even for the 'unlimited' dimension,
+        # which scipy reports as None
+        return int(self.data.variables[param1].shape[0])
+    
+    def getValueLookup(self, param1):
+        # The memory mapped array of the variable
+        return self.data.variables[param1].data
+    
+    def getValue(self, vlookup, index):
+        return vlookup[index]
+    
+    def getValue2D(self, vlookup, index, x, y):
+        return vlookup[x, y]
+    
+    def getArray(self, param1, dtype=float, shape=None):
+        # A view into the file unless we have to convert the type
+        values = self.data.variables[param1].data
+        if dtype is None:
+            return values
+        return values.astype(dtype, copy=False)
+    
+    def getSlice(self, param1, start, stop, dtype=float, shape=None):
+        values = self.data.variables[param1].data[start:stop]
+        if dtype is None:
+            return values
+        return values.astype(dtype, copy=False)
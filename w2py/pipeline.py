@@ -0,0 +1,164 @@
+'''
+Pipeline
+
+Run work through a chain of stages, each with its own threads, connected by
+bounded queues.  A batch conversion reads and decodes a file, writes a
+raster, renders a PNG and writes a page.  Done one after another the disk
+sits idle while we decode and the CPU waits while we write.  As stages they
+overlap: one file is being rendered while the next is decoding.  Threads
+are enough for that, since file reads and writes, gzip and numpy let go of
+the python lock while they work.
+
+The queues between stages are small, and only so many items are in the
+pipeline at once, so a slow stage holds up the ones before it instead of
+piling up work in memory.  Each stage keeps track of how many items it
+handled and how long it was busy, so a report shows the bottleneck.
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import threading, time, Queue
+
+# Imports from my library
+import log
+
+class Stage(object):
+    def __init__(self, name, func, threads=1, queueSize=2):
+        """ One step of a pipeline.
+            name: name for the report
+            func: function taking an item and returning the item for the
+                  next stage
+            threads: threads running func at once
+            queueSize: items waiting for this stage before the stage
+                       before it has to wait
+        """
+        self.name = name
+        self.func = func
+        self.threads = max(1, int(threads))
+        self.queue = Queue.Queue(max(1, queueSize))
+        self.lock = threading.Lock()
+        self.running = 0
+        self.count = 0
+        self.busy = 0.0
+
+    def addTime(self, seconds):
+        """ Count one handled item that took seconds """
+        with self.lock:
+            self.count += 1
+            self.busy += seconds
+
+class Pipeline(object):
+    def __init__(self, stages):
+        """ Make a pipeline from a list of Stages, in order """
+        self.stages = stages
+        self.results = Queue.Queue()
+        self.wall = 0.0
+        self.feedError = None
+
+        # Everything in the queues and threads at once, plus one more waiting
+        # to go in.  Results are given back in order, so this also bounds
+        # the finished ones held waiting on a slow earlier item
+        self.limit = sum(s.threads+s.queue.maxsize for s in stages)+1
+
+    def work(self, i):
+        """ Thread loop for stage i.  An item is (sequence, value, error),
+            once there's an error the later stages pass it on untouched.
+            None means no more items, the last thread of a stage to see it
+            tells the next stage """
+        stage = self.stages[i]
+        if i+1 < len(self.stages):
+            nextQueue = self.stages[i+1].queue
+        else:
+            nextQueue = self.results
+        while True:
+            item = stage.queue.get()
+            if item is None:
+                break
+            seq, value, error = item
+            if error is None:
+                start = time.time()
+                try:
+                    value = stage.func(value)
+                except Exception as e:
+                    error = str(e.args)
+                stage.addTime(time.time()-start)
+            nextQueue.put((seq, value, error))
+        with stage.lock:
+            stage.running -= 1
+            last = (stage.running == 0)
+        if last:
+            if i+1 < len(self.stages):
+                for t in range(self.stages[i+1].threads):
+                    nextQueue.put(None)
+            else:
+                nextQueue.put(None)
+
+    def feed(self, items, room):
+        """ Thread loop putting the items into the first stage.  If getting
+            the items fails the error is kept for run to raise, the stages
+            still get their None so the ones already in finish """
+        first = self.stages[0]
+        try:
+            for seq, value in enumerate(items):
+                room.acquire()
+                first.queue.put((seq, value, None))
+        except Exception as e:
+            self.feedError = e
+        finally:
+            for t in range(first.threads):
+                first.queue.put(None)
+
+    def run(self, items):
+        """ Put items through the pipeline, yielding (item, error) in the
+            order the items came.  item is what the last stage returned,
+            or the item as far as it got if error isn't None.  An error
+            getting the items is raised after the ones before it are given """
+        start = time.time()
+        self.feedError = None
+        room = threading.Semaphore(self.limit)
+        threads = [threading.Thread(target=self.feed, args=(items, room))]
+        for i, stage in enumerate(self.stages):
+            stage.running = stage.threads
+            for t in range(stage.threads):
+                threads.append(threading.Thread(target=self.work, args=(i,)))
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        # Hold finished items until the ones before them are done
+        done = {}
+        wanted = 0
+        while True:
+            item = self.results.get()
+            if item is None:
+                break
+            done[item[0]] = item
+            while wanted in done:
+                seq, value, error = done.pop(wanted)
+                wanted += 1
+                room.release()
+                yield (value, error)
+        self.wall += time.time()-start
+        if self.feedError is not None:
+            raise self.feedError
+
+    def report(self):
+        """ Log the throughput of each stage.  Busy is the share of its
+            threads' time a stage was working, the bottleneck is the stage
+            busiest on it """
+        log.info("Pipeline of {0:.2f} seconds:".format(self.wall))
+        worst = None
+        for stage in self.stages:
+            busy = 0.0
+            if self.wall > 0:
+                busy = stage.busy/(stage.threads*self.wall)
+            rate = 0.0
+            if stage.busy > 0:
+                rate = stage.count*stage.threads/stage.busy
+            log.info("  {0}: {1} items, {2} threads, {3:.2f} items/second, {4:.0%} busy".format(
+                     stage.name, stage.count, stage.threads, rate, busy))
+            if worst is None or busy > worst[1]:
+                worst = (stage.name, busy)
+        if worst is not None:
+            log.info("  Bottleneck stage is "+worst[0])
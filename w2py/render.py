@@ -0,0 +1,135 @@
+'''
+Render utilities
+
+Draw a LatLonGrid straight to a PNG file without arcpy.  The grid values go
+through a color lookup table, the USA map outlines from our basemap cache go
+on top, and we write the PNG ourselves with zlib.  This runs on headless machines and is a lot
+faster than building a map document for every image.
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import os, struct, zlib, hashlib
+import numpy
+
+# Imports from my library
+import log
+import w2py.resource as w2res
+import w2py.basemap as w2basemap
+from w2py.datatype import datatype
+
+class ColorMap(object):
+    def __init__(self, colors, low, high, background=(255, 255, 255)):
+        """ A stretched color map.
+            colors: (N, 3) uint8 lookup table from low to high
+            low, high: the data values stretched over the table.  Values
+            outside clamp to the end colors
+            background: color for missing data """
+        self.colors = numpy.asarray(colors, numpy.uint8)
+        self.low = float(low)
+        self.high = float(high)
+        self.background = numpy.asarray(background, numpy.uint8)
+
+        # Last entry of the table is the background, so missing data
+        # is just one more index into it
+        self.table = numpy.vstack((self.colors, self.background))
+
+    def getKey(self):
+        """ Get a digest of everything deciding the colors we make """
+        h = hashlib.md5(repr((self.low, self.high)).encode("utf-8"))
+        h.update(numpy.ascontiguousarray(self.table).data)
+        return h.hexdigest()
+
+def hsvRamp(hsv1, hsv2, size=256):
+    """ Get an algorithmic color ramp like ArcGIS makes, interpolating
+        between two hue (degrees), saturation, value (0-1) colors.
+        Returns a (size, 3) uint8 table """
+    t = numpy.linspace(0.0, 1.0, size)
+    h = (hsv1[0]+(hsv2[0]-hsv1[0])*t) % 360.0
+    s = hsv1[1]+(hsv2[1]-hsv1[1])*t
+    v = hsv1[2]+(hsv2[2]-hsv1[2])*t
+
+    # Standard hsv to rgb, one sector of the hue wheel at a time
+    sector = numpy.floor(h/60.0).astype(int) % 6
+    frac = h/60.0-numpy.floor(h/60.0)
+    p = v*(1.0-s)
+    q = v*(1.0-s*frac)
+    r = v*(1.0-s*(1.0-frac))
+    choices = [(v, r, p), (q, v, p), (p, v, r), (p, q, v), (r, p, v), (v, p, q)]
+    rgb = numpy.empty((size, 3), float)
+    for i, c in enumerate(choices):
+        pick = sector == i
+        for band in range(3):
+            rgb[pick, band] = c[band][pick]
+    return numpy.round(rgb*255.0).astype(numpy.uint8)
+
+def getCloudCoverColorMap():
+    """ Get the color map matching our cloudcover.lyr symbology, the
+        ArcGIS 'Cyan-Light to Blue-Dark' ramp stretched from 10 to 82.2086 """
+    return ColorMap(hsvRamp((180.0, 0.15, 1.0), (240.0, 1.0, 0.55)), 10.0, 82.2086)
+
+def colorize(M, colorMap):
+    """ Turn a 2D grid of values into a (rows, cols, 3) uint8 image through
+        the color lookup table.  Missing data and the other flag values
+        get the background color """
+    size = len(colorMap.colors)
+    scale = (size-1)/(colorMap.high-colorMap.low)
+
+    # One index per cell, then a single lookup does the coloring.  Tables
+    # are small, so a 16 bit index keeps the temporary small too
+    index = numpy.clip((M-colorMap.low)*scale, 0, size-1).astype(numpy.uint16)
+    index[M <= datatype.missingData] = size
+    return colorMap.table[index]
+
+def writePNG(filename, image, level=6):
+    """ Write a (rows, cols, 3) RGB or (rows, cols, 4) RGBA uint8 image as
+        a PNG file.  level is the zlib level, 1 is fastest """
+    height, width, channels = image.shape
+    colorType = {3:2, 4:6}[channels]
+
+    # Each row starts with its filter type, 0 is none
+    raw = numpy.zeros((height, width*channels+1), numpy.uint8)
+    raw[:, 1:] = image.reshape((height, width*channels))
+
+    def chunk(tag, data):
+        crc = zlib.crc32(tag+data) & 0xffffffff
+        return struct.pack(">I", len(data))+tag+data+struct.pack(">I", crc)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, colorType, 0, 0, 0)
+    f = open(filename, "wb")
+    try:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", header))
+        f.write(chunk(b"IDAT", zlib.compress(raw.data, level)))
+        f.write(chunk(b"IEND", b""))
+    finally:
+        f.close()
+
+def renderLatLonGrid(llg, colorMap=None, mapColor=(64, 64, 64), basemap=None, width=None):
+    """ Render a LatLonGrid to an RGB image, one pixel per cell, with the
+        USA map outlines on top.  The outlines come from the given
+        BasemapCache, or the default one.  With a width, the coarsest
+        overview of the grid at least that wide is drawn instead, so the
+        work goes with the image size and not the grid size """
+    if width:
+        llg = llg.getOverviewFor(width)
+    if colorMap is None:
+        colorMap = getCloudCoverColorMap()
+    if basemap is None:
+        basemap = w2basemap.defaultCache
+    image = colorize(llg.getValues(), colorMap)
+    lines = basemap.getLatLonGridLines(llg)
+    image.reshape((-1, image.shape[2]))[lines] = mapColor
+    return image
+
+def genPNGFile(D, outHTMLFolder, outputPNGfile, colorMap=None, basemap=None, width=None):
+    """ Given one of our LatLonGrid objects, output it as a PNG without
+        arcpy, optionally a preview about width pixels wide. Return the 
+        full path to new image file"""
+    workpng = w2res.getTempFile(outHTMLFolder, outputPNGfile)
+    if os.path.isfile(workpng):
+        os.remove(workpng)
+    writePNG(workpng, renderLatLonGrid(D, colorMap, basemap=basemap, width=width))
+    log.info("Wrote png of map to "+workpng)
+    return workpng
@@ -0,0 +1,310 @@
+'''
+Radial resampling
+
+Turn a RadialSet into a LatLonGrid centered on the radar.  The bearing and
+range of each grid cell from the radar only depend on the radar location,
+elevation and gate layout, which stay the same from scan to scan.  So we
+work out the trigonometry once per geometry and keep it as a polar map: the
+bearing of every grid cell and the gate covering it.  The radial azimuths
+can move a little from scan to scan, so they aren't part of it.  A search
+of the cell bearings in a scan's sorted azimuths finds each cell's radial,
+giving an index map: the flat index of the gate covering every cell.  Most
+scans repeat the azimuths of one before, so index maps are kept too, by
+geometry and azimuth layout, and resampling is one gather through one.
+
+Beam heights use the usual 4/3 earth radius model for standard refraction.
+Polar and index maps are kept in memory with least recently used eviction,
+and saved to a cache folder so the next run doesn't compute them again.
+The folder is kept under a size, dropping the maps used longest ago.
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import os, hashlib, threading, tempfile
+from collections import OrderedDict
+import numpy
+
+# Imports from my library
+import log
+import w2py.resource as w2res
+from w2py.datatype import datatype
+from w2py.datatype.latlongrid import LatLonGrid
+
+earthRadius = 6371000.0                  # meters
+effectiveRadius = earthRadius*4.0/3.0    # 4/3 earth for beam propagation
+defaultCellSize = 0.01                   # degrees
+blockRows = 256                          # rows of the map computed at a time
+defaultMaxBytes = 512*1024**2            # size of the maps kept in the cache folder
+
+def getRadialGrid(rs, cellSize=defaultCellSize):
+    """ Get the geometry of a grid covering the whole range of a RadialSet,
+        as (lat, lon, dlat, dlon, rows, cols) with lat, lon the upper left """
+    lat, lon, height = rs.getLocation()
+    maxRange = rs.getRangeToFirstGate()+rs.getNumGates()*float(rs.getGateWidths()[0])
+
+    # Ground distance is never more than the slant range, so that covers it
+    halfLat = numpy.degrees(maxRange/earthRadius)
+    halfLon = halfLat/numpy.cos(numpy.radians(lat))
+    rows = int(numpy.ceil(2.0*halfLat/cellSize))
+    cols = int(numpy.ceil(2.0*halfLon/cellSize))
+    return (lat+rows*cellSize/2.0, lon-cols*cellSize/2.0, cellSize, cellSize, rows, cols)
+
+def computePolarMap(location, elevation, firstGate, gateWidth, gates, grid):
+    """ Find the bearing of each cell of a grid from the radar and the gate
+        covering it.
+        location: radar [lat, lon, height]
+        elevation: elevation angle in degrees
+        firstGate, gateWidth: range to the first gate and gate width in meters
+        gates: number of gates in a radial
+        grid: (lat, lon, dlat, dlon, rows, cols) from getRadialGrid
+        Returns (bearing, gate), float32 degrees and int32 (rows, cols)
+        arrays, gate is -1 where no gate reaches the cell """
+    upper, left, dlat, dlon, rows, cols = grid
+    lat0 = numpy.radians(location[0])
+    e = numpy.radians(elevation)
+    dLon = numpy.radians(left+(numpy.arange(cols)+0.5)*dlon-location[1])
+    sinHalfDLon = numpy.sin(dLon/2.0)
+
+    bearings = numpy.empty((rows, cols), numpy.float32)
+    gateIndex = numpy.empty((rows, cols), numpy.int32)
+    for r0 in range(0, rows, blockRows):
+        r1 = min(rows, r0+blockRows)
+        phi = numpy.radians(upper-(numpy.arange(r0, r1)+0.5)*dlat)[:, numpy.newaxis]
+
+        # Great circle angle and bearing from the radar to the cell centers
+        a = numpy.sin((phi-lat0)/2.0)**2+numpy.cos(lat0)*numpy.cos(phi)*sinHalfDLon**2
+        angle = 2.0*numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
+        bearing = numpy.degrees(numpy.arctan2(numpy.sin(dLon)*numpy.cos(phi),
+                  numpy.cos(lat0)*numpy.sin(phi)-numpy.sin(lat0)*numpy.cos(phi)*numpy.cos(dLon))) % 360.0
+
+        # Same ground distance on the 4/3 earth, then the slant range of the
+        # beam reaching it from the triangle of earth center, radar and cell
+        t = angle*earthRadius/effectiveRadius
+        up = numpy.cos(e+t)
+        slant = effectiveRadius*numpy.sin(t)/numpy.where(up > 0, up, 1.0)
+        gate = numpy.floor((slant-firstGate)/gateWidth).astype(numpy.int64)
+        ok = (up > 0) & (gate >= 0) & (gate < gates)
+        bearings[r0:r1] = bearing
+        gateIndex[r0:r1] = numpy.where(ok, gate, -1)
+    return (bearings, gateIndex)
+
+def getLayoutKey(rs):
+    """ Get a digest of the radial azimuths and spacings of a RadialSet """
+    h = hashlib.md5()
+    for values in (rs.getAzimuths(), rs.getAzimuthalSpacings()):
+        h.update(numpy.ascontiguousarray(values, numpy.float64).data)
+    return h.hexdigest()
+
+def computeIndexMap(polar, azimuth, spacing, gates):
+    """ Find the flat index radial*gates+gate of the gate covering each cell
+        for one scan's radials.
+        polar: (bearing, gate) from computePolarMap
+        azimuth, spacing: numpy arrays of each radial's start azimuth and
+        azimuthal spacing in degrees
+        Returns an int32 (rows, cols) array, -1 where no gate covers the cell """
+    bearings, gateIndex = polar
+
+    # Radials sorted by azimuth, so each cell can search for the one
+    # starting at or before its bearing
+    azimuth = numpy.asarray(azimuth, numpy.float64)
+    spacing = numpy.asarray(spacing, numpy.float64)
+    order = numpy.argsort(azimuth)
+    sortedAzimuth = azimuth[order]
+
+    rows = bearings.shape[0]
+    index = numpy.empty(bearings.shape, numpy.int32)
+    for r0 in range(0, rows, blockRows):
+        r1 = min(rows, r0+blockRows)
+        bearing = bearings[r0:r1]
+        gate = gateIndex[r0:r1]
+
+        # A bearing before the first radial wraps to the last one
+        at = numpy.searchsorted(sortedAzimuth, bearing, "right")-1
+        radial = order[at]
+        offset = (bearing-azimuth[radial]) % 360.0
+        ok = (gate >= 0) & (offset < spacing[radial])
+        index[r0:r1] = numpy.where(ok, radial*gates+gate, -1)
+    return index
+
+class ResampleCache(object):
+    def __init__(self, size=8, folder=None, maxBytes=defaultMaxBytes):
+        """ Cache of polar maps per radar geometry and index maps per
+            geometry and azimuth layout.
+            size: how many of each to keep in memory
+            folder: optional folder to save and load maps
+            maxBytes: size of the maps kept in the folder, the least
+                      recently used go first when it's over """
+        self.size = size
+        self.folder = folder
+        self.maxBytes = maxBytes
+        self.maps = OrderedDict()
+        self.indexMaps = OrderedDict()
+        self.lock = threading.Lock()
+
+    def getKey(self, rs, grid):
+        """ Get the cache key for the geometry of a RadialSet on a grid.
+            Only the site, elevation and gates, the azimuths change every
+            scan """
+        location = [repr(float(v)) for v in rs.getLocation()]
+        return tuple(location+[repr(float(rs.getElevation())),
+                               repr(float(rs.getRangeToFirstGate())),
+                               repr(float(rs.getGateWidths()[0])),
+                               int(rs.getNumGates())]+
+                     [repr(float(v)) for v in grid[:4]]+list(grid[4:]))
+
+    def getCacheFile(self, key):
+        """ Get the file location of a map in our cache folder """
+        name = hashlib.md5(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, "radial_"+name+".npz")
+
+    def getPolarMap(self, rs, grid):
+        """ Get the polar map of a RadialSet's geometry on a grid.  Computed
+            only the first time we see the geometry """
+        key = self.getKey(rs, grid)
+        polar = self.recall(self.maps, key)
+        if polar is None and self.folder:
+            polar = self.loadMap(key, ("bearing", "gate"))
+        if polar is None:
+            log.info("Computing radial polar map for a {0} by {1} grid".format(grid[4], grid[5]))
+            polar = computePolarMap(rs.getLocation(), rs.getElevation(),
+                                    rs.getRangeToFirstGate(), float(rs.getGateWidths()[0]),
+                                    rs.getNumGates(), grid)
+            if self.folder:
+                self.saveMap(key, bearing=polar[0], gate=polar[1])
+        self.remember(self.maps, key, polar)
+        return polar
+
+    def getIndexMap(self, rs, grid):
+        """ Get the index map of a RadialSet on a grid, see computeIndexMap.
+            Only worked out from the polar map when the azimuths aren't
+            the same as a scan we've seen """
+        key = self.getKey(rs, grid)+(getLayoutKey(rs),)
+        index = self.recall(self.indexMaps, key)
+        if index is None and self.folder:
+            index = self.loadMap(key, ("index",))
+            if index is not None:
+                index = index[0]
+        if index is None:
+            index = computeIndexMap(self.getPolarMap(rs, grid), rs.getAzimuths(),
+                                    rs.getAzimuthalSpacings(), rs.getNumGates())
+            if self.folder:
+                self.saveMap(key, index=index)
+        self.remember(self.indexMaps, key, index)
+        return index
+
+    def recall(self, maps, key):
+        """ Get a map we have in memory, or None.  Pipeline threads share a
+            cache, so the order is only changed under our lock """
+        with self.lock:
+            value = maps.pop(key, None)
+            if value is not None:
+                maps[key] = value
+            return value
+
+    def remember(self, maps, key, value):
+        """ Keep a map in memory.  Most recent goes on the end, oldest falls
+            off the front """
+        with self.lock:
+            maps[key] = value
+            while len(maps) > self.size:
+                maps.popitem(last=False)
+
+    def loadMap(self, key, names):
+        """ Load the named arrays of a map from our cache folder as a tuple,
+            or None if it isn't there.  Loading marks it used for the least
+            recently used order """
+        cacheFile = self.getCacheFile(key)
+        if not os.path.isfile(cacheFile):
+            return None
+        try:
+            f = numpy.load(cacheFile)
+            try:
+                arrays = tuple(f[name] for name in names)
+            finally:
+                f.close()
+            os.utime(cacheFile, None)
+        except (IOError, OSError, KeyError, ValueError) as e:
+            log.info("Couldn't load radial map {0}: {1}".format(cacheFile, e))
+            return None
+        return arrays
+
+    def saveMap(self, key, **arrays):
+        """ Save the named arrays of a map to our cache folder.  Batch
+            workers and threads can make the same map at the same time, so
+            write a temp file and move it into place, so nobody loads a half
+            written one """
+        cacheFile = self.getCacheFile(key)
+        temp = None
+        try:
+            if not os.path.isdir(self.folder):
+                os.makedirs(self.folder)
+            handle, temp = tempfile.mkstemp(".npz", ".radial", self.folder)
+            os.close(handle)
+            numpy.savez(temp, **arrays)
+            with self.lock:
+                if not os.path.isfile(cacheFile):
+                    os.rename(temp, cacheFile)
+        except (IOError, OSError) as e:
+            log.info("Couldn't save radial map to {0}: {1}".format(cacheFile, e))
+        if temp is not None and os.path.isfile(temp):
+            os.remove(temp)
+        self.evict()
+
+    def evict(self):
+        """ Drop the maps in our folder used longest ago until they're
+            under our size.  Maps saved by older versions go too """
+        with self.lock:
+            self.evictFiles()
+
+    def evictFiles(self):
+        """ Drop the oldest maps in our folder, see evict """
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.startswith("radial_") and (name.endswith(".npz") or name.endswith(".npy")):
+                path = os.path.join(self.folder, name)
+                try:
+                    entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+                except OSError:
+                    pass     # Another worker dropped it
+        entries.sort()
+        total = sum(e[1] for e in entries)
+        for used, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """ Forget all the maps we have in memory """
+        with self.lock:
+            self.maps.clear()
+            self.indexMaps.clear()
+
+# The cache used when resampling doesn't ask for its own
+defaultCache = ResampleCache(folder=w2res.getCacheDir())
+
+def resampleRadialSet(rs, cellSize=defaultCellSize, cache=None):
+    """ Resample a RadialSet to a LatLonGrid around the radar with the
+        given cell size in degrees.  Cells no gate covers are missing data.
+        Polar maps come from the given ResampleCache, or the default one """
+    if cache is None:
+        cache = defaultCache
+    grid = getRadialGrid(rs, cellSize)
+    index = cache.getIndexMap(rs, grid)
+
+    # Missing goes on the end of the data so the -1 of uncovered cells
+    # picks it up in the same gather
+    M = rs.getValues()
+    flat = numpy.empty(M.size+1, M.dtype)
+    flat[:-1] = M.ravel()
+    flat[-1] = datatype.missingData
+    llg = LatLonGrid(flat[index], grid[0], grid[1], grid[2], grid[3])
+    llg.setTypeName(rs.getTypeName())
+    llg.setTime(rs.getTime())
+    llg.setEpochTime(rs.getEpochTime())
+    llg.setFileName(rs.getFileName())
+    return llg
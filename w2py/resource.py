@@ -6,7 +6,7 @@ Keep track of the names/locations of any static resources we use, file types.
 @author: Robert Toomey (retoomey)
 '''
 
-import os
+import os, tempfile
 
 def getScriptDir():
     """ Get root location this script is running from. Found this example 
@@ -53,6 +53,19 @@ def getUSAMapLayer():
 def getTempFile(rootfolder, filename):
     """ Get a full temp file location given a rootfolder and name """
     return os.path.join(rootfolder, filename)   
+
+def getFastTempDir():
+    """ Get a memory backed (tmpfs) folder for temp files if this system
+        has one, otherwise None for the system default temp folder """
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return shm
+    return None
+
+def getCacheDir():
+    """ Get the location of our cache folder for things we compute once and
+        keep between runs.  Made by whoever saves there first """
+    return os.path.join(tempfile.gettempdir(), "w2pycache")
                     
 def getBaseMulti(filename):
     """ Turn something like 'C:/stuff/test.netcdf.gz' into 'test' """
@@ -0,0 +1,62 @@
+'''
+Shapefile utilities
+
+Read the outlines out of an ESRI shapefile without arcpy, so we can draw
+maps like our usa.shp on headless machines.  We only need the line work
+of polygon and polyline shapes, not the attributes.
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import struct
+import numpy
+
+# Shape types we can get lines from
+polyLineTypes = [3, 5, 13, 15, 23, 25]
+
+def readShapeSegments(filename):
+    """ Read every line segment of the polygon/polyline shapes in a
+        shapefile.  Returns a numpy array of shape (N, 4), each row a
+        segment of x0, y0, x1, y1 in the file's coordinates (lon/lat for
+        our maps) """
+    f = open(filename, "rb")
+    try:
+        content = f.read()
+    finally:
+        f.close()
+
+    # 100 byte header, file length is in 16 bit words
+    fileLength = struct.unpack(">i", content[24:28])[0]*2
+    shapeType = struct.unpack("<i", content[32:36])[0]
+    if shapeType not in polyLineTypes:
+        raise ValueError("Shapefile {0} isn't polygon or polyline, type is {1}".format(
+                         filename, shapeType))
+
+    segments = []
+    at = 100
+    while at < fileLength:
+        # Record header is big endian, content length in 16 bit words
+        length = struct.unpack(">i", content[at+4:at+8])[0]*2
+        record = at+8
+        at = record+length
+        if struct.unpack("<i", content[record:record+4])[0] not in polyLineTypes:
+            continue  # Null shape
+
+        # Type, bounding box, then the part starts and the points
+        numParts, numPoints = struct.unpack("<ii", content[record+36:record+44])
+        parts = numpy.frombuffer(content, "<i4", numParts, record+44)
+        points = numpy.frombuffer(content, "<f8", numPoints*2,
+                                  record+44+4*numParts).reshape((numPoints, 2))
+
+        # Segments join each point to the next, but not across parts
+        if numPoints < 2:
+            continue
+        joined = numpy.ones(numPoints-1, bool)
+        breaks = parts[1:]-1
+        joined[breaks[(breaks >= 0) & (breaks < numPoints-1)]] = False
+        segments.append(numpy.hstack((points[:-1], points[1:]))[joined])
+
+    if not segments:
+        return numpy.empty((0, 4), float)
+    return numpy.vstack(segments)
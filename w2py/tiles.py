@@ -0,0 +1,229 @@
+'''
+Web map tiles
+
+Cut a LatLonGrid into the 256 pixel z/x/y PNG tiles web maps use, in the
+Web Mercator projection, so a browser only loads the part of a CONUS grid
+it shows at the zoom it shows.
+
+In Web Mercator a pixel's latitude only depends on its row and its
+longitude on its column.  So the grid cell under every pixel of a zoom
+level comes from two index vectors, the grid row of each pixel row and
+the grid column of each pixel column.  We keep those per grid geometry and
+zoom, and a tile is one gather through its part of them.
+
+Tiles with no data aren't written, web maps show nothing for them.  Each
+frame keeps a digest of every tile's values, so a tile that didn't change
+from the frame before is linked to the old file instead of being drawn
+again.  The digests include the color map, so a restyled frame draws.  Tiles are drawn in a pool of threads, the gather, zlib and file
+writing let go of the python lock.
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import os, math, json, shutil, hashlib, threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import numpy
+
+# Imports from my library
+import log
+import w2py.render as w2render
+from w2py.datatype import datatype
+
+tileSize = 256
+maxLatitude = 85.0511287798     # Web Mercator stops here
+defaultZooms = range(3, 8)
+digestFile = "tiles.json"
+pngLevel = 1          # zlib level of tiles, compressing is most of drawing one
+
+def getTileX(lon, zoom):
+    """ Get the fractional tile column of a longitude at a zoom level """
+    return (lon+180.0)/360.0*(1 << zoom)
+
+def getTileY(lat, zoom):
+    """ Get the fractional tile row of a latitude at a zoom level """
+    lat = math.radians(max(-maxLatitude, min(maxLatitude, lat)))
+    return (1.0-math.log(math.tan(lat)+1.0/math.cos(lat))/math.pi)/2.0*(1 << zoom)
+
+def getGridBounds(llg):
+    """ Get the [west, south, east, north] of a LatLonGrid """
+    lon, lat = llg.getUpperLeft()
+    rows, cols = llg.shape
+    return [lon, lat-rows*llg.getCellSizeY(), lon+cols*llg.getCellSizeX(), lat]
+
+def computeTileIndex(grid, zoom):
+    """ Work out the grid rows and columns under the pixels of every tile
+        covering a grid at a zoom level.
+        grid: (lat, lon, dlat, dlon, rows, cols) with lat, lon upper left
+        Returns (x0, y0, rowIndex, colIndex).  x0, y0 is the first tile and
+        rowIndex, colIndex have the grid row of each pixel row and the grid
+        column of each pixel column from there on, -1 off the grid """
+    lat, lon, dlat, dlon, rows, cols = grid
+    n = 1 << zoom
+    x0 = int(getTileX(lon, zoom))
+    x1 = min(n-1, int(getTileX(lon+cols*dlon, zoom)))
+    y0 = int(getTileY(lat, zoom))
+    y1 = min(n-1, int(getTileY(lat-rows*dlat, zoom)))
+
+    # Pixel centers to longitudes and latitudes, then to grid cells
+    world = float(tileSize*n)
+    px = numpy.arange(x0*tileSize, (x1+1)*tileSize)+0.5
+    pixelLon = px/world*360.0-180.0
+    colIndex = numpy.floor((pixelLon-lon)/dlon).astype(numpy.int64)
+    colIndex[(colIndex < 0) | (colIndex >= cols)] = -1
+
+    py = numpy.arange(y0*tileSize, (y1+1)*tileSize)+0.5
+    pixelLat = numpy.degrees(numpy.arctan(numpy.sinh(numpy.pi*(1.0-2.0*py/world))))
+    rowIndex = numpy.floor((lat-pixelLat)/dlat).astype(numpy.int64)
+    rowIndex[(rowIndex < 0) | (rowIndex >= rows)] = -1
+    return (x0, y0, rowIndex, colIndex)
+
+class TileIndexCache(object):
+    def __init__(self, size=32):
+        """ Cache of tile index vectors per grid geometry and zoom level.
+            size: how many to keep, least recently used go first """
+        self.size = size
+        self.maps = OrderedDict()
+        self.lock = threading.Lock()
+
+    def getTileIndex(self, grid, zoom):
+        """ Get computeTileIndex of a grid at a zoom level, computed only the
+            first time we see the geometry.  Pipeline threads share a cache,
+            so the order is only changed under our lock """
+        key = tuple([repr(float(v)) for v in grid[:4]]+list(grid[4:])+[zoom])
+        with self.lock:
+            index = self.maps.pop(key, None)
+        if index is None:
+            index = computeTileIndex(grid, zoom)
+        with self.lock:
+            self.maps[key] = index
+            while len(self.maps) > self.size:
+                self.maps.popitem(last=False)
+        return index
+
+# The cache used when tiling doesn't ask for its own
+defaultCache = TileIndexCache()
+
+def getTileValues(values, index, x, y):
+    """ Gather the values of one tile, missing data off the grid """
+    x0, y0, rowIndex, colIndex = index
+    r = rowIndex[(y-y0)*tileSize:(y-y0+1)*tileSize]
+    c = colIndex[(x-x0)*tileSize:(x-x0+1)*tileSize]
+    tile = values[numpy.ix_(numpy.maximum(r, 0), numpy.maximum(c, 0))]
+    tile[r < 0, :] = datatype.missingData
+    tile[:, c < 0] = datatype.missingData
+    return tile
+
+def renderTile(tile, colorMap):
+    """ Color a tile of values as an RGBA image, clear where there's no data """
+    image = numpy.empty(tile.shape+(4,), numpy.uint8)
+    image[:, :, :3] = w2render.colorize(tile, colorMap)
+    image[:, :, 3] = numpy.where(tile > datatype.missingData, 255, 0)
+    return image
+
+def linkTile(old, new):
+    """ Make a tile the same file as one from another frame, a hard link
+        where we can so it takes no space """
+    if os.path.exists(new):
+        os.remove(new)
+    try:
+        os.link(old, new)
+    except (AttributeError, OSError):
+        shutil.copyfile(old, new)
+
+def readDigests(folder):
+    """ Read the tile digests of a frame, empty if it has none """
+    try:
+        f = open(os.path.join(folder, digestFile))
+        try:
+            return json.load(f)["tiles"]
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError, KeyError):
+        return {}
+
+def genTiles(llg, folder, zooms=defaultZooms, colorMap=None, previous=None, workers=4,
+             cache=None):
+    """ Write the z/x/y.png tiles of a LatLonGrid under a folder.
+        zooms: the zoom levels to make
+        colorMap: a render.ColorMap, the cloudcover one if None
+        previous: folder of a finished frame before, tiles that didn't
+                  change are linked to its files.  Only give one nothing
+                  else is writing or removing
+        workers: threads drawing tiles at the same time
+        cache: the TileIndexCache to use, the default one if None
+        Returns the number of tiles (drawn, linked, empty) """
+    if colorMap is None:
+        colorMap = w2render.getCloudCoverColorMap()
+    if cache is None:
+        cache = defaultCache
+    colorKey = colorMap.getKey().encode("utf-8")
+    old = {}
+    if previous:
+        old = readDigests(previous)
+
+    # Start the frame clean, so tiles that are empty now don't linger
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder)
+
+    values = llg.getValues()
+    lon, lat = llg.getUpperLeft()
+    grid = (lat, lon, llg.getCellSizeY(), llg.getCellSizeX())+tuple(values.shape)
+    work = []
+    for z in zooms:
+        index = cache.getTileIndex(grid, z)
+        x0, y0, rowIndex, colIndex = index
+        for y in range(y0, y0+len(rowIndex)//tileSize):
+            for x in range(x0, x0+len(colIndex)//tileSize):
+                work.append((z, x, y, index))
+
+    def makeTile(item):
+        z, x, y, index = item
+        tile = getTileValues(values, index, x, y)
+        if not (tile > datatype.missingData).any():
+            return None
+        name = "{0}/{1}/{2}".format(z, x, y)
+        h = hashlib.md5(colorKey)
+        h.update(numpy.ascontiguousarray(tile).data)
+        digest = h.hexdigest()
+        path = os.path.join(folder, str(z), str(x), str(y)+".png")
+        xFolder = os.path.dirname(path)
+        if not os.path.isdir(xFolder):
+            try:
+                os.makedirs(xFolder)
+            except OSError:
+                pass     # Another thread made it
+        if old.get(name) == digest:
+            oldPath = os.path.join(previous, str(z), str(x), str(y)+".png")
+            if os.path.isfile(oldPath):
+                linkTile(oldPath, path)
+                return (name, digest, False)
+        w2render.writePNG(path, renderTile(tile, colorMap), pngLevel)
+        return (name, digest, True)
+
+    digests = {}
+    drawn = 0
+    pool = ThreadPool(max(1, workers))
+    try:
+        for result in pool.imap_unordered(makeTile, work, 16):
+            if result is not None:
+                digests[result[0]] = result[1]
+                drawn += result[2]
+    finally:
+        pool.close()
+        pool.join()
+
+    # Remember what we made for the next frame and for the page
+    info = {"bounds":getGridBounds(llg), "minZoom":min(zooms), "maxZoom":max(zooms),
+            "tiles":digests}
+    f = open(os.path.join(folder, digestFile), "w")
+    try:
+        json.dump(info, f)
+    finally:
+        f.close()
+    linked = len(digests)-drawn
+    log.info("Wrote {0} tiles to {1}, {2} linked from the frame before, {3} empty".format(
+             drawn, folder, linked, len(work)-len(digests)))
+    return (drawn, linked, len(work)-len(digests))
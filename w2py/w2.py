@@ -10,35 +10,106 @@ For now, do lots of work here.  Some of this will migrate/separate later
 '''
 
 # System imports
-import arcpy, os, shutil, time
+import os, sys, shutil, gzip, multiprocessing, threading, time, collections, Queue
+import numpy
+
+# Arcpy is only needed for ArcGIS rasters and map output.  Without it we can
+# still read data files using one of the non arcpy netcdf readers
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
 
 # Local import (same folder)
 import log
 import w2py.resource as w2res
 import w2py.html as w2html
+import w2py.discover as w2discover
+import w2py.manifest as w2manifest
+import w2py.catalog as w2catalog
+import w2py.watch as w2watch
+import w2py.pipeline as w2pipeline
+import w2py.mosaic as w2mosaic
+import w2py.accumulate as w2accumulate
+import w2py.tiles as w2tiles
+import w2py.render as w2render
+import w2py.geotiff as w2tiff
+import w2py.gridcache as w2gridcache
+import w2py.resample as w2resample
 
 # Library folder imports
 from netcdf import netcdf_util
+from netcdf import netcdf_writer
 from w2py.datatype import datatype as datatype
+from w2py.datatype import overview as w2overview
+from w2py.datatype import gridstats as w2stats
 from w2py.datatype.latlongrid import LatLonGrid
+from w2py.datatype.radialset import RadialSet
+
+# Reload the reader module for every file.  Running in ArcGIS doesn't
+# reload python, turn this on when working on a reader there
+reloadReaders = False
+
+def haveLibrary(name):
+    """ Return True if we can import the given python library """
+    try:
+        __import__(name)
+        return True
+    except ImportError:
+        return False
+    
+def getAutoReader(datafile):
+    """ Pick the fastest netcdf library we have installed that can read 
+        the given file.  Memory mapped scipy is fastest for the classic 
+        netcdf WDSS2 writes, but only netCDF4 can read netcdf4/HDF5 files """
+    if datafile.endswith(".gz"):
+        f = gzip.GzipFile(datafile, 'rb')
+    else:
+        f = open(datafile, 'rb')
+    try:
+        magic = f.read(4)
+    finally:
+        f.close()
+    isHDF5 = magic.startswith(b"\x89HDF")
+    
+    if not isHDF5 and haveLibrary("scipy.io"):
+        return "SCIPY"
+    if haveLibrary("netCDF4"):
+        return "NETCDF4"
+    if not isHDF5 and haveLibrary("Scientific.IO.NetCDF"):
+        return "SCIENTIFIC"
+    return "ARCGIS"
 
 def getReader(datafile, net):  
     """ Get the netcdf reader we will use to injest our data"""
-    from netcdf import arcpy_netcdf_reader
-    from netcdf import sci_netcdf_reader
     
-    # Running in ArcGIS it doesn't reload python..this is for debuggng:
-    if (log.debug):
-        reload(arcpy_netcdf_reader)
-        reload(sci_netcdf_reader)
-        
-    if ("SCIENTIFIC" in net):
+    if (not net) or ("AUTO" in net):
+        net = getAutoReader(datafile)
+        log.info("Automatically picked the "+net+" netcdf parser")
+    
+    # Only import the library we use, the others might not be installed    
+    if ("SCIPY" in net):
+        from netcdf import scipy_netcdf_reader as reader
+        readerClass = "scipyNetcdfReader"
+        log.info("Using SCIPY memory mapped netcdf parser")
+    elif ("NETCDF4" in net):
+        from netcdf import netcdf4_netcdf_reader as reader
+        readerClass = "netcdf4NetcdfReader"
+        log.info("Using NETCDF4 netcdf parser")
+    elif ("SCIENTIFIC" in net):
+        from netcdf import sci_netcdf_reader as reader
+        readerClass = "sciNetcdfReader"
         log.info("Using SCIENTIFIC python netcdf parser")
-        return sci_netcdf_reader.sciNetcdfReader(datafile)
     else:
-        log.info("Using ArcGIS netcdf parser (slow)")
         # Using ArcGIS NetCD.  So slow..so very, very slow
-        return arcpy_netcdf_reader.arcpyNetcdfReader(datafile)
+        from netcdf import arcpy_netcdf_reader as reader
+        readerClass = "arcpyNetcdfReader"
+        log.info("Using ArcGIS netcdf parser (slow)")
+    
+    # Running in ArcGIS it doesn't reload python..this is for debuggng:
+    if reloadReaders:
+        reload(reader)
+    return getattr(reader, readerClass)(datafile)
 
 def genPNGFile(D, featureLocation, outHTMLFolder, outputPNGfile, asymboll=""):  
     """ Given one of our DataType objects, and a arcgis Feature file, output the feature as a PNG.
@@ -113,6 +184,58 @@ def genPNGFile(D, featureLocation, outHTMLFolder, outputPNGfile, asymboll=""):
     
     return workpng  
 
+def makePNGFile(D, featureLocation, outHTMLFolder, outputPNGfile, asymboll="",
+                renderer="ARCGIS", previewSize=None):
+    """ Make the PNG for one of our DataType objects with the chosen renderer.
+        NUMPY draws the grid directly without arcpy, using our cloudcover
+        colors, ARCGIS exports a map document using the symbology layer.
+        previewSize draws a NUMPY image from an overview about that many
+        pixels wide instead of one pixel per cell.
+        Return the full path to new image file"""
+    if "NUMPY" in renderer:
+        return w2render.genPNGFile(D, outHTMLFolder, outputPNGfile, width=previewSize)
+    return genPNGFile(D, featureLocation, outHTMLFolder, outputPNGfile, asymboll)
+
+def getRenderKey(symbols, renderer, tileZooms=None, previewSize=None):
+    """ Get what decides the look of a PNG and its tiles, for the manifest """
+    key = renderer
+    if not ("NUMPY" in renderer):
+        key = "{0}:{1}".format(renderer, symbols)
+    elif previewSize:
+        key += ":preview{0}".format(previewSize)
+    if tileZooms:
+        key += ":tiles{0}-{1}".format(min(tileZooms), max(tileZooms))
+    return key
+
+def getOverviewBase(rasterFolder, baseName, rasterFormat="ARCGIS"):
+    """ Get the path, without extension, of the saved overviews of a file.
+        They go next to a GeoTIFF, or next to the geodatabase since they 
+        aren't rasters ArcGIS knows """
+    if rasterFormat != "GEOTIFF":
+        rasterFolder = os.path.dirname(rasterFolder)
+    return os.path.abspath(os.path.join(rasterFolder, baseName))
+
+def getTileFolder(hFolder, baseName):
+    """ Get the folder of the web map tiles of a file's page """
+    return os.path.join(hFolder, "tiles", baseName)
+
+def getKnownStats(manifest, path, todo):
+    """ Get the grid statistics text the manifest has for a file whose page
+        is being made again, or None.  getWork only leaves the raster out
+        when the file's content is the one recorded """
+    if todo[0] or not todo[2]:
+        return None
+    record = manifest.getRecord(path)
+    return record and record["stats"]
+
+def getTilesFrom(manifest, prevPath, renderKey, hFolder, rendering):
+    """ Get the tile folder of the file before to link unchanged tiles from,
+        or None.  Only one the manifest says is finished with the same look,
+        and that isn't in rendering, the files being drawn again right now """
+    if not prevPath or (prevPath in rendering) or not manifest.isRendered(prevPath, renderKey):
+        return None
+    return getTileFolder(hFolder, w2html.genFileBase(prevPath))
+
 def writeArcPyRaster(llg, outputlocation):
     """ Write a arc python Raster given  LatLonGrid datatype.  For now,
         just keep this code here.  Eventually will create a separate arcpy library """ 
@@ -141,7 +264,171 @@ def writeArcPyRaster(llg, outputlocation):
         
     return myRaster
 
-def readSingleFileToRaster(datafile, output, net, htmlOn=False, symbols=None, hFolder=None):
+def writeRaster(llg, outputlocation, rasterFormat="ARCGIS"):
+    """ Write a LatLonGrid as a raster in the chosen format.  ARCGIS saves
+        an arcpy raster, GEOTIFF writes a GeoTIFF file without needing arcpy """
+    if rasterFormat == "GEOTIFF":
+        w2tiff.writeGeoTIFF(llg, outputlocation)
+        if arcpy is not None:
+            llg.setRaster(arcpy.Raster(outputlocation))
+        return outputlocation
+    return writeArcPyRaster(llg, outputlocation)
+
+def getRasterLocation(rasterFolder, baseName, rasterFormat="ARCGIS"):
+    """ Get where a batch puts the raster of a file.  ARCGIS rasters go in
+        our geodatabase, GEOTIFF ones are .tif files in the output folder """
+    if rasterFormat == "GEOTIFF":
+        baseName = baseName+".tif"
+    return os.path.abspath(os.path.join(rasterFolder, baseName))
+
+# Decoded grids are read from and saved to this GridCache when it's set
+gridCache = None
+
+def useGridCache(folder=None, maxBytes=w2gridcache.defaultMaxBytes):
+    """ Keep the grids of the files we read in an on-disk GridCache, so 
+        reading a file again is just memory mapping its grid.  folder None
+        uses our cache folder.  Returns the GridCache """
+    global gridCache
+    gridCache = w2gridcache.GridCache(folder, maxBytes)
+    log.info("Caching decoded grids in "+gridCache.folder)
+    return gridCache
+
+def readDataFile(datafile, net, lazy=False, dtype=numpy.float32, keepSparse=False,
+                 cache=None):
+    """ Read a data file into one of our DataType objects with the chosen
+        netcdf reader.  lazy reads just the header, leaving the grid to be
+        read on first use.  Scanning the time, type and size of lots of 
+        files is fast that way.  dtype is the type of the data matrix, 
+        None for the type stored in the file.  keepSparse reads sparse
+        grids as SparseLatLonGrids.  cache is the GridCache LatLonGrids
+        come from and go to, the useGridCache one if None.  A compressed
+        file can't be read a piece at a time, so a lazy one lets go of its
+        reader after the header and opens the file again for the grid """
+    if cache is None:
+        cache = gridCache
+    if keepSparse or dtype is None:
+        cache = None
+    if cache is not None:
+        D = cache.get(datafile, net, dtype)
+        if D is not None:
+            return D
+    reader = getReader(datafile, net)
+    D = netcdf_util.readNetcdfFile(reader, lazy, dtype, keepSparse)
+    if D != None:
+        D.setFileName(datafile)
+        if not D.isLoaded() and datafile.endswith(".gz"):
+            D.setLoader(lambda: netcdf_util.readNetcdfFile(getReader(datafile, net), True,
+                                                           dtype, keepSparse).loadData())
+        if cache is not None and isinstance(D, LatLonGrid):
+            cacheGrid(cache, datafile, net, D)
+    return D
+
+def cacheGrid(cache, datafile, net, llg):
+    """ Save a LatLonGrid to a GridCache, once its grid is read if that's
+        left for later """
+    if llg.isLoaded():
+        cache.put(datafile, net, llg)
+        return
+    loader = llg.loader
+    def load():
+        M = loader()
+        cache.put(datafile, net, llg, M)
+        return M
+    llg.setLoader(load)
+
+def writeDataFile(D, datafile, sparse=None):
+    """ Write one of our LatLonGrids or RadialSets as a WDSS2 netcdf file,
+        gzipped if the name ends in .gz.  sparse None writes runs or a 
+        dense grid, whichever is smaller """
+    return netcdf_writer.writeNetcdfFile(D, datafile, sparse)
+
+def readGridHeader(datafile, net):
+    """ Read the header of a data file's LatLonGrid without keeping the file
+        open.  Returns a LatLonGrid that reads the file again for its grid
+        when it's first used, or None if the file isn't a grid """
+    D = readDataFile(datafile, net, True)
+    if not isinstance(D, LatLonGrid):
+        return None
+    llg = LatLonGrid(None, D.getLat(), D.getLon(), D.getCellSizeY(), D.getCellSizeX(),
+                     D.shape)
+    llg.setTypeName(D.getTypeName())
+    llg.setTime(D.getTime())
+    llg.setEpochTime(D.getEpochTime())
+    llg.setSparse(D.isSparse())
+    llg.setFileName(datafile)
+    llg.setLoader(lambda: readDataFile(datafile, net).getValues())
+    return llg
+
+def mosaicFiles(datafiles, net, output=None, policy="max", weights=None):
+    """ Mosaic the LatLonGrids of a list of data files into one LatLonGrid
+        covering all of them, see w2py.mosaic for the policies.  output is a
+        .npy file to memory map the mosaic to, None keeps it in memory.
+        weights is a list with the weight of each file for the average.
+        All the headers are read first for the extent and time order, then 
+        each file is opened again, added and let go, so only one is open at
+        a time """
+    if weights is None:
+        weights = [1.0]*len(datafiles)
+    inputs = []
+    for f, w in zip(datafiles, weights):
+        D = readGridHeader(f, net)
+        if D is not None:
+            inputs.append((D.getEpochTime() or 0, f, D, w))
+        else:
+            log.info("Skipping non grid type for the mosaic: "+f)
+    inputs.sort()
+    
+    mosaic = w2mosaic.Mosaic(w2mosaic.getUnionGrid([i[2] for i in inputs]), policy, output)
+    for i in range(len(inputs)):
+        t, f, D, w = inputs[i]
+        inputs[i] = None
+        mosaic.add(D, w)
+        del D
+    return mosaic.getGrid()
+
+def readGrids(inFolder, net, typeName=None):
+    """ Yield the LatLonGrids of the files under a folder in time order, 
+        found the same way readMultipleFiles finds them.  typeName picks one
+        product.  Only the headers are read here, each file is opened again
+        for its grid when that's used, so only the one being used holds its
+        data if the caller lets go of each """
+    for f in w2discover.discoverFiles(inFolder):
+        try:
+            D = readGridHeader(f, net)
+        except Exception as e:
+            log.error("Got exception parsing file "+f)
+            log.error("Error is "+str(e.args))
+            continue
+        if D is not None and (typeName is None or D.getTypeName() == typeName):
+            yield D
+        del D     # Let go of it before reading the next one
+
+def accumulateFiles(inFolder, net, typeName, operation="max"):
+    """ Accumulate the LatLonGrids of one product under a folder into one
+        running max, min, sum or count LatLonGrid, see w2py.accumulate.
+        Returns None if there weren't any grids """
+    acc = None
+    for D in readGrids(inFolder, net, typeName):
+        if acc is None:
+            acc = w2accumulate.Accumulator(w2accumulate.getGridGeometry(D), operation)
+        acc.add(D)
+    if acc is None:
+        return None
+    return acc.getGrid()
+
+def accumulateWindow(inFolder, net, typeName, window, operation="max", panes=12):
+    """ Accumulate the LatLonGrids of one product under a folder over a
+        sliding window of window seconds, yielding (file, LatLonGrid) with
+        the accumulation up to each file as it's added """
+    acc = w2accumulate.SlidingAccumulator(window, operation, panes)
+    for D in readGrids(inFolder, net, typeName):
+        acc.add(D)
+        f = D.getFileName()
+        del D
+        yield (f, acc.getGrid())
+
+def readSingleFileToRaster(datafile, output, net, htmlOn=False, symbols=None, hFolder=None,
+                           renderer="ARCGIS", rasterFormat="ARCGIS"):
     """ Given a file location and an output location, 
         try to read it using the netcdf reader
         Everything here wraps through our interface so it will work 
@@ -151,19 +438,17 @@ def readSingleFileToRaster(datafile, output, net, htmlOn=False, symbols=None, hF
     
     # Get the reader from our netcdf module and read the file
     # into our 'datatype' class.  Then output to arcpy feature
-    reader = getReader(datafile, net)
-    D = netcdf_util.readNetcdfFile(reader)
-    if D != None:
-        D.setFileName(datafile)
+    D = readDataFile(datafile, net)
     
     # Current only LatLonGrids can output to raster...
-    # Most likely RadialSets will become polygon shapefiles or tables...etc...
-    # We will probably want a table injest function for radial sets..
+    # RadialSets are resampled to a LatLonGrid around the radar first
+    if isinstance(D, RadialSet):
+        D = w2resample.resampleRadialSet(D)
     
     newFeature = None
     if isinstance(D, LatLonGrid):
         # Create a new Raster feature for our LatLonGrid datatype
-        newFeature = writeArcPyRaster(D, output)
+        newFeature = writeRaster(D, output, rasterFormat)
         
         # Generate an HTML page for this Datatype, including our PNG file
         if htmlOn:
@@ -175,145 +460,495 @@ def readSingleFileToRaster(datafile, output, net, htmlOn=False, symbols=None, hF
             htmlName = baseName+".html"
             
             # Generate an PNG file page for this Raster
-            genPNGFile(D, output, hFolder, pngName, symbols)
+            makePNGFile(D, output, hFolder, pngName, symbols, renderer)
             w2html.genHTMLFile(D, hFolder, htmlName, pngName)
         
     else:
-        log.info(">>>>>>>>>>>>>>>Skipping generation for non LatLonGrid type.")
+        log.info(">>>>>>>>>>>>>>>Skipping generation for non grid type.")
         log.info("The type is "+str(type(D)))
     
 
     log.resetProgress()
     return newFeature
           
-def readMultipleFiles(inFolder, outFolder, net, htmlOn=False, symbols=None, hFolder=None):  
-    """ Given a input folder and output folder, try to read
-        every possible file in the tree, creating an equal converted
-        file """
+def outputExists(location):
+    """ Is an output still there?  Rasters in a geodatabase aren't files, so
+        ask arcpy about those """
+    if os.path.exists(location):
+        return True
+    return (arcpy is not None) and arcpy.Exists(location)
+
+def decodeFile(work):
+    """ First stage of converting a file: read it, resample a RadialSet and
+        decode the grid.  work is a dictionary with the batch 'job' tuple,
+        each stage adds to it.  'outputs' is left None when there's nothing
+        to do """
+    (f, rasterFolder, rasterFormat, net, htmlOn, symbols, renderer, hFolder, 
+     prevFile, nextFile, todo, tileZooms, previewSize, tilesFrom, stats) = work["job"]
+    doRaster, doPNG, doHTML = todo
+    work["D"] = None
+    work["outputs"] = None
+    if not any(todo):
+        return work
+    
+    # Get our DataType object from the file header, then the grid unless
+    # there's nothing that needs it.  A page alone, a PNG from the raster
+    # we have or a preview from saved overviews don't
+    D = readDataFile(f, net, True)
+    log.info("Successfully read file "+f)
+    if isinstance(D, RadialSet):
+        D = w2resample.resampleRadialSet(D)
+    work["outputs"] = {"isGrid":False, "raster":None, "png":None, "html":None,
+                       "prevFile":prevFile, "nextFile":nextFile, "stats":None}
+    if isinstance(D, LatLonGrid):
+        work["outputs"]["isGrid"] = True
+        if doRaster or (htmlOn and doPNG and (tileZooms or 
+                        ("NUMPY" in renderer and not previewSize))):
+            D.getValues()
+            
+            # The page's statistics while we have the values, the manifest
+            # keeps them for making the page again without decoding
+            if htmlOn:
+                work["outputs"]["stats"] = w2stats.dumpStats(D.getStats())
+        elif stats:
+            D.setStats(w2stats.loadStats(stats))
+        if previewSize:
+            D.setOverviewBase(getOverviewBase(rasterFolder, w2html.genFileBase(f),
+                                              rasterFormat))
+    else:
+        log.info(">>>>>>>>>>>>>>>Skipping generation for non grid type.")
+        log.info("The type is "+str(type(D)))
+    work["D"] = D
+    return work
+
+def writeFileRaster(work):
+    """ Stage writing the raster of a decoded file """
+    (f, rasterFolder, rasterFormat, net, htmlOn, symbols, renderer, hFolder, 
+     prevFile, nextFile, todo, tileZooms, previewSize, tilesFrom, stats) = work["job"]
+    doRaster, doPNG, doHTML = todo
+    D = work["D"]
+    if not isinstance(D, LatLonGrid):
+        return work
     
+    # We'll output the raster as a grid to the geodatabase we created,
+    # replacing characters that confuse ArcGIS. Tried making other files
+    # and had issues with rasters not coming out correct.  Our own 
+    # GeoTIFF writer doesn't need the geodatabase.
+    output = getRasterLocation(rasterFolder, w2html.genFileBase(f), rasterFormat)
+    log.info("Raster output location is "+output)
+
+    # Create a new Raster feature for our LatLonGrid datatype, unless
+    # the manifest says the one we have is up to date.  A raster that
+    # isn't in the manifest is stale, so replace it
+    if doRaster:
+        if rasterFormat != "GEOTIFF" and arcpy.Exists(output):
+            log.info("Replacing stale raster "+output)
+            arcpy.Delete_management(output)
+        writeRaster(D, output, rasterFormat)
+        
+        # Saved overviews are of the old data
+        w2overview.removeOverviews(getOverviewBase(rasterFolder, w2html.genFileBase(f),
+                                                   rasterFormat))
+    elif doPNG and not ("NUMPY" in renderer):
+        log.info("Raster is up to date, reading from cache: "+output)
+        r =arcpy.Raster(output)
+        D.setRaster(r)   
+    work["outputs"]["raster"] = output
+    return work
+
+def renderFile(work):
+    """ Stage rendering the PNG of a decoded file """
+    (f, rasterFolder, rasterFormat, net, htmlOn, symbols, renderer, hFolder, 
+     prevFile, nextFile, todo, tileZooms, previewSize, tilesFrom, stats) = work["job"]
+    if htmlOn and todo[1] and isinstance(work["D"], LatLonGrid):
+        log.info("Generating PNG file to "+hFolder)
+        baseName = w2html.genFileBase(f)
+        pngName = baseName+".png"
+        makePNGFile(work["D"], work["outputs"]["raster"], hFolder, pngName, symbols, renderer,
+                    previewSize)
+        work["outputs"]["png"] = w2res.getTempFile(hFolder, pngName)
+        
+        # Web map tiles for the page, reusing the unchanged tiles of the
+        # file before if it was finished already
+        if tileZooms:
+            w2tiles.genTiles(work["D"], getTileFolder(hFolder, baseName), tileZooms,
+                             previous=tilesFrom)
+    return work
+
+def writeFilePage(work):
+    """ Last stage of converting a file, writing its HTML page.  We let go 
+        of the data after, to keep ArcGIS memory getting too big """
+    (f, rasterFolder, rasterFormat, net, htmlOn, symbols, renderer, hFolder, 
+     prevFile, nextFile, todo, tileZooms, previewSize, tilesFrom, stats) = work["job"]
+    if htmlOn and todo[2] and isinstance(work["D"], LatLonGrid):
+        log.info("Generating HTML file to "+hFolder)
+        baseName = w2html.genFileBase(f)
+        htmlName = baseName+".html"
+        tiles = None
+        if tileZooms:
+            tiles = ("tiles/"+baseName, min(tileZooms), max(tileZooms))
+        stats = work["D"].getStats()
+        if work["outputs"]["stats"] is None:
+            work["outputs"]["stats"] = w2stats.dumpStats(stats)
+        w2html.genHTMLFile(work["D"], hFolder, htmlName, baseName+".png", "index.html",
+                           prevFile, nextFile, tiles, stats)
+        work["outputs"]["html"] = w2res.getTempFile(hFolder, htmlName)
+    work["D"] = None
+    return work
+
+# The steps of converting a file, in order, with the stage names
+convertStages = [("decode", decodeFile), ("raster", writeFileRaster),
+                 ("render", renderFile), ("page", writeFilePage)]
+
+def convertFile(job):
+    """ Convert one file of a batch to a raster, optionally with its PNG and
+        HTML page.  This runs in a worker process when converting in 
+        parallel, so it takes one tuple of everything it needs and returns
+        what the batch needs for the manifest and index: (file, outputs, 
+        error).  outputs is the dictionary Manifest.record takes, or None 
+        if there was nothing to do.  error is None on success """
+    # Normally not good to catch all exceptions, but we want to keep going when
+    # there's a big batch job, so we'll allow it here, but show the reason for the error.
+    work = {"job":job}
+    try:
+        for name, stage in convertStages:
+            work = stage(work)
+    except Exception as e:
+        return (job[0], None, str(e.args))
+    return (job[0], work["outputs"], None)
+
+def convertPipeline(jobs, stageThreads):
+    """ Convert files in a Pipeline of the convertStages, giving the same
+        (file, outputs, error) as convertFile in the same order.  
+        stageThreads is a dictionary of thread counts by stage name, one 
+        thread for those not in it """
+    pipeline = w2pipeline.Pipeline([w2pipeline.Stage(name, stage, stageThreads.get(name, 1))
+                                    for name, stage in convertStages])
+    for work, error in pipeline.run({"job":job} for job in jobs):
+        if error:
+            yield (work["job"][0], None, error)
+        else:
+            yield (work["job"][0], work["outputs"], None)
+    pipeline.report()
+          
+def batchJobs(files, rasterFolder, rasterFormat, net, htmlOn, symbols, renderer, hFolder,
+              manifest, tileZooms=None, previewSize=None, rendering=None):
+    """ Make the convertFile work for each file as the files come in.  We
+        look one file ahead for the next link.  The links don't wrap around
+        at the ends, since the last file isn't known until the first one
+        is already done.  The index page is there for that.  The manifest
+        tells us what is already made for each file.  Files getting a new
+        PNG are added to the rendering set, the caller takes them out once
+        they're recorded """
+    renderKey = getRenderKey(symbols, renderer, tileZooms, previewSize)
+    if rendering is None:
+        rendering = set()
+    def job(f, prevPath, nextFile):
+        prevFile = ""
+        if prevPath:
+            prevFile = w2html.genFileBase(prevPath)
+        raster = getRasterLocation(rasterFolder, w2html.genFileBase(f), rasterFormat)
+        todo = manifest.getWork(f, net, renderKey, htmlOn, prevFile, nextFile, raster,
+                                outputExists)
+        tilesFrom = None
+        if tileZooms and todo[1]:
+            tilesFrom = getTilesFrom(manifest, prevPath, renderKey, hFolder, rendering)
+            rendering.add(f)
+        return (f, rasterFolder, rasterFormat, net, htmlOn, symbols, renderer, hFolder, 
+                prevFile, nextFile, todo, tileZooms, previewSize, tilesFrom,
+                getKnownStats(manifest, f, todo))
+        
+    prevPath = None
+    current = None
+    for f in files:
+        if current is not None:
+            nextFile = w2html.genFileBase(f)
+            yield job(current, prevPath, nextFile)
+            prevPath = current
+        current = f
+    if current is not None:
+        yield job(current, prevPath, "")
+          
+def getRasterFolder(outFolder, rasterFormat):
+    """ Get where a batch puts its rasters, making the geodatabase if needed """
     # We'll create a geodatabase in the output folder to stick all features
     # in.  The way ArcToolbox parameters handles this stuff is really bad design.
-    gdbpath = os.path.abspath(os.path.join(outFolder, "thedatafiles.gdb"))
-    if not os.path.exists(gdbpath):
+    if rasterFormat == "GEOTIFF":
+        return os.path.abspath(outFolder)
+    rasterFolder = os.path.abspath(os.path.join(outFolder, "thedatafiles.gdb"))
+    if not os.path.exists(rasterFolder):
         arcpy.CreateFileGDB_management(outFolder, "thedatafiles.gdb")
-    log.info("Using geodatabase at "+gdbpath)
-    
-    # Create the index.html file.  This will be a table of contents for the datafiles
+    log.info("Using geodatabase at "+rasterFolder)
+    return rasterFolder
+
+def openHTMLIndex(hFolder):
+    """ Create the index.html file.  This will be a table of contents for 
+        the datafiles, the caller adds a list item per page """
+    outHTMLindex = open(os.path.abspath(os.path.join(hFolder, "index.html")), "w")
+    w2html.genHTMLHeader(outHTMLindex, "Table of Contents")
+    outHTMLindex.write("This is a table of contents of all data files<br>\n<ul>\n")
+    return outHTMLindex
+
+def closeHTMLIndex(outHTMLindex):
+    """ Finish the index.html file """
+    outHTMLindex.write("</ul>\n")
+    w2html.genHTMLFooter(outHTMLindex)
+
+def startWorker(gridCacheSettings):
+    """ Set up a worker process of startPool.  Workers started fresh, like
+        on Windows, don't have our settings, so use the same grid cache """
+    if gridCacheSettings is not None:
+        useGridCache(*gridCacheSettings)
+
+def startPool(workers):
+    """ Start a pool of worker processes for converting files """
+    log.info("Converting with {0} worker processes".format(workers))
+    if log.haveArcpy:
+        # Inside ArcGIS the executable is ArcMap, workers need real python
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, "pythonw.exe"))
+    gridCacheSettings = None
+    if gridCache is not None:
+        gridCacheSettings = (gridCache.folder, gridCache.maxBytes)
+    return multiprocessing.Pool(workers, startWorker, (gridCacheSettings,))
+
+def convertInPool(pool, jobs, limit):
+    """ Convert files in a pool, giving the same (file, outputs, error) as
+        convertFile in the same order.  At most limit files are handed to
+        the pool at once, so the jobs are only made as the pool gets to
+        them and files still being found wait in their folders """
+    running = collections.deque()
+    for job in jobs:
+        if len(running) >= limit:
+            yield running.popleft().get()
+        running.append(pool.apply_async(convertFile, (job,)))
+    while running:
+        yield running.popleft().get()
+
+def readMultipleFiles(inFolder, outFolder, net, htmlOn=False, symbols=None, hFolder=None,
+                      workers=1, renderer="ARCGIS", rasterFormat="ARCGIS", query=None,
+                      stageThreads=None, tileZooms=None, previewSize=None):  
+    """ Given a input folder and output folder, try to read
+        every possible file in the tree, creating an equal converted
+        file.  workers is the number of processes converting files at
+        the same time.  rasterFormat ARCGIS makes geodatabase rasters,
+        GEOTIFF makes .tif files without arcpy.  A manifest in the output 
+        folder remembers what was made, so running again only converts new
+        or changed files.
+        query is a dictionary of Catalog.query filters, like 
+        {"typeName":"MergedReflectivityQC"}.  When given, the files come from
+        a catalog in the output folder instead of a scan of the tree.  The
+        catalog only reads the headers of new or changed files.
+        stageThreads runs one file's decode, raster, render and page stages 
+        at the same time as other files' stages, with the thread count of 
+        each stage in a dictionary like {"decode":2, "render":2}.  A report 
+        of each stage's throughput is logged at the end.  It's used instead 
+        of worker processes.
+        tileZooms is a list of zoom levels to make web map tiles for, the
+        pages then show the grid on a slippy map.
+        previewSize makes NUMPY images about that many pixels wide from an
+        overview of the grid, instead of a pixel per cell.  The overviews
+        are saved next to the rasters """
+    rasterFolder = getRasterFolder(outFolder, rasterFormat)
+    manifest = w2manifest.Manifest(outFolder)
+    renderKey = getRenderKey(symbols, renderer, tileZooms, previewSize)
+    rendering = set()
     if htmlOn:
-        indexLocation = os.path.join(hFolder, "index.html")
-        outHTMLindex = os.path.abspath(indexLocation)
-        outHTMLindex = open(outHTMLindex, "w")
-        w2html.genHTMLHeader(outHTMLindex, "Table of Contents")
-        outHTMLindex.write("This is a table of contents of all data files<br>\n<ul>\n")
+        outHTMLindex = openHTMLIndex(hFolder)
         
-    # First walk to gather all possible files and sort them
-    # This could be a memory pig for large collections of files, but makes our index
-    # and prev/next html link generation a lot easier..
-    fileCount = 0
-    filelist = []
-    maxFiles = 10000  # Allow breaking out after a certain number of files...
-    for dir, sub, files in os.walk(inFolder):
-        for f in files:
-            
-            # Get the full path and see if it ends in a handled extension type (netcdf)
-            absPath = os.path.abspath(os.path.join(dir, f))
-            if w2res.isHandledFileType(absPath):
-                fileCount += 1
-                filelist.append(absPath)
-                if fileCount >= maxFiles:
-                    break
-        if fileCount >= maxFiles: 
-            break
-    filelist.sort()
-    log.info("File count size is "+str(len(filelist)))   
+    # Files stream in time order as they are discovered, so the work 
+    # starts without gathering the whole tree first.  A catalog query
+    # gives them in time order too
+    if query is None:
+        files = w2discover.discoverFiles(inFolder)
+    else:
+        catalog = w2catalog.Catalog(outFolder)
+        catalog.update(inFolder, lambda f: readDataFile(f, net, True))
+        files = catalog.getFiles(folder=inFolder, **query)
+        catalog.close()
+    jobs = batchJobs(files, rasterFolder, rasterFormat, net, htmlOn, symbols, renderer,
+                     hFolder, manifest, tileZooms, previewSize, rendering)
          
     # Now march each file and try to convert...
+    # Results come back in file order either way, so the index is the same
     # FIXME: How to check if user pressed Cancel button?            
-    log.setStepProgress("Files", 0, fileCount, 1)
-    #c = 1
-    for c, f in enumerate(filelist):
-        #for f in files:
-        log.setProgressLabel("Handling {0}, file {1}/{2}".format(f, c+1, fileCount))
-        #c += 1
- 
-
-        try:                
-            # Get NetCDF reader for this file and get our DataType object
-            reader = getReader(f, net)
-            D = netcdf_util.readNetcdfFile(reader)
-            if D != None:
-                D.setFileName(f)
-            log.info("Successfully read file "+f)
-            
-            if isinstance(D, LatLonGrid):
-                
-                # Make a safe base filename for HTML/PNG and Raster generation
-                baseName = w2html.genFileBase(f)
-                
-                # We'll output the raster as a grid to the geodatabase we created,
-                # replacing characters that confuse ArcGIS. Tried making other files
-                # and had issues with rasters not coming out correct.
-                output = os.path.abspath(os.path.join(gdbpath, baseName))
-                log.info("Raster output location is "+output)
-            
-                # Create a new Raster feature for our LatLonGrid datatype
-                # For now, only write a new one if it doesn't exist.  Eventually
-                # should respect the overwrite environment
-                ex = arcpy.Exists(output)
-                if ex:
-                    log.info("Raster already exists, reading from cache: "+output)
-                    r =arcpy.Raster(output)
-                    D.setRaster(r)   
-                else:
-                    writeArcPyRaster(D, output)
-                
-                # Generate an HTML page for this Datatype, including our PNG file
-                if htmlOn:
-                    log.info("Generating PNG and HTML files to "+hFolder)
-                
-                    # Get a generated output file names for HTML and PNG
-                    pngName = baseName+".png"
-                    htmlName = baseName+".html"
-                    
-                    # Generate navigation links that cycle...
-                    # prev page in our HTML file collection
-                    if (c - 1) >= 0:
-                        prevFile = w2html.genFileBase(filelist[c-1])
-                    else:
-                        prevFile = w2html.genFileBase(filelist[len(filelist)-1])
-                         
-                    # next page in our HTML file collection
-                    if (c + 1) < len(filelist):
-                        nextFile = w2html.genFileBase(filelist[c+1])
-                    else:
-                        nextFile = w2html.genFileBase(filelist[0])
-                        
-                    # Generate an PNG file page for this Raster
-                    genPNGFile(D, output, hFolder, pngName, symbols)
-                    w2html.genHTMLFile(D, hFolder, htmlName, pngName, "index.html",
-                                       prevFile, nextFile)
-                    
-                    shortName = os.path.basename(f)
-                    w2html.genHTMLListItem(outHTMLindex, htmlName, shortName)
-                
-                # Delete the netcdf and raster files to keep ArcGIS memory getting too big
-                del D
-            else:
-                log.info(">>>>>>>>>>>>>>>Skipping generation for non LatLonGrid type.")
-                log.info("The type is "+str(type(D)))
-            
-            del reader
-                
-        # Normally not good to catch all exceptions, but we want to keep going when
-        # there's a big batch job, so we'll allow it here, but show the reason for the error.
-        except Exception as e:
-            log.error("Got exception parsing file "+absPath)
-            log.error("Error is "+str(e.args))
-            
+    pool = None
+    if stageThreads is not None:
+        results = convertPipeline(jobs, stageThreads)
+    elif workers > 1:
+        pool = startPool(workers)
+        results = convertInPool(pool, jobs, 2*workers)
+    else:
+        results = (convertFile(job) for job in jobs)
+        
+    # We don't know the file count until we're done, so no step progress
+    log.setDefaultProgress("Converting files...")
+    fileCount = 0
+    for c, (f, outputs, error) in enumerate(results):
+        fileCount = c+1
+        log.setProgressLabel("Handled {0}, file {1}".format(f, fileCount))
+        if error:
+            log.error("Got exception parsing file "+f)
+            log.error("Error is "+error)
+        else:
+            # Record right away, so a crash doesn't lose finished work.  A
+            # file that failed stays in rendering, nothing links its tiles
+            if outputs is not None:
+                manifest.record(f, net, renderKey, outputs)
+            rendering.discard(f)
+            record = manifest.getRecord(f)
+            if htmlOn and record["html"]:
+                htmlName = os.path.basename(record["html"])
+                shortName = os.path.basename(f)
+                w2html.genHTMLListItem(outHTMLindex, htmlName, shortName)
         log.setProgressPosition()
-        time.sleep(0.5)      
+        
+    if pool:
+        pool.close()
+        pool.join()
+    log.info("File count size is "+str(fileCount))   
+    manifest.close()
     log.resetProgress()
     
     if htmlOn:
-        outHTMLindex.write("</ul>\n")
-        w2html.genHTMLFooter(outHTMLindex)
+        closeHTMLIndex(outHTMLindex)
+
+class Finished(object):
+    """ A result we already have, looking like one still coming from a pool """
+    def __init__(self, result):
+        self.result = result
+        
+    def ready(self):
+        return True
+    
+    def get(self):
+        return self.result
+
+def watchFolders(inFolders, outFolder, net, htmlOn=False, symbols=None, hFolder=None,
+                 workers=1, renderer="ARCGIS", rasterFormat="ARCGIS", interval=0.25,
+                 settle=0.5, queueSize=16, stop=None, tileZooms=None, previewSize=None):
+    """ Keep converting data files as they show up in a list of input 
+        folders, the same way readMultipleFiles does, until stop (a 
+        threading.Event) is set or Ctrl-C.  Files already there go first, 
+        the manifest skips the ones done before.
+        A watcher thread polls every interval seconds and hands files over
+        once they've been the same for settle seconds, so we don't read one 
+        still being written.  It waits when queueSize files are waiting to
+        be converted, and at most two files per worker are converting at 
+        once, so falling behind doesn't use up memory.
+        Each page links back to the file before it in the same folder, and
+        that page is made again to link forward.  The index gets a line as
+        each page is published """
+    rasterFolder = getRasterFolder(outFolder, rasterFormat)
+    manifest = w2manifest.Manifest(outFolder)
+    renderKey = getRenderKey(symbols, renderer, tileZooms, previewSize)
+    if htmlOn:
+        outHTMLindex = openHTMLIndex(hFolder)
+    if stop is None:
+        stop = threading.Event()
+    
+    # Watch in our own thread, waiting on a full queue holds up new files
+    # in their folders instead of in memory
+    watcher = w2watch.FolderWatcher(inFolders, settle)
+    waiting = Queue.Queue(queueSize)
+    def watch():
+        while not stop.is_set():
+            for f in watcher.poll():
+                while not stop.is_set():
+                    try:
+                        waiting.put((f, time.time()), True, interval)
+                        break
+                    except Queue.Full:
+                        pass
+            stop.wait(interval)
+    thread = threading.Thread(target=watch)
+    thread.daemon = True
+    thread.start()
+    
+    pool = None
+    if workers > 1:
+        pool = startPool(workers)
+    running = collections.deque()
+    newest = {}    # folder -> path of the newest file converted in it
+    rendering = set()   # files getting a new PNG and tiles, see batchJobs
+    
+    def submit(f, prevFile, nextFile, prevPath, isNew, seen):
+        """ Start converting a file with its page links.  prevPath is the
+            file before it, its page links forward once this one is done """
+        raster = getRasterLocation(rasterFolder, w2html.genFileBase(f), rasterFormat)
+        todo = manifest.getWork(f, net, renderKey, htmlOn, prevFile, nextFile, raster,
+                                outputExists)
+        tilesFrom = None
+        if tileZooms and todo[1]:
+            tilesFrom = getTilesFrom(manifest, prevPath, renderKey, hFolder, rendering)
+            rendering.add(f)
+        job = (f, rasterFolder, rasterFormat, net, htmlOn, symbols, renderer, hFolder,
+               prevFile, nextFile, todo, tileZooms, previewSize, tilesFrom,
+               getKnownStats(manifest, f, todo))
+        if pool:
+            result = pool.apply_async(convertFile, (job,))
+        else:
+            result = Finished(convertFile(job))
+        running.append((result, prevPath, isNew, seen))
+    
+    def finish(result, prevPath, isNew, seen):
+        """ Record a converted file, list its page and link the page before
+            it forward.  Called in the order the files were started, so the
+            page before is always finished first """
+        f, outputs, error = result.get()
+        if error:
+            log.error("Got exception parsing file "+f)
+            log.error("Error is "+error)
+            return
+        if outputs is not None:
+            manifest.record(f, net, renderKey, outputs)
+        rendering.discard(f)
+        if not isNew:
+            return
+        record = manifest.getRecord(f)
+        if htmlOn and record["html"]:
+            w2html.genHTMLListItem(outHTMLindex, os.path.basename(record["html"]),
+                                   os.path.basename(f))
+            outHTMLindex.flush()
+            prevRecord = prevPath and manifest.getRecord(prevPath)
+            if prevRecord:
+                submit(prevPath, prevRecord["prevFile"] or "", w2html.genFileBase(f), None, 
+                       False, seen)
+        log.info("Published {0} {1:.2f} seconds after it was ready".format(f, 
+                 time.time()-seen))
+    
+    log.info("Watching {0} for new files".format(", ".join(inFolders)))
+    try:
+        while not stop.is_set():
+            
+            # Finish what's done, waiting on the oldest when too many are going
+            while running and (running[0][0].ready() or len(running) >= 2*workers):
+                finish(*running.popleft())
+            # Look back at what's running often, so pages go out right away
+            try:
+                f, seen = waiting.get(True, 0.02 if running else interval)
+            except Queue.Empty:
+                continue
+            
+            # A page made before keeps its forward link, a new one has none
+            # until the next file shows up
+            folder = os.path.dirname(f)
+            prevPath = newest.get(folder)
+            newest[folder] = f
+            prevFile = ""
+            if prevPath:
+                prevFile = w2html.genFileBase(prevPath)
+            record = manifest.getRecord(f)
+            nextFile = (record and record["nextFile"]) or ""
+            submit(f, prevFile, nextFile, prevPath, True, seen)
+    except KeyboardInterrupt:
+        log.info("Stopping, finishing the files already started")
+    stop.set()
+    while running:
+        finish(*running.popleft())
+        
+    if pool:
+        pool.close()
+        pool.join()
+    manifest.close()
+    if htmlOn:
+        closeHTMLIndex(outHTMLindex)
@@ -0,0 +1,107 @@
+'''
+Folder watching
+
+Find data files as they show up in folders being written to, like the
+output folders of a running WDSS2 system.  We poll, since that works
+everywhere including network drives, but keep it cheap: a folder's
+modification time only changes when files are added, removed or renamed in
+it, so each poll is one stat per folder and only changed folders are listed.
+The tree is never walked again after the first look.
+
+A new file might still be being written.  We hand it out once its size and
+modification time haven't changed for a settle time.
+
+@author: Robert Toomey (retoomey)
+'''
+
+# System import
+import os, time
+
+# Imports from my library
+import w2py.resource as w2res
+import w2py.discover as w2discover
+
+class FolderWatcher(object):
+    def __init__(self, folders, settle=0.5, existing=True):
+        """ Watch folder trees for new data files.
+            folders: list of root folders to watch, subfolders included
+            settle: seconds a file has to stay the same before it's ready
+            existing: hand out the files already there too, oldest first
+        """
+        self.roots = [os.path.abspath(f) for f in folders]
+        self.settle = settle
+        self.folders = {}    # folder -> modification time when last listed
+        self.files = {}      # folder -> set of file names seen in it
+        self.pending = {}    # path -> ((size, mtime), time first seen that way)
+        for r in self.roots:
+            self.listFolder(r)
+        if not existing:
+            self.pending.clear()
+
+    def listFolder(self, folder):
+        """ Look for new files and folders in a folder, watching new folders
+            and everything under them.  The time is taken before listing, so
+            anything showing up while we list changes the time again and 
+            we'll look again next poll """
+        try:
+            mtime = os.stat(folder).st_mtime
+            names = os.listdir(folder)
+        except OSError:
+            self.removeFolder(folder)
+            return
+        self.folders[folder] = mtime
+        seen = self.files.setdefault(folder, set())
+        current = set()
+        for n in names:
+            path = os.path.join(folder, n)
+            if os.path.isdir(path):
+                if path not in self.folders:
+                    self.listFolder(path)
+            elif w2res.isHandledFileType(path):
+                current.add(n)
+                if n not in seen:
+                    self.pending[path] = (None, 0)
+
+        # Forget files that went away, so one written again counts as new
+        for n in seen - current:
+            self.pending.pop(os.path.join(folder, n), None)
+        self.files[folder] = current
+
+    def removeFolder(self, folder):
+        """ Stop watching a folder that went away, and all under it """
+        under = os.path.join(folder, "")
+        for d in [d for d in self.folders if d == folder or d.startswith(under)]:
+            del self.folders[d]
+            for n in self.files.pop(d, ()):
+                self.pending.pop(os.path.join(d, n), None)
+
+    def poll(self):
+        """ Check for changes and return the paths of files that are ready,
+            in time order """
+        for folder, mtime in list(self.folders.items()):
+            if folder not in self.folders:
+                continue     # Removed along with its parent this poll
+            try:
+                changed = os.stat(folder).st_mtime != mtime
+            except OSError:
+                self.removeFolder(folder)
+                continue
+            if changed:
+                self.listFolder(folder)
+
+        now = time.time()
+        ready = []
+        for path, (last, since) in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            look = (st.st_size, st.st_mtime)
+            if look != last:
+                self.pending[path] = (look, now)
+            elif now - since >= self.settle:
+                del self.pending[path]
+                ready.append(path)
+        ready.sort(key=w2discover.getFileTimeKey)
+        return ready